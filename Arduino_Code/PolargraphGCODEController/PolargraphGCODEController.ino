@@ -7,6 +7,7 @@ https://github.com/Joeshmoe16/GCODE_Plotter_Polargraph.git
 #include "AFMotor.h"
 #include <Servo.h>
 #include <string.h>
+#include <util/crc16.h>
 
 #define ESTOP_BTN 22 
 #define DEFAULT_SPEED 25
@@ -78,6 +79,36 @@ long lastInteractionTime = 0L;
 #define OUT_CMD_SYNC_STR "SYNC,"
 #define ESTOP_PRESSED "ESTOP_PRESSED"
 #define COMMAND_COMPLETE "CMD_COMPLETE"
+#define STREAM_STR "STREAM,"
+#define ACK_STR "ACK,"
+#define NAK_STR "NAK,"
+
+// Streaming * * * * * * * * * * 
+// Number of commands that can wait in the ring buffer while another command runs
+#define STREAM_SLOTS 8
+// Sequence numbers count 0-255 then wrap
+#define STREAM_SEQ_MOD 256
+const char STREAM_FRAME_START = 'S';
+
+boolean streamMode = false;
+char streamRing[STREAM_SLOTS][INLENGTH+1];
+byte streamRingSeq[STREAM_SLOTS];
+byte streamRingHead = 0;
+byte streamRingCount = 0;
+// line being received in stream mode, it can arrive while a command is running
+char streamLine[INLENGTH+1];
+int streamLinePos = 0;
+boolean streamLineOverflow = false;
+int streamExpectedSeq = 0;
+
+// Binary frames, asked for with "C17,<window>,1,END". Each frame is
+// sync, seq, opcode (the number of the Cxx command), 4 params as int16 little endian in 0.1mm, CRC-16/CCITT (high byte first)
+// The CRC (poly 0x1021, start 0xFFFF) covers seq, opcode and the params.
+#define BINARY_FRAME_SYNC 0xA5
+#define BINARY_FRAME_LENGTH 13
+boolean streamBinary = false;
+byte binaryFrame[BINARY_FRAME_LENGTH];
+byte binaryFramePos = 0;
 
 const static char MSG_E_STR[] = "MSG,E,";
 const static char CHECKED[] = "CHECKED";
@@ -100,6 +131,8 @@ const static char CMD_ENABLE_USER_INPUT[] = "C13";
 const static char CMD_DISABLE_USER_INPUT[] = "C14";
 const static char CMD_TEST_GCODE[] = "C15";
 const static char CMD_SET_HOME_POS[] = "C16";
+const static char CMD_STREAM[] = "C17"; //Starts streaming mode with param window size, 0 stops it, param 2 is 1 for binary frames. ex.) "C17,8,END\r\n" replies "STREAM,8", "C17,8,1,END\r\n" replies "STREAM,8,1"
+const static char CMD_POLYLINE[] = "C18"; //Linear moves through several points, params are pairs of X, Y offsets in 0.01mm from the point before ex.) "C18,250,-120,248,-130,END\r\n"
 const static char CMD_SET_ABSOLUTE_POS[] = "C90";
 const static char CMD_SET_RELATIVE_POS[] = "C91";
 
@@ -136,6 +169,12 @@ void setup() {
 }
 
 void loop() {
+  if (streamMode){
+    // Commands are framed with sequence numbers and acknowledged, no echo or CHECKED
+    comms_streamLoop();
+    return;
+  }
+
   //Wait for new command
   if (comms_waitForNextCommand(newCommand)) 
   {
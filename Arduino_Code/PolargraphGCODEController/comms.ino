@@ -268,5 +268,203 @@ void comms_ready()
   Serial.println(F(READY_STR));
 }
 
+/*
+Streaming mode.
 
+Started by the host with "C17,<window>,END" using the normal handshake, the reply "STREAM,<slots>" tells the host
+how many commands it may have in flight. Old firmware ignores C17, so the host sees no reply and keeps using the handshake.
+
+In streaming mode every command is framed as "S<seq>,<command>\n", ex.) "S12,C01,10.0,-20.0,END\n".
+Frames are stored in a ring buffer as they arrive, even while a command is running, and are run in order.
+After a command runs "ACK,<seq>" is sent. A frame with the wrong sequence number, or that arrives when the ring
+buffer is full, is dropped and "NAK,<expected seq>" is sent so the host resends from that frame.
+"S<seq>,C17,0,END" leaves streaming mode. An ESTOP also leaves streaming mode and clears the ring buffer.
+
+With "C17,<window>,1,END" frames are binary instead (see BINARY_FRAME_LENGTH), and the reply is "STREAM,<slots>,1".
+A binary frame is turned back into a command string, ex.) "C01,10.0,-20.0,0.0,0.0,END", and stored in the ring buffer.
+A frame with a bad CRC is dropped and "NAK,<expected seq>" is sent. ACK and NAK are the same as text frames.
+*/
+
+void comms_setStreamMode(int window, boolean binary)
+{
+  streamRingHead = 0;
+  streamRingCount = 0;
+  streamLinePos = 0;
+  streamLineOverflow = false;
+  streamExpectedSeq = 0;
+  binaryFramePos = 0;
+  streamMode = (window > 0);
+  streamBinary = streamMode && binary;
+  if (streamMode){
+    Serial.print(F(STREAM_STR));
+    if (streamBinary){
+      Serial.print(STREAM_SLOTS);
+      Serial.println(F(",1"));
+    }
+    else{
+      Serial.println(STREAM_SLOTS);
+    }
+  }
+}
+
+void comms_streamLoop()
+{
+  long idleTime = millis();
+  while (streamMode)
+  {
+    comms_streamPoll();
+    util_runBackgroundProcesses();
+
+    if (eStopPressed){
+      // Commands waiting are thrown away, the host sees ESTOP_PRESSED and stops streaming
+      comms_setStreamMode(0, false);
+      return;
+    }
+
+    if (streamRingCount == 0){
+      if ((millis() - idleTime) > rebroadcastReadyInterval){
+        comms_ready();
+        idleTime = millis();
+      }
+      continue;
+    }
+
+    // Take the next command out of the ring buffer, its slot can be refilled while it runs
+    byte seq = streamRingSeq[streamRingHead];
+    memcpy(lastCommand, streamRing[streamRingHead], sizeof(lastCommand));
+    streamRingHead = (streamRingHead + 1) % STREAM_SLOTS;
+    streamRingCount--;
+
+    comms_parseAndExecuteCommand(lastCommand);
+
+    Serial.print(F(ACK_STR));
+    Serial.println(seq);
+    idleTime = millis();
+    lastOperationTime = millis();
+    lastInteractionTime = lastOperationTime;
+  }
+}
+
+// Moves any received bytes into the ring buffer. Called often while commands run, so it must never block.
+void comms_streamPoll()
+{
+  if (!streamMode){
+    return;
+  }
+  if (streamBinary){
+    comms_binaryPoll();
+    return;
+  }
+  while (Serial.available() > 0)
+  {
+    char ch = Serial.read();
+    if (ch == '\r'){
+      continue;
+    }
+    if (ch == INTERMINATOR){
+      streamLine[streamLinePos] = 0;
+      if (streamLineOverflow){
+        comms_streamNak();
+      }
+      else if (streamLinePos > 0){
+        comms_streamFrame(streamLine);
+      }
+      streamLinePos = 0;
+      streamLineOverflow = false;
+    }
+    else if (streamLinePos < INLENGTH){
+      streamLine[streamLinePos] = ch;
+      streamLinePos++;
+    }
+    else{
+      streamLineOverflow = true;
+    }
+  }
+}
+
+void comms_streamFrame(char *frame)
+{
+  if (frame[0] != STREAM_FRAME_START){
+    // Not a frame, ex.) a late CHECKED from the handshake
+    return;
+  }
+  char *end;
+  long seq = strtol(frame + 1, &end, 10);
+  if ((end == frame + 1) || (*end != ',') || (seq != streamExpectedSeq) || (streamRingCount >= STREAM_SLOTS)){
+    comms_streamNak();
+    return;
+  }
+
+  byte tail = (streamRingHead + streamRingCount) % STREAM_SLOTS;
+  strncpy(streamRing[tail], end + 1, INLENGTH);
+  streamRing[tail][INLENGTH] = 0;
+  streamRingSeq[tail] = (byte)seq;
+  streamRingCount++;
+  streamExpectedSeq = (streamExpectedSeq + 1) % STREAM_SEQ_MOD;
+}
+
+void comms_binaryPoll()
+{
+  while (Serial.available() > 0)
+  {
+    byte b = Serial.read();
+    if ((binaryFramePos == 0) && (b != BINARY_FRAME_SYNC)){
+      // Wait for the start of a frame
+      continue;
+    }
+    binaryFrame[binaryFramePos] = b;
+    binaryFramePos++;
+    if (binaryFramePos == BINARY_FRAME_LENGTH){
+      binaryFramePos = 0;
+      comms_binaryFrame(binaryFrame);
+    }
+  }
+}
+
+void comms_binaryFrame(byte *frame)
+{
+  uint16_t crc = 0xFFFF;
+  for (byte i=1; i<BINARY_FRAME_LENGTH-2; i++){
+    crc = _crc_xmodem_update(crc, frame[i]);
+  }
+  uint16_t frameCrc = ((uint16_t)frame[BINARY_FRAME_LENGTH-2] << 8) | frame[BINARY_FRAME_LENGTH-1];
+  byte seq = frame[1];
+  if ((crc != frameCrc) || (seq != streamExpectedSeq) || (streamRingCount >= STREAM_SLOTS)){
+    comms_streamNak();
+    return;
+  }
+
+  // Back to a command string so it runs the same way as every other command
+  byte tail = (streamRingHead + streamRingCount) % STREAM_SLOTS;
+  char *command = streamRing[tail];
+  sprintf(command, "C%02d", frame[2]);
+  for (byte i=0; i<4; i++){
+    int16_t value = (int16_t)(frame[3 + 2*i] | ((uint16_t)frame[4 + 2*i] << 8));
+    comms_appendTenths(command, value);
+  }
+  strcat(command, CMD_END);
+  streamRingSeq[tail] = seq;
+  streamRingCount++;
+  streamExpectedSeq = (streamExpectedSeq + 1) % STREAM_SEQ_MOD;
+}
+
+// Appends ",<value/10>" ex.) -123 -> ",-12.3"
+void comms_appendTenths(char *command, int16_t value)
+{
+  long tenths = value;
+  const char *sign = "";
+  if (tenths < 0){
+    sign = "-";
+    tenths = -tenths;
+  }
+  char param[12];
+  sprintf(param, ",%s%ld.%ld", sign, tenths/10, tenths%10);
+  strcat(command, param);
+}
+
+void comms_streamNak()
+{
+  Serial.print(F(NAK_STR));
+  Serial.println(streamExpectedSeq);
+}
 
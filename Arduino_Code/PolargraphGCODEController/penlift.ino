@@ -30,7 +30,7 @@ void penlift_movePen(int start, int end, int delay_ms)
     for (int i=start; i<=end; i++) 
     {
       penHeight.write(i);
-      delay(delay_ms);
+      util_delay(delay_ms);
     }
   }
   else
@@ -38,7 +38,7 @@ void penlift_movePen(int start, int end, int delay_ms)
     for (int i=start; i>=end; i--) 
     {
       penHeight.write(i);
-      delay(delay_ms);
+      util_delay(delay_ms);
     }
   }
   penHeight.detach();
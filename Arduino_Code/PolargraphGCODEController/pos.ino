@@ -130,7 +130,7 @@ void LinearInterpolation(double X, double Y){
     movePositionDirect(iter_X, iter_Y);
     if(index==0){
       //extra delay for first step for acceleration
-      delay(2);
+      util_delay(2);
     }
     //if estop is pressed, update global positions and return from function
     if(eStopPressed){
@@ -142,7 +142,7 @@ void LinearInterpolation(double X, double Y){
 
   // one final movement to final position
   movePositionDirect(X, Y);
-  delay(2);
+  util_delay(2);
   currentXpos = X;
   currentYpos = Y;
 }
@@ -206,7 +206,7 @@ void CircularInterpolationCW(double X, double Y, double I, double J){
     movePositionDirect(iter_X, iter_Y);
     if(index==0){
       //extra delay for first step for acceleration
-      delay(2);
+      util_delay(2);
     }
     //if estop is pressed, update global positions and return from function
     if(eStopPressed){
@@ -217,7 +217,7 @@ void CircularInterpolationCW(double X, double Y, double I, double J){
   }
   // one final movement to final position
   movePositionDirect(X, Y);
-  delay(2);   
+  util_delay(2);   
   currentXpos = X;
   currentYpos = Y;
 }
@@ -281,7 +281,7 @@ void CircularInterpolationCCW(double X, double Y, double I, double J){
     movePositionDirect(iter_X, iter_Y);
     if(index==0){
       //extra delay for first step for acceleration
-      delay(2);
+      util_delay(2);
     }
     //if estop is pressed, update global positions and return from function
     if(eStopPressed){
@@ -293,7 +293,7 @@ void CircularInterpolationCCW(double X, double Y, double I, double J){
 
   // one final movement to final position
   movePositionDirect(X, Y); 
-  delay(2);
+  util_delay(2);
   currentXpos = X;
   currentYpos = Y;
 }
@@ -25,6 +25,16 @@ void util_WaitForMotors(){
     }
     motorL.runSpeedToPosition();
     motorR.runSpeedToPosition();
+    // In streaming mode the next commands are received while the motors move
+    comms_streamPoll();
+  }
+}
+
+// Same as delay(), but keeps receiving streamed commands
+void util_delay(unsigned long delay_ms){
+  unsigned long start = millis();
+  while((millis() - start) < delay_ms){
+    comms_streamPoll();
   }
 }
 
@@ -66,6 +76,10 @@ void util_processCommand(String com){
     relativeCoords = false;
   else if (com.startsWith(CMD_SET_RELATIVE_POS))
     relativeCoords = true;
+  else if (com.startsWith(CMD_STREAM))
+    comms_setStreamMode(atoi(inParam1), atoi(inParam2) == 1);
+  else if (com.startsWith(CMD_POLYLINE))
+    CMD_Polyline(com);
 }
 
 void moveHome(){
@@ -130,6 +144,39 @@ void CMD_CircularInterpolationCC(){
   CircularInterpolationCCW(X, Y, I, J);
 }
 
+void CMD_Polyline(String com){
+  //linear moves through each point, only 4 params fit in inParam1-4 so the params are read from the command itself
+  //offsets are added up from where the move starts, so rounding on the host never adds up
+  const char *param = strchr(com.c_str(), ',');
+  double startX = currentXpos;
+  double startY = currentYpos;
+  long offsetX = 0;
+  long offsetY = 0;
+  bool prevState = relativeCoords;
+  relativeCoords = false;
+  while(param != NULL){
+    char *end;
+    long dx = strtol(param + 1, &end, 10);
+    if((end == param + 1) || (*end != ',')){
+      break;
+    }
+    param = end;
+    long dy = strtol(param + 1, &end, 10);
+    if(end == param + 1){
+      break;
+    }
+    param = (*end == ',') ? end : NULL;
+
+    offsetX += dx;
+    offsetY += dy;
+    LinearInterpolation(startX + offsetX/100.0, startY + offsetY/100.0);
+    if(eStopPressed){
+      break;
+    }
+  }
+  relativeCoords = prevState;
+}
+
 void CMD_MoveRelative(){
   //moves to relative position and ignores relative/absolute coordinates
   //WARNING: if estop is pressed, currentPos variables will be wrong
@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+
+from GcodeProgram import GcodeProgram, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW
+
+class ArcFitter:
+    """
+    Replaces runs of short G01 moves that follow a circle with one G02 or G03, the plotter interpolates arcs itself
+    (see CircularInterpolationCW() in pos.ino). Curves from Inkscape are usually hundreds of tiny G01 moves.
+    Only runs of pen down G01 moves in absolute coordinates are changed, every other command is kept as it is.
+    Each arc is made as long as it can be while every point of the run, and the middle of every G01 it replaces,
+    stays within tolerance (mm) of the arc.
+
+    The center of an arc is always the same distance from its start and end, the plotter gets the radius from the end.
+    Arcs turn less than a full circle, the plotter does not draw an arc that ends where it starts.
+
+    tolerance -> Max distance in mm between the G01 moves and the arc that replaces them.
+    minMoves -> Fewest G01 moves that are replaced by an arc.
+    maxRadius -> Largest arc radius in mm, on the arduino a double is a float and big arcs lose precision.
+
+    fit(program) -> Returns (GcodeProgram with arcs, number of arcs made, number of G01 moves they replaced).
+    """
+    def __init__(self, tolerance=0.05, minMoves=4, maxRadius=500.0):
+        self.__tolerance = tolerance
+        self.__minMoves = minMoves
+        self.__maxRadius = maxRadius
+        # Largest turn of an arc, and of one G01 move in it
+        self.__maxSweep = 1.9*math.pi
+        self.__maxStepAngle = math.pi/4
+
+    def fit(self, program):
+        commands = program.commands
+        num = len(commands)
+        inRun = (commands["op"] == OP_LINEAR) & (commands["pen"] == 1) & ~program.relativeMode()
+        if np.count_nonzero(inRun) < self.__minMoves:
+            return program, 0, 0
+
+        x, y = program.positions()
+        # Runs of G01 moves, each run starts from the position before its first move
+        edges = np.diff(np.concatenate(([0], inRun.astype(np.int8), [0])))
+        runStarts = np.flatnonzero(edges == 1)
+        runEnds = np.flatnonzero(edges == -1)
+
+        keep = np.ones(num, dtype=bool)
+        # Command that each arc replaces, and the arc
+        arcRows = []
+        arcs = []
+        for runStart, runEnd in zip(runStarts.tolist(), runEnds.tolist()):
+            if runEnd - runStart < self.__minMoves:
+                continue
+            # Point 0 is where the run starts, point k is the end of command runStart + k - 1
+            if runStart > 0:
+                pointX = x[runStart - 1:runEnd]
+                pointY = y[runStart - 1:runEnd]
+            else:
+                pointX = np.concatenate(([0.0], x[:runEnd]))
+                pointY = np.concatenate(([0.0], y[:runEnd]))
+            for first, last, arc in self.__fitRun(pointX, pointY):
+                # The command that ends at the last point becomes the arc, the ones before it are removed
+                keep[runStart + first:runStart + last - 1] = False
+                arcRows.append(runStart + last - 1)
+                arcs.append(arc)
+
+        if not arcs:
+            return program, 0, 0
+        fitted = commands.copy()
+        arcRows = np.array(arcRows, dtype=np.int64)
+        arcs = np.array(arcs)
+        fitted["op"][arcRows] = arcs[:, 0].astype(np.uint8)
+        fitted["i"][arcRows] = arcs[:, 1]
+        fitted["j"][arcRows] = arcs[:, 2]
+        numReplaced = int(num - np.count_nonzero(keep)) + len(arcRows)
+        return GcodeProgram(fitted[keep]), len(arcRows), numReplaced
+
+    def __fitRun(self, pointX, pointY):
+        """
+        Yields (first point, last point, (op, I, J)) for each arc found in a run of points, from the start of the run.
+        Each arc is grown by doubling its number of moves, then a binary search finds the longest one that fits.
+        """
+        numMoves = len(pointX) - 1
+        first = 0
+        while first + self.__minMoves <= numMoves:
+            arc = self.__fitArc(pointX, pointY, first, first + self.__minMoves)
+            if arc is None:
+                first += 1
+                continue
+            good = first + self.__minMoves
+            bad = numMoves + 1
+            step = self.__minMoves
+            while good + step < bad:
+                candidate = min(good + step, numMoves)
+                fittedArc = self.__fitArc(pointX, pointY, first, candidate)
+                if fittedArc is None:
+                    bad = candidate
+                    break
+                good, arc = candidate, fittedArc
+                if candidate == numMoves:
+                    break
+                step *= 2
+            while bad - good > 1:
+                middle = (good + bad)//2
+                fittedArc = self.__fitArc(pointX, pointY, first, middle)
+                if fittedArc is None:
+                    bad = middle
+                else:
+                    good, arc = middle, fittedArc
+            yield first, good, arc
+            first = good
+
+    def __fitArc(self, pointX, pointY, first, last):
+        """
+        Fits an arc to points first to last, returns (op, I, J) or None if the points are not within tolerance of an arc.
+        The center is on the line halfway between the first and last point, where the least squares error is smallest.
+        """
+        px = pointX[first:last + 1]
+        py = pointY[first:last + 1]
+        startX, startY = px[0], py[0]
+        chordX = px[-1] - startX
+        chordY = py[-1] - startY
+        chord = math.hypot(chordX, chordY)
+        if chord < self.__tolerance:
+            return None
+        # Center is middle + t*normal
+        middleX = startX + chordX/2
+        middleY = startY + chordY/2
+        normalX = -chordY/chord
+        normalY = chordX/chord
+        # |P - C|^2 - |S - C|^2 is a + b*t for every point, t that makes it closest to 0
+        a = (px - middleX)**2 + (py - middleY)**2 - (chord/2)**2
+        b = -2*((px - startX)*normalX + (py - startY)*normalY)
+        bb = float(np.dot(b, b))
+        if bb < 1e-12:
+            return None
+        t = -float(np.dot(a, b))/bb
+        centerX = middleX + t*normalX
+        centerY = middleY + t*normalY
+        radius = math.hypot(startX - centerX, startY - centerY)
+        if radius > self.__maxRadius:
+            return None
+
+        # Every point, and the middle of every move between them, on the circle
+        if np.max(np.abs(np.hypot(px - centerX, py - centerY) - radius)) > self.__tolerance:
+            return None
+        middleDistance = np.hypot((px[:-1] + px[1:])/2 - centerX, (py[:-1] + py[1:])/2 - centerY)
+        if np.max(np.abs(middleDistance - radius)) > self.__tolerance:
+            return None
+        # Every move turns the same way, not too far
+        angles = np.arctan2(py - centerY, px - centerX)
+        turns = np.mod(np.diff(angles) + math.pi, 2*math.pi) - math.pi
+        if np.all(turns > 0):
+            op = OP_ARC_CCW
+        elif np.all(turns < 0):
+            op = OP_ARC_CW
+        else:
+            return None
+        turns = np.abs(turns)
+        if turns.max() > self.__maxStepAngle or turns.sum() > self.__maxSweep:
+            return None
+        return op, centerX - startX, centerY - startY
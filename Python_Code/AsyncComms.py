@@ -0,0 +1,557 @@
+import asyncio
+
+import serial
+
+from BinaryFrame import BinaryFrame
+from SerialReader import (SerialReader, EVENT_ECHO, EVENT_READY, EVENT_COMPLETE, EVENT_ESTOP, EVENT_RESET,
+                          EVENT_STREAM, EVENT_ACK, EVENT_NAK, EVENT_CLOSED)
+
+class AsyncUSBComm:
+    """
+    asyncio version of USBComm, every method that waits on the device is a coroutine so one event loop can
+    drive the device (or several devices) and a UI without a thread per blocking call.
+    USBComm runs one of these on its own event loop thread, its methods are thin wrappers around the ones here.
+    The device reads the commands and parses up to 4 values with the commands.
+    (not including the command itself C00-C99) The commands can be up to 70 characters.
+
+    userFeedBackQueue -> Queue of strings that can be accessed eternally for User feedback.
+    progress -> Optional ProgressChannel, each command sent is set as its last command instead of being put on userFeedBackQueue.
+
+    await send(command, window) -> Sends a command. With the handshake it waits for the command to complete,
+                                   in streaming mode only for space in the window. Returns False if the device stopped or the connection was lost.
+                                   window keeps fewer commands in flight than the stream window, ex.) so a jog stops soon after the last one.
+    await waitForComplete() -> Waits for the command sent to complete (CMD_COMPLETE or READY), or for every streamed command to be acknowledged.
+    await sendSingleCommand(command) -> send() then waitForComplete(), no other command is sent in between.
+    await startStreaming() -> Asks the device to start streaming mode, if a stream window was given. Called by connectDevice().
+    await connectDevice(device, name, bootDelay) -> Starts communication with an open serial.Serial like device, ex.) a PolargraphEmulator.
+    await startComm(port) -> Starts communication on a port, ex.) COM15.
+    endComm() -> Ends the connection to the device if one is connected.
+    events() -> Async iterator of every SerialEvent from the device, ex.) "async for event in comm.events():", ends when the connection closes.
+    isStreaming(), isBinary(), numInFlight(), setBinaryFrames(), testConnection(), testConnectionNoOutput() -> Same as USBComm.
+
+    Timeouts are asyncio.wait_for() around the wait for each event, ex.) the echo of a command is waited for loopTimeout seconds.
+    Calls from several tasks are safe, each exchange with the device (a command and its echo, or waiting for completion)
+    holds a lock so commands from different tasks are never mixed up.
+
+    Streaming mode (opt in with streamWindow > 0):
+    Normally each command is echoed, confirmed with CHECKED and completed before the next is sent, so the plotter
+    waits on the USB round trips between every move. In streaming mode up to streamWindow commands are in flight at once.
+    Commands are sent as "S<seq>,<command>", the device stores them in a ring buffer and sends "ACK,<seq>" when each completes,
+    or "NAK,<seq>" to have the commands from seq sent again. It is started with "C17,<window>,END" when connecting,
+    firmware that does not reply with "STREAM,<slots>" keeps using the handshake.
+    With binaryFrames each command is sent as a 13 byte BinaryFrame (opcode, params in 0.1mm, seq and a CRC) instead,
+    asked for with "C17,<window>,1,END". The device NAKs frames with a bad CRC. If the reply is "STREAM,<slots>"
+    without ",1" the firmware only knows text frames and those are used.
+
+    Everything the device sends is read by a SerialReader thread, which splits it into lines and events
+    (echo, ready, complete, estop, reset, ack, nak) and hands them to the event loop. The coroutines above await those events.
+    """
+    def __init__(self, userFeedbackQueue, streamWindow=0, binaryFrames=False, progress=None):
+        # Holds the instance of the "serial" used to actuall communicate
+        self.__device = None
+        # Reads lines from the device in its own thread, see SerialReader
+        self.__reader = None
+        # Events from the reader, and the queues of the events() iterators
+        self.__events = None
+        self.__listeners = []
+        # One exchange with the device at a time, made on the event loop when first needed
+        self.__lock = None
+        # Queue that is used to provide feedback in real time to a user
+        self.__userFeedbackQueue = userFeedbackQueue
+        # Keeps only the last command sent for the user, see ProgressChannel
+        self.__progress = progress
+
+        # Constants
+        # Flag to print debug info to terminal
+        self.__debug = False
+        # Baud rate of connection
+        self.__baudRate = 1000000
+        # time in loop before giving up on waiting from reply from connected device
+        self.__loopTimeout = 3
+        # Longest time to wait for an event before checking the connection again
+        self.__eventWaitTime = 0.5
+        # Seconds of delay after making initial connection to com port
+        self.__bootDelay = 2
+        # Max characters in a single command
+        self.__maxCharacters = 70
+
+        # Streaming
+        # Number of commands asked for in flight, 0 always uses the handshake
+        self.__requestedStreamWindow = streamWindow
+        # Ask for binary frames when streaming, and if the device agreed
+        self.__requestedBinary = binaryFrames
+        self.__binary = False
+        # Number of commands in flight agreed with the device, 0 if not streaming
+        self.__streamWindow = 0
+        # Sequence numbers wrap, this matches STREAM_SEQ_MOD in the firmware
+        self.__streamSeqMod = 256
+        self.__nextSeq = 0
+        # Frames sent but not acknowledged, by sequence number in the order they were sent
+        self.__inFlight = {}
+        # Sequence number the last resend started from, None when no resend is in progress
+        self.__resendFrom = None
+        # NAKs of __resendFrom that can still come from frames sent before the resend
+        self.__staleNaks = 0
+
+    async def send(self, command, window=None):
+        async with self.__getLock():
+            return await self.__send(command, window)
+
+    async def waitForComplete(self):
+        async with self.__getLock():
+            return await self.__waitForComplete()
+
+    async def sendSingleCommand(self, command):
+        async with self.__getLock():
+            if not self.testConnection():
+                return False
+            # With the handshake send() already waited for the command to complete
+            completed = await self.__send(command)
+            if completed and self.__streamWindow > 0:
+                completed = await self.__waitForStream()
+            return completed
+
+    async def startStreaming(self):
+        async with self.__getLock():
+            return await self.__startStreaming()
+
+    async def events(self):
+        listener = asyncio.Queue()
+        self.__listeners.append(listener)
+        try:
+            while True:
+                event = await listener.get()
+                yield event
+                if event.kind == EVENT_CLOSED:
+                    return
+        finally:
+            self.__listeners.remove(listener)
+
+    def isStreaming(self):
+        return self.__streamWindow > 0
+
+    def numInFlight(self):
+        return len(self.__inFlight)
+
+    def setBinaryFrames(self, binaryFrames):
+        """
+        Used the next time streaming starts, ex.) on the next startComm().
+        """
+        self.__requestedBinary = binaryFrames
+
+    def isBinary(self):
+        return self.__streamWindow > 0 and self.__binary
+
+    def __getLock(self):
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        return self.__lock
+
+    async def __send(self, command, window=None):
+        """
+        Sends a command with the handshake and waits for it to complete, or in streaming mode as soon as there
+        is space in the window (or in window, if it is smaller) without waiting for it to complete.
+        """
+        if not self.testConnection():
+            return False
+        if self.__streamWindow == 0:
+            completed = await self.__sendCommand(command)
+            if completed:
+                completed = await self.__waitForComplete()
+            return completed
+
+        # Wait for space in the window
+        if window is None or window > self.__streamWindow:
+            window = self.__streamWindow
+        while len(self.__inFlight) >= max(window, 1):
+            if not await self.__waitStreamEvent():
+                return False
+        if self.__streamWindow == 0 or not self.testConnectionNoOutput():
+            # endComm() ran while waiting
+            return False
+
+        command = self.__completeCommand(command).replace("\n", "")
+        seq = self.__nextSeq
+        if self.__binary:
+            try:
+                frame = BinaryFrame.encode(seq, command)
+            except ValueError as e:
+                self.__userFeedbackQueue.put(f"Failed to Send Command.\n{e}")
+                return False
+        else:
+            frame = f"S{seq},{command}\n"
+        if self.__debug:
+            print(f"Streaming: {frame}")
+        if not self.__sendFrame(frame):
+            self.__userFeedbackQueue.put("Failed to Send Command.\nInternal Error.")
+            return False
+        self.__showCommand(command)
+        self.__inFlight[seq] = frame
+        self.__nextSeq = (seq + 1) % self.__streamSeqMod
+
+        # Handle replies that already arrived without waiting
+        event = self.__nextEventNoWait()
+        while event is not None:
+            if not self.__handleStreamEvent(event):
+                return False
+            event = self.__nextEventNoWait()
+        return True
+
+    async def __startStreaming(self):
+        """
+        Asks the device to start streaming mode. Does nothing if no stream window was given or already streaming.
+        Returns True if streaming mode is being used.
+        """
+        if self.__requestedStreamWindow <= 0 or self.__streamWindow > 0:
+            return self.__streamWindow > 0
+        if not self.testConnectionNoOutput():
+            return False
+
+        self.__resetStream()
+        # Remove boot messages and READY signals so they are not mistaken for a reply
+        self.__clearEvents()
+        request = f"C17,{self.__requestedStreamWindow},1,END" if self.__requestedBinary else f"C17,{self.__requestedStreamWindow},END"
+        if not await self.__sendCommand(request):
+            return False
+
+        slots = 0
+        binary = False
+        deadline = asyncio.get_running_loop().time() + self.__loopTimeout
+        while True:
+            event = await self.__nextEvent(max(deadline - asyncio.get_running_loop().time(), 0))
+            if event is None:
+                break
+            if event.kind == EVENT_STREAM:
+                slots = event.value or 0
+                binary = event.text.endswith(",1")
+            elif event.kind in (EVENT_COMPLETE, EVENT_ESTOP, EVENT_RESET, EVENT_CLOSED):
+                break
+
+        if slots > 0:
+            self.__streamWindow = min(slots, self.__requestedStreamWindow)
+            self.__binary = binary and self.__requestedBinary
+            if self.__debug:
+                print(f"Streaming {self.__streamWindow} commands, binary frames {self.__binary}.")
+        elif self.__debug:
+            print("Device does not support streaming, using handshake.")
+        return self.__streamWindow > 0
+
+    async def __waitForComplete(self):
+        """
+        Waits for the device to send back either a READY signal or a CMD_COMPLETE signal.
+        Returns true or false indicating if waitForComplete ended correctly.
+        """
+        if self.__streamWindow > 0:
+            return await self.__waitForStream()
+
+        if self.__debug:
+            print("---------------WAIT FOR COMPLETE---------------")
+        while True:
+            # Check device is still connected
+            if not self.testConnectionNoOutput():
+                return False
+            event = await self.__nextEvent(self.__eventWaitTime)
+            if event is None:
+                continue
+
+            # Check if major error as occured
+            if event.kind in (EVENT_ESTOP, EVENT_CLOSED):
+                return False
+            elif event.kind == EVENT_RESET:
+                # Check if major error as occured
+                if self.__debug:
+                    print("device Reset.")
+                return False
+            elif event.kind in (EVENT_COMPLETE, EVENT_READY):
+                # Wait is complete if this was received
+                if self.__debug:
+                    print("Received: " + event.text)
+                break
+            elif self.__debug:
+                print("Other Received: " + event.text)
+
+        if self.__debug:
+            print("---------------\n")
+
+        return True
+
+    async def __sendCommand(self, command):
+        """
+        Sends a command to the device,
+        waits for the command to be sent back, verifies if the command is correct.
+        """
+        command = self.__completeCommand(command)
+
+        if self.__debug:
+            print("---------------SEND COMMAND---------------")
+            print("Sending: " + command)
+
+        # Send the data to the device, checks that the command sent correctly
+        if not self.__sendData(command):
+            self.__userFeedbackQueue.put("Failed to Send Command.\nInternal Error.")
+            return False
+        else:
+            self.__showCommand(command)
+
+
+        # Waits for the command to be sent back from the device, verifies the command matches
+        checkCommand = command.replace("\n", "") # Remove newlines from command
+        deadline = asyncio.get_running_loop().time() + self.__loopTimeout
+        while True:
+            # Check that the wait for received command has not errored out
+            event = await self.__nextEvent(max(deadline - asyncio.get_running_loop().time(), 0))
+            if event is None:
+                break
+            if self.__debug:
+                print("Received: " + event.text)
+
+            # Check incoming data for error
+            if event.kind in (EVENT_RESET, EVENT_CLOSED):
+                # The device reset and a major error must have occured
+                if self.__debug:
+                    print("device Reset.")
+                return False
+            elif event.kind == EVENT_ECHO and checkCommand in event.text:
+                # the command was received correctly and the device sent back the same command
+                break
+            elif event.kind == EVENT_READY:
+                # Some kind of error occured, resend the command
+                self.__sendData(command)
+
+        if self.__debug:
+            print("Sending:" + "CHECKED" )
+
+        # Send back CHECKED to indicate that the command was verified and the device can execute the command
+        if not self.__sendData("CHECKED\n"):
+            return False
+
+        # The CHECKED sent back is an echo event, waitForComplete() skips it
+        if self.__debug:
+            print("---------------\n")
+        return True
+
+    def __completeCommand(self, command):
+        """
+        If command is missing components add them
+        """
+        if(",END" not in command):
+            command += ",END"
+        elif("END" not in command):
+            command += "END"
+        if("\n" not in command):
+            command += "\n"
+        return command
+
+    def __showCommand(self, command):
+        if self.__progress is not None:
+            self.__progress.setCommand(command)
+        else:
+            self.__userFeedbackQueue.put(command)
+
+    # REGION Events
+    def __onEvent(self, events, event):
+        """
+        Runs on the event loop, called from the reader thread through call_soon_threadsafe().
+        """
+        events.put_nowait(event)
+        for listener in self.__listeners:
+            listener.put_nowait(event)
+
+    async def __nextEvent(self, timeout=None):
+        """
+        Returns the next event, or None if there is none within timeout seconds (None waits forever, 0 does not wait).
+        """
+        event = self.__nextEventNoWait()
+        if event is not None or timeout == 0 or self.__events is None:
+            return event
+        try:
+            return await asyncio.wait_for(self.__events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __nextEventNoWait(self):
+        if self.__events is None:
+            return None
+        try:
+            return self.__events.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def __clearEvents(self):
+        while self.__nextEventNoWait() is not None:
+            pass
+
+    # REGION Streaming
+    async def __waitForStream(self):
+        """
+        Waits for every command in flight to be acknowledged.
+        """
+        while self.__inFlight:
+            if not await self.__waitStreamEvent():
+                return False
+        return True
+
+    async def __waitStreamEvent(self):
+        """
+        Waits for the next event from the device and handles it.
+        Returns False if the device stopped streaming (ESTOP or reset) or the connection was lost.
+        """
+        if not self.testConnectionNoOutput():
+            self.__resetStream()
+            return False
+        event = await self.__nextEvent(self.__eventWaitTime)
+        if event is None:
+            return True
+        return self.__handleStreamEvent(event)
+
+    def __handleStreamEvent(self, event):
+        """
+        ACK,<seq> completes every frame up to seq, NAK,<seq> sends every frame from seq again.
+        The device NAKs every frame that arrives after a dropped one, so while a resend is in progress the NAKs of
+        the frames sent before it are ignored. Otherwise each of them would resend the whole window again.
+        Returns False if the device stopped streaming (ESTOP or reset) or the connection was lost.
+        """
+        if event.kind == EVENT_ACK:
+            seq = event.value
+            if seq in self.__inFlight:
+                # Frames are acknowledged in order
+                for sentSeq in list(self.__inFlight):
+                    del self.__inFlight[sentSeq]
+                    if sentSeq == seq:
+                        break
+                if self.__resendFrom not in self.__inFlight:
+                    # The resent frames arrived
+                    self.__resendFrom = None
+                    self.__staleNaks = 0
+        elif event.kind == EVENT_NAK:
+            seq = event.value
+            if seq == self.__resendFrom and self.__staleNaks > 0:
+                # From a frame sent before the resend
+                self.__staleNaks -= 1
+            elif seq in self.__inFlight:
+                if self.__debug:
+                    print(f"Resending from {seq}")
+                sentSeqs = list(self.__inFlight)
+                # Each frame after seq that was sent before the resend can still be NAKed once, a NAK past those
+                # means a resent frame was dropped as well
+                self.__resendFrom = seq
+                self.__staleNaks = len(sentSeqs) - sentSeqs.index(seq) - 1
+                for sentSeq in sentSeqs[sentSeqs.index(seq):]:
+                    if not self.__sendFrame(self.__inFlight[sentSeq]):
+                        return False
+        elif event.kind in (EVENT_ESTOP, EVENT_RESET, EVENT_CLOSED):
+            # The device left streaming mode and threw away the commands in flight
+            if self.__debug:
+                print("Streaming stopped: " + event.text)
+            self.__resetStream()
+            return False
+        elif self.__debug:
+            print("Other Received: " + event.text)
+        return True
+
+    def __resetStream(self):
+        """
+        Goes back to the handshake, startStreaming() has to be called again to stream.
+        """
+        self.__streamWindow = 0
+        self.__binary = False
+        self.__nextSeq = 0
+        self.__inFlight = {}
+        self.__resendFrom = None
+        self.__staleNaks = 0
+
+    def __sendFrame(self, frame):
+        """
+        Sends a text frame (str) or binary frame (bytes).
+        """
+        if isinstance(frame, str):
+            return self.__sendData(frame)
+        self.__device.write(frame)
+        return True
+
+    def __sendData(self, data):
+        """
+        Encodes and sends string over serial.
+        """
+        if len(data) >= self.__maxCharacters:
+            if self.__debug:
+                print("Too much data.")
+            return False
+
+        self.__device.write(data.encode())
+        return True
+
+    # REGION Comm selction start and end, testing connection
+    def testConnection(self):
+        """
+        Tests for any comm connection, adds an error to userFeedbackQueue if needed.
+        """
+        if self.testConnectionNoOutput():
+            return True
+        else:
+            self.__userFeedbackQueue.put("Device Not Connected.")
+            return False
+
+    def testConnectionNoOutput(self):
+        """
+        Tests for any comm connection without adding anything to the userFeedbackQueue.
+        """
+        if self.__device is None:
+            return False
+        elif not self.__device.is_open:
+            return False
+        else:
+            return True
+
+    def endComm(self):
+        """
+        Closes connection of Comm port.
+        Checks that port is open first.
+        """
+        if self.testConnectionNoOutput():
+            self.__device.close()
+        # Closing the port ends the read the reader thread is waiting in
+        if self.__reader is not None:
+            self.__reader.stop()
+            self.__reader = None
+        self.__resetStream()
+
+    async def startComm(self, port):
+        """
+        Starts serial communication with the specified port.
+        """
+        try:
+            device = serial.Serial(port=port, baudrate=self.__baudRate, timeout=1)
+            #devices and other devices reset when connected, this delay gives them a chance to boot properly
+            await self.connectDevice(device, port, self.__bootDelay)
+        except serial.SerialException as e:
+            self.__userFeedbackQueue.put(f"Failed to connect to {port}: {e}")
+            if self.__debug:
+                print(e)
+            self.__device = None
+
+    async def connectDevice(self, device, name, bootDelay=0.0):
+        """
+        Uses a device that is already open, anything with the same methods as serial.Serial, ex.) a PolargraphEmulator.
+        Waits bootDelay seconds for the device to boot, then throws away its boot messages so "POLARGRAPH ON!"
+        is not mistaken for a reset. name is shown to the user.
+        """
+        async with self.__getLock():
+            if self.__reader is not None:
+                self.__reader.stop()
+            self.__device = device
+            await asyncio.sleep(bootDelay)
+            self.__device.reset_input_buffer()
+            # Each connection gets its own queue, so a late event from the last reader never ends up in it
+            loop = asyncio.get_running_loop()
+            events = asyncio.Queue()
+            self.__events = events
+            self.__reader = SerialReader(self.__device, lambda event: loop.call_soon_threadsafe(self.__onEvent, events, event))
+            self.__reader.start()
+            self.__userFeedbackQueue.put(f"Connected to {name}.")
+            if self.__debug:
+                print(f"Connected to {name}.")
+            self.__resetStream()
+            if await self.__startStreaming():
+                framing = "binary frames" if self.__binary else "text frames"
+                self.__userFeedbackQueue.put(f"Streaming {self.__streamWindow} commands at once, {framing}.")
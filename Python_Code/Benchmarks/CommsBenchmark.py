@@ -0,0 +1,260 @@
+# Measures how fast commands get through the serial command path.
+# Every run sends a generated gcode file with GcodeControler.runGcode() to a PolargraphEmulator,
+# for each baud rate, command mix and protocol (handshake, streaming text frames or streaming binary frames,
+# with or without runs of G01 moves batched into C18 commands).
+# It reports commands/sec, moves/sec (a C18 batch counts each of its moves) (over the time at least one command is in flight), the p50 and p99 time
+# from sending a command until the host sees it complete, and the bytes sent each way.
+# Moves take no time on the emulator (unless --time-scale is given), so the numbers are the cost of the comms alone.
+# The total time of each run is saved too, it also includes the time runGcode waits for the device to be READY
+# with no command in flight, before the first command and after the last one.
+# Run from the Python_Code folder:
+#   python Benchmarks/CommsBenchmark.py [--output results.json] [--compare old_results.json]
+# Results are saved as json, --compare prints the change from an earlier results file.
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import tempfile
+import platform
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Comms import USBComm
+from ProgressChannel import ProgressChannel
+from GcodeControl import GcodeControler
+from DeviceEmulator import PolargraphEmulator
+from BinaryFrame import BINARY_FRAME_SYNC, BINARY_FRAME_LENGTH
+
+BAUD_RATES = (115200, 250000, 1000000)
+MIXES = ("lines", "arcs", "travel", "mixed")
+# Protocol name, the stream window and binary frames given to USBComm, and if G01 moves are batched
+PROTOCOLS = (("handshake", 0, False, False), ("stream", 8, False, False), ("binary", 8, True, False),
+             ("batch", 0, False, True), ("st-batch", 8, False, True))
+
+class RecordingDevice:
+    """
+    Passes everything through to the emulator, and records when each command is sent and when the host reads its completion.
+    Handshake commands complete with CMD_COMPLETE after their CHECKED, streamed commands with ACK,<seq>.
+    """
+    def __init__(self, device):
+        self.__device = device
+        self.sent = []
+        self.completed = []
+        # Streamed frames waiting for their ACK, by sequence number
+        self.__streamSent = {}
+        # Handshake command waiting for CHECKED, and commands waiting for CMD_COMPLETE
+        self.__lastCommandTime = None
+        self.__checkedTimes = []
+        # Bytes read after the last newline
+        self.__buffer = bytearray()
+
+    def __getattr__(self, name):
+        return getattr(self.__device, name)
+
+    def write(self, data):
+        now = time.perf_counter()
+        line = bytes(data).strip()
+        if data[:1] == bytes([BINARY_FRAME_SYNC]) and len(data) == BINARY_FRAME_LENGTH:
+            # Binary frame, the ACK has the sequence number as text
+            self.__streamSent.setdefault(str(data[1]).encode(), now)
+        elif line.startswith(b"S"):
+            seq = line[1:].split(b",", 1)[0]
+            # A resent frame keeps the time it was first sent
+            self.__streamSent.setdefault(seq, now)
+        elif line == b"CHECKED":
+            if self.__lastCommandTime is not None:
+                self.__checkedTimes.append(self.__lastCommandTime)
+                self.__lastCommandTime = None
+        elif line.startswith(b"C"):
+            # Resent commands keep the time they were first sent
+            if self.__lastCommandTime is None:
+                self.__lastCommandTime = now
+        return self.__device.write(data)
+
+    def read(self, size=1):
+        data = self.__device.read(size)
+        self.__buffer += data
+        while b"\n" in self.__buffer:
+            end = self.__buffer.index(b"\n")
+            self.__record(bytes(self.__buffer[:end]).strip())
+            del self.__buffer[:end + 1]
+        return data
+
+    def __record(self, line):
+        now = time.perf_counter()
+        if line == b"CMD_COMPLETE" and self.__checkedTimes:
+            self.__done(self.__checkedTimes.pop(0), now)
+        elif line.startswith(b"ACK,"):
+            sentTime = self.__streamSent.pop(line[4:], None)
+            if sentTime is not None:
+                self.__done(sentTime, now)
+
+    def __done(self, sentTime, completeTime):
+        self.sent.append(sentTime)
+        self.completed.append(completeTime)
+
+def generateGcodeFile(path, mix, numMoves):
+    """
+    lines -> Short G01 moves with the pen down.
+    arcs -> G02 and G03 moves.
+    travel -> Pen up, G00 to a new place, pen down, a few G01 moves, so most commands are pen moves and travel.
+    mixed -> All of the above.
+    """
+    random.seed(0)
+    x, y = 100.0, -100.0
+    with open(path, 'w') as file:
+        file.write("G21\nG90\nG00 Z5.000000\nG00 X100.000000 Y-100.000000\nG01 Z-1.000000 F100.0\n")
+        for i in range(numMoves):
+            kind = mix
+            if mix == "mixed":
+                kind = ("lines", "lines", "arcs", "travel")[i % 4]
+            if kind == "lines":
+                x = min(max(x + random.uniform(-2, 2), 10), 500)
+                y = min(max(y + random.uniform(-2, 2), -700), -10)
+                file.write(f"G01 X{x:.6f} Y{y:.6f} Z-1.000000\n")
+            elif kind == "arcs":
+                # Half circle of radius 1 and back again
+                direction = "G02" if i % 2 == 0 else "G03"
+                x += 2 if i % 2 == 0 else -2
+                file.write(f"{direction} X{x:.6f} Y{y:.6f} Z-1.000000 I{1 if i % 2 == 0 else -1:.6f} J0.000000\n")
+            else:
+                if i % 4 == 0:
+                    x = random.uniform(10, 500)
+                    y = random.uniform(-700, -10)
+                    file.write(f"G00 Z5.000000\nG00 X{x:.6f} Y{y:.6f}\nG01 Z-1.000000\n")
+                else:
+                    x = min(x + 1, 500)
+                    file.write(f"G01 X{x:.6f} Y{y:.6f} Z-1.000000\n")
+        file.write("G00 Z5.000000\n")
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(fraction*(len(values) - 1))), len(values) - 1)
+    return values[index]
+
+def busySeconds(sent, completed):
+    """
+    Time at least one command was in flight, the union of every send to complete interval.
+    """
+    total = 0.0
+    busyStart = busyEnd = None
+    for start, end in sorted(zip(sent, completed)):
+        if busyEnd is None or start > busyEnd:
+            if busyEnd is not None:
+                total += busyEnd - busyStart
+            busyStart, busyEnd = start, end
+        else:
+            busyEnd = max(busyEnd, end)
+    if busyEnd is not None:
+        total += busyEnd - busyStart
+    return total
+
+def countMoves(commandsRun):
+    """
+    Moves the emulator ran, each X, Y pair of a C18 batch is a move.
+    """
+    numMoves = 0
+    for command in commandsRun:
+        if command.startswith("C18"):
+            numMoves += (command.count(",") - 1)//2
+        else:
+            numMoves += 1
+    return numMoves
+
+def runOne(path, baudRate, window, binary, batch, timeScale):
+    emulator = PolargraphEmulator(baudRate=baudRate, timeScale=timeScale)
+    device = RecordingDevice(emulator)
+    progress = ProgressChannel()
+    comms = USBComm(queue.Queue(), window, binary, progress)
+    comms.connectDevice(device, "emulator", bootDelay=0.1)
+    controller = GcodeControler(comms, progress)
+    controller.setGcodeFile(path)
+    controller.setBatchMoves(batch)
+
+    bytesBefore = (emulator.bytesReceived, emulator.bytesSent)
+    commandsBefore = len(emulator.commandsRun)
+    startTime = time.perf_counter()
+    result = controller.runGcode()
+    elapsed = time.perf_counter() - startTime
+    streaming = comms.isStreaming()
+    binary = comms.isBinary()
+    comms.endComm()
+
+    latencies = [complete - sent for sent, complete in zip(device.sent, device.completed)]
+    numCommands = len(latencies)
+    commandSeconds = busySeconds(device.sent, device.completed)
+    numMoves = countMoves(emulator.commandsRun[commandsBefore:])
+    return {
+        "ok": result is None,
+        "commands": numCommands,
+        "runSeconds": elapsed,
+        "commandSeconds": commandSeconds,
+        "commandsPerSecond": numCommands/commandSeconds if commandSeconds > 0 else 0.0,
+        "moves": numMoves,
+        "movesPerSecond": numMoves/commandSeconds if commandSeconds > 0 else 0.0,
+        "p50LatencyMs": percentile(latencies, 0.5)*1000,
+        "p99LatencyMs": percentile(latencies, 0.99)*1000,
+        "bytesToDevice": emulator.bytesReceived - bytesBefore[0],
+        "bytesFromDevice": emulator.bytesSent - bytesBefore[1],
+        "streaming": streaming,
+        "binary": binary,
+    }
+
+def compare(results, oldResults):
+    """
+    Prints the change in commands/sec and p99 latency from an earlier results file.
+    """
+    old = {(r["protocol"], r["baudRate"], r["mix"]): r for r in oldResults["runs"]}
+    print("\nChange from previous results:")
+    for run in results["runs"]:
+        previous = old.get((run["protocol"], run["baudRate"], run["mix"]))
+        if previous is None or previous["commandsPerSecond"] <= 0 or previous["p99LatencyMs"] <= 0:
+            continue
+        rateChange = run["commandsPerSecond"]/previous["commandsPerSecond"] - 1
+        latencyChange = run["p99LatencyMs"]/previous["p99LatencyMs"] - 1
+        print(f"{run['protocol']:>9} {run['baudRate']:>8} {run['mix']:>6}: "
+              f"commands/sec {rateChange:+.1%}, p99 latency {latencyChange:+.1%}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serial command path benchmark.")
+    parser.add_argument("--moves", type=int, default=300, help="Moves in each generated file.")
+    parser.add_argument("--baud", type=int, nargs="+", default=BAUD_RATES)
+    parser.add_argument("--mix", choices=MIXES, nargs="+", default=MIXES)
+    parser.add_argument("--time-scale", type=float, default=0.0, help="Scales how long moves take on the emulator, 0 is instant.")
+    parser.add_argument("--output", default="CommsBenchmark.json", help="Results file to write.")
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    results = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "moves": args.moves,
+        "timeScale": args.time_scale,
+        "runs": [],
+    }
+    print(f"{'protocol':>9} {'baud':>8} {'mix':>6} {'cmds':>5} {'cmd/s':>8} {'moves/s':>8} {'p50 ms':>7} {'p99 ms':>7} {'bytes out':>9} {'bytes in':>9} {'run s':>6}")
+    for mix in args.mix:
+        path = os.path.join(tempfile.gettempdir(), f"CommsBenchmark_{mix}.ngc")
+        generateGcodeFile(path, mix, args.moves)
+        for baudRate in args.baud:
+            for protocol, window, binary, batch in PROTOCOLS:
+                run = runOne(path, baudRate, window, binary, batch, args.time_scale)
+                run.update({"protocol": protocol, "baudRate": baudRate, "mix": mix})
+                results["runs"].append(run)
+                print(f"{protocol:>9} {baudRate:>8} {mix:>6} {run['commands']:>5} {run['commandsPerSecond']:>8.1f} {run['movesPerSecond']:>8.1f} "
+                      f"{run['p50LatencyMs']:>7.2f} {run['p99LatencyMs']:>7.2f} {run['bytesToDevice']:>9} {run['bytesFromDevice']:>9} {run['runSeconds']:>6.2f}"
+                      + ("" if run["ok"] else "  FAILED"))
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nSaved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(results, json.load(file))
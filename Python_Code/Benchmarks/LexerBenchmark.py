@@ -0,0 +1,85 @@
+# Measures how many lines per second the GCODE lexer can parse.
+# It compares GcodeLexer against the old approach of compiling a regex for every letter of every line.
+# Run from the Python_Code folder:
+#   python Benchmarks/LexerBenchmark.py [gcode file]
+# If no file is given a file of Inkscape style commands is generated.
+
+import os
+import sys
+import re
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from GcodeLexer import GcodeLexer
+
+def generateGcodeFile(path, numLines):
+    """
+    Writes a file that looks like gcodetools output, mostly G01 moves with pen moves and comments.
+    """
+    random.seed(0)
+    with open(path, 'w') as file:
+        file.write("(Header)\n(Generated by gcodetools)\nG21 (All units in mm)\nG90\n")
+        for i in range(numLines):
+            if i % 200 == 0:
+                file.write("G00 Z5.000000\n")
+                file.write(f"G00 X{random.uniform(0, 500):.6f} Y{random.uniform(-700, 0):.6f}\n\n")
+                file.write("G01 Z-1.000000 F100.0(Penetrate)\n")
+            elif i % 50 == 0:
+                file.write(f"G02 X{random.uniform(0, 500):.6f} Y{random.uniform(-700, 0):.6f} Z-1.000000 I{random.uniform(-5, 5):.6f} J{random.uniform(-5, 5):.6f}\n")
+            else:
+                file.write(f"G01 X{random.uniform(0, 500):.6f} Y{random.uniform(-700, 0):.6f} Z-1.000000\n")
+
+def oldParse(path):
+    """
+    The parse that was used before GcodeLexer. Removes comments from the whole text,
+    then compiles a regex for each value that GcodeControler needed from each line.
+    """
+    def findVal(letter, command):
+        pattern = re.compile(rf"{re.escape(letter)}\s*([-+]?\d*\.?\d+)", re.IGNORECASE)
+        match = pattern.search(command)
+        if match:
+            return float(match.group(1))
+        return -1
+
+    with open(path, 'r') as file:
+        txt = file.read()
+    txt = re.sub(r'\([^)]*\)', '', txt)
+    pattern = re.compile(r'^(G00|G01|G02|G03|G90|G91)')
+    values = []
+    for line in txt.splitlines():
+        if pattern.search(line):
+            if ("G00" in line) or ("G01" in line):
+                values.append((findVal("X", line), findVal("Y", line)))
+            elif ("G02" in line) or ("G03" in line):
+                values.append((findVal("X", line), findVal("Y", line), findVal("I", line), findVal("J", line)))
+            if ("Z" in line) and ("X" not in line) and ("Y" not in line):
+                values.append(findVal("Z", line))
+    return values
+
+def newParse(path):
+    return GcodeLexer().readCommands(path)
+
+def timeParse(parse, path, numLines):
+    startTime = time.perf_counter()
+    parse(path)
+    elapsed = time.perf_counter() - startTime
+    return numLines/elapsed
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+        with open(path, 'r') as file:
+            numLines = sum(1 for _ in file)
+    else:
+        numLines = 200000
+        path = os.path.join(tempfile.gettempdir(), "LexerBenchmark.ngc")
+        generateGcodeFile(path, numLines)
+
+    oldRate = timeParse(oldParse, path, numLines)
+    newRate = timeParse(newParse, path, numLines)
+    print(f"Lines: {numLines}")
+    print(f"Old regex parse: {oldRate:,.0f} lines/sec")
+    print(f"GcodeLexer:      {newRate:,.0f} lines/sec")
+    print(f"Speedup:         {newRate/oldRate:.1f}x")
@@ -0,0 +1,55 @@
+import struct
+import binascii
+
+# These match BINARY_FRAME_SYNC and BINARY_FRAME_LENGTH in PolargraphGCODEController.ino
+BINARY_FRAME_SYNC = 0xA5
+BINARY_FRAME_LENGTH = 13
+# Params are sent in 0.1mm, the length of one motor step
+BINARY_FRAME_SCALE = 10
+# sync, seq, opcode, 4 params, then the CRC which is packed big endian
+_BODY = struct.Struct("<BBB4h")
+_CRC = struct.Struct(">H")
+_MIN_PARAM = -32768
+_MAX_PARAM = 32767
+
+class BinaryFrame:
+    """
+    Binary command frames for streaming mode, 13 bytes instead of a 30-55 character "S<seq>,Cxx,...,END" line.
+    sync (0xA5), seq, opcode (the number of the Cxx command), 4 params as little endian int16 in 0.1mm,
+    then a CRC-16/CCITT (poly 0x1021, start 0xFFFF, high byte first) of seq, opcode and the params.
+    Params are rounded to 0.1mm, the plotter can't move less than that.
+
+    encode(seq, command) -> Returns the frame for a command string, ex.) "C01,10.25,-20,END". Raises ValueError if it can't be encoded.
+    decode(frame) -> Returns (seq, command string) from a frame, or None if the CRC is wrong.
+    """
+    @staticmethod
+    def encode(seq, command):
+        fields = command.strip().split(",")
+        if fields and fields[-1] == "END":
+            fields = fields[:-1]
+        name = fields[0]
+        if len(name) != 3 or name[0] != "C" or not name[1:].isdigit():
+            raise ValueError(f"{command} is not a Cxx command.")
+        if len(fields) > 5:
+            raise ValueError(f"{command} has more than 4 params.")
+        params = []
+        for field in fields[1:]:
+            value = round(float(field)*BINARY_FRAME_SCALE)
+            if value < _MIN_PARAM or value > _MAX_PARAM:
+                raise ValueError(f"{field} is too large for a binary frame.")
+            params.append(value)
+        params += [0]*(4 - len(params))
+        body = _BODY.pack(BINARY_FRAME_SYNC, seq, int(name[1:]), *params)
+        return body + _CRC.pack(binascii.crc_hqx(body[1:], 0xFFFF))
+
+    @staticmethod
+    def decode(frame):
+        if len(frame) != BINARY_FRAME_LENGTH or frame[0] != BINARY_FRAME_SYNC:
+            return None
+        body = frame[:-_CRC.size]
+        if _CRC.unpack(frame[-_CRC.size:])[0] != binascii.crc_hqx(body[1:], 0xFFFF):
+            return None
+        _, seq, opcode, *params = _BODY.unpack(body)
+        # Same text the firmware builds with comms_appendTenths()
+        command = f"C{opcode:02d}" + "".join(f",{value/BINARY_FRAME_SCALE:.1f}" for value in params) + ",END"
+        return seq, command
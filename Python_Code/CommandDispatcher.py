@@ -0,0 +1,164 @@
+import threading
+from collections import deque
+
+# Key of the jog moves (C05) queued with jog()
+JOG_KEY = "jog"
+# Key of the moves of a continuous jog, see startJog()
+CONTINUOUS_JOG_KEY = "continuousJog"
+
+class CommandDispatcher:
+    """
+    Sends the commands of the manual controls (buttons, speed slider, arrow keys) from its own thread,
+    so the GUI never waits on the device. Commands are sent one at a time, in the order they were submitted.
+
+    Commands that are superseded before they are sent are dropped. A command submitted with a key replaces the
+    last queued command if it has the same key, ex.) while the speed slider is dragged only the latest speed is
+    waiting to be sent. Jogs (C05) at the end of the queue are added together into one move, up to maxJogDistance mm
+    on each axis, so pressing a button many times never queues up seconds of moves.
+
+    A continuous jog (ex.) while an arrow key is held) is a stream of short relative moves, each about jogStepTime seconds
+    long at the jog speed. In streaming mode only jogAhead of them are in flight, so the next move is already on the
+    device when one ends and the pen moves smoothly, while the pen stops within about (jogAhead + 1)*jogStepTime seconds
+    of stopJog(). With the handshake each move is sent when the one before completes.
+
+    arduinoComms -> USBComm used to send the commands.
+    userFeedbackQueue -> Queue of strings for user feedback, commands that could not be sent are reported on it.
+    maxJogDistance -> Largest queued jog in mm on each axis, presses past it are dropped.
+    jogStepTime -> Seconds each move of a continuous jog takes.
+    jogAhead -> Moves of a continuous jog in flight at once, when streaming.
+
+    submit(action, key, onDone) -> Queues a command string, or a function that sends commands and returns if it worked,
+                                   ex.) GcodeControler.switchPen. onDone(result) is called from the dispatcher thread once it ran.
+    jog(dX, dY) -> Queues a relative move (C05), added to a jog that is already waiting.
+    startJog(directionX, directionY, speed) -> Starts, or changes, a continuous jog. Directions are -1, 0 or 1, speed is in mm/s (C07).
+    stopJog() -> Stops the continuous jog, the moves in flight are finished.
+    clear() -> Drops every command that was not sent yet, ex.) when a GCODE run starts.
+    waitUntilIdle(timeout) -> Waits for the queued commands to be sent, returns False if they were not within timeout seconds.
+    numPending() -> Returns the number of commands waiting or being sent.
+    stop() -> Drops the queue and ends the thread.
+    """
+    def __init__(self, arduinoComms, userFeedbackQueue, maxJogDistance=20.0, jogStepTime=0.1, jogAhead=2):
+        self.__ArduinoComms = arduinoComms
+        self.__userFeedbackQueue = userFeedbackQueue
+        self.__maxJogDistance = maxJogDistance
+        self.__jogStepTime = jogStepTime
+        self.__jogAhead = jogAhead
+        # (dX, dY) of each move of the continuous jog, None when not jogging
+        self.__jogStep = None
+        # Moves of a continuous jog were queued and not waited for yet
+        self.__jogSent = False
+        # Queued [key, action, onDone], jogs are [JOG_KEY, [dX, dY], onDone] until they are sent
+        self.__queue = deque()
+        self.__busy = False
+        self.__running = True
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, action, key=None, onDone=None):
+        with self.__condition:
+            if key is not None and self.__queue and self.__queue[-1][0] == key:
+                self.__queue[-1] = [key, action, onDone]
+            else:
+                self.__queue.append([key, action, onDone])
+            self.__condition.notify_all()
+
+    def jog(self, dX, dY):
+        with self.__condition:
+            if self.__queue and self.__queue[-1][0] == JOG_KEY:
+                move = self.__queue[-1][1]
+                move[0] = self.__clampJog(move[0] + dX)
+                move[1] = self.__clampJog(move[1] + dY)
+            else:
+                self.__queue.append([JOG_KEY, [self.__clampJog(dX), self.__clampJog(dY)], None])
+            self.__condition.notify_all()
+
+    def startJog(self, directionX, directionY, speed):
+        step = max(speed, 0.01)*self.__jogStepTime
+        with self.__condition:
+            self.__jogStep = (round(directionX*step, 3), round(directionY*step, 3))
+            self.__condition.notify_all()
+
+    def stopJog(self):
+        with self.__condition:
+            self.__jogStep = None
+            self.__condition.notify_all()
+
+    def clear(self):
+        with self.__condition:
+            self.__queue.clear()
+            self.__condition.notify_all()
+
+    def waitUntilIdle(self, timeout=None):
+        with self.__condition:
+            return self.__condition.wait_for(self.__isIdle, timeout)
+
+    def numPending(self):
+        with self.__condition:
+            return len(self.__queue) + self.__busy
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            self.__queue.clear()
+            self.__jogStep = None
+            self.__condition.notify_all()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__busy = False
+                self.__condition.notify_all()
+                item = self.__nextItem()
+                if item is None:
+                    return
+                key, action, onDone = item
+                self.__busy = True
+
+            if key == JOG_KEY:
+                action = f"C05,{round(action[0], 3)},{round(action[1], 3)}"
+            try:
+                if key == CONTINUOUS_JOG_KEY and action is None:
+                    # The continuous jog stopped, wait for the moves in flight to finish, with the handshake they already did
+                    result = not self.__ArduinoComms.isStreaming() or self.__ArduinoComms.waitForComplete()
+                elif key == CONTINUOUS_JOG_KEY:
+                    # Next move of the continuous jog, it is not waited for
+                    # Only jogAhead moves in flight, so the jog stops soon after stopJog()
+                    result = self.__ArduinoComms.queueCommand(f"C05,{action[0]},{action[1]}", self.__jogAhead)
+                    if not result:
+                        self.stopJog()
+                elif callable(action):
+                    result = action()
+                else:
+                    result = self.__ArduinoComms.sendSingleCommand(action)
+            except Exception as e:
+                # The thread has to keep running for the next command
+                self.__userFeedbackQueue.put(f"Command failed: {e}")
+                result = False
+            if onDone is not None:
+                onDone(result)
+
+    def __nextItem(self):
+        """
+        Waits for the next [key, action, onDone] to run, or returns None when the dispatcher stops. Called holding the condition.
+        Queued commands go first, a move of the continuous jog is [CONTINUOUS_JOG_KEY, (dX, dY), None]
+        and its end is [CONTINUOUS_JOG_KEY, None, None].
+        """
+        while self.__running:
+            if self.__queue:
+                return self.__queue.popleft()
+            if self.__jogStep is not None:
+                self.__jogSent = True
+                return [CONTINUOUS_JOG_KEY, self.__jogStep, None]
+            elif self.__jogSent:
+                self.__jogSent = False
+                return [CONTINUOUS_JOG_KEY, None, None]
+            else:
+                self.__condition.wait()
+        return None
+
+    def __isIdle(self):
+        return not self.__queue and not self.__busy and self.__jogStep is None and not self.__jogSent
+
+    def __clampJog(self, distance):
+        return max(-self.__maxJogDistance, min(self.__maxJogDistance, distance))
@@ -0,0 +1,102 @@
+import threading
+from queue import Queue, Empty, Full
+
+class CommandPipeline:
+    """
+    Prepares items from an iterator in a seperate thread so they are ready before they are needed.
+    Used so the next commands are read and converted while the device is still running the current one.
+    Items are passed between threads in small batches. At most depth batches are held at once, 
+    so memory stays the same no matter how long the iterator is.
+
+    The pipeline is iterated like any other iterator. Errors raised by the source are raised when iterating.
+    close() -> Stops the thread early, for example when a GCODE run is stopped.
+    """
+    def __init__(self, source, depth=8, batchSize=64):
+        self.__source = source
+        self.__batchSize = batchSize
+        self.__queue = Queue(maxsize=depth)
+        self.__closed = threading.Event()
+        # Batch currently being iterated
+        self.__batch = []
+        self.__index = 0
+        # Marks the end of the source in the queue
+        self.__end = object()
+        self.__thread = threading.Thread(target=self.__fill, daemon=True)
+        self.__thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__index >= len(self.__batch):
+            batch = self.__queue.get()
+            if batch is self.__end:
+                # Leave the marker so further calls also stop
+                self.__queue.put(batch)
+                raise StopIteration
+            if isinstance(batch, _PipelineError):
+                self.__queue.put(self.__end)
+                raise batch.error
+            self.__batch = batch
+            self.__index = 0
+        item = self.__batch[self.__index]
+        self.__index += 1
+        return item
+
+    def close(self):
+        """
+        Stops the thread filling the pipeline. Any prepared items are thrown away.
+        """
+        self.__closed.set()
+        # Empty the queue so a blocked put() can finish
+        try:
+            while True:
+                self.__queue.get_nowait()
+        except Empty:
+            pass
+        self.__thread.join()
+
+    def __fill(self):
+        """
+        Runs in the pipeline thread, moves items from the source to the queue.
+        A batch is passed on when it is full, or straight away if the queue is empty,
+        so the first items are never held back waiting for a full batch.
+        """
+        batch = []
+        try:
+            for item in self.__source:
+                batch.append(item)
+                if len(batch) >= self.__batchSize or self.__queue.empty():
+                    if not self.__put(batch):
+                        return
+                    batch = []
+        except Exception as e:
+            self.__put(_PipelineError(e))
+            return
+        finally:
+            # Closes files held open by generators
+            if hasattr(self.__source, "close"):
+                self.__source.close()
+        if batch:
+            if not self.__put(batch):
+                return
+        self.__put(self.__end)
+
+    def __put(self, item):
+        """
+        Waits for space in the queue, returns False if the pipeline was closed while waiting.
+        """
+        while not self.__closed.is_set():
+            try:
+                self.__queue.put(item, timeout=0.05)
+                return True
+            except Full:
+                continue
+        return False
+
+class _PipelineError:
+    """
+    Carries an error from the pipeline thread to the thread iterating the pipeline.
+    """
+    def __init__(self, error):
+        self.error = error
@@ -1,6 +1,9 @@
 import serial
 import serial.tools.list_ports
-import time
+import asyncio
+import threading
+
+from AsyncComms import AsyncUSBComm
 
 class USBComm:
     """
@@ -9,257 +12,132 @@ class USBComm:
     (not including the command itself C00-C99) The commands can be up to 70 characters.
 
     userFeedBackQueue -> Queue of strings that can be accessed eternally for User feedback.
+    progress -> Optional ProgressChannel, each command sent is set as its last command instead of being put on userFeedBackQueue,
+                so a long run does not fill the queue with commands.
 
     sendSingleCommand(command) -> sends command to device and waits for command to complete. Updates userFeedBackQueue with sent command or if the command failed.
-    readRemainingData() -> Reads any data left in the serial buffer. Waits for device to send back READY signal.
+    queueCommand(command, window) -> In streaming mode sends a command without waiting for it to complete, only for space in the window
+                                     (or for fewer than window commands in flight). Otherwise the same as sendSingleCommand().
+    startStreaming() -> Asks the device to start streaming mode, if a stream window was given. Called by startComm().
+    isStreaming() -> Returns if streaming mode is being used.
+    numInFlight() -> Returns the number of streamed commands the device has not completed yet, 0 if not streaming.
+    setBinaryFrames(binaryFrames) -> Asks for binary frames when streaming starts on the next connection.
+    isBinary() -> Returns if commands are being sent as binary frames.
+    waitForComplete() -> Waits for the command sent to complete, or for every streamed command to be acknowledged.
     testConnection() -> tests the connection with the USB device. Updates userFeedBackQueue if device is not connected.
     testConnectionNoOutput() -> Same as above but does not Update userFeedBackQueue.
     endComm() -> Ends connection to a USB device if a device is connected.
     startComm(port) -> starts communication on a port. The port should be a string like COM1 or COM15
+    connectDevice(device, name, bootDelay) -> starts communication with an open serial.Serial like device, ex.) a PolargraphEmulator.
+    getAsyncComm() -> Returns (AsyncUSBComm, event loop), for code that wants to await the device on the same connection (see asyncio.run_coroutine_threadsafe()).
     getPortsDesciptions() -> Gets desciptions of ports for a User to select. Returns list of strings.
     getPorts() -> Gets the actual names of ports for startComm. Returns list of strings. The indicies of the list match the indicicies of the list returned by getPortsDesciptions()
 
+    The protocol (handshake, streaming mode, binary frames) is in AsyncUSBComm. It runs on an asyncio event loop in
+    a thread owned by this class, and the methods above are thin wrappers that run its coroutines there and wait for the result.
+    Every caller (the GUI, the GCODE thread) goes through the same loop, so their commands are never mixed up.
+    The wrappers must not be called from a coroutine running on that loop, await the AsyncUSBComm instead.
     """
-    def __init__(self, userFeedbackQueue):
-        # Holds the instance of the "serial" used to actuall communicate
-        self.__device = None
-        # Queue that is used to provide feedback in real time to a user
-        self.__userFeedbackQueue = userFeedbackQueue
+    def __init__(self, userFeedbackQueue, streamWindow=0, binaryFrames=False, progress=None):
+        self.__comm = AsyncUSBComm(userFeedbackQueue, streamWindow, binaryFrames, progress)
+        # Event loop the AsyncUSBComm runs on
+        self.__loop = asyncio.new_event_loop()
+        self.__loopThread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.__loopThread.start()
 
         # Constants
-        # Loop wait time, time after sending command that device has to process the command
-        self.__loopWaitTime = 0.0001
         # Flag to print debug info to terminal
         self.__debug = False
-        # Baud rate of connection
-        self.__baudRate = 1000000
-        # time in loop before giving up on waiting from reply from connected device
-        self.__loopTimeout = 3
-        # Seconds of delay after making initial connection to com port
-        self.__bootDelay = 2 
-        # Max characters in a single command
-        self.__maxCharacters = 70
 
     def sendSingleCommand(self, command):
         """
-        Checks for connection, sends a command, waits for the command to be completed. 
-        Device should send back the commands within the self.__loopTimeout amount of time.
-        The WaitForComplete() may take as long as needed for the command to finish.
+        Checks for connection, sends a command, waits for the command to be completed.
         """
-        if not self.testConnection():
-            return
+        return self.__run(self.__comm.sendSingleCommand(command))
 
-        completed = self.__sendCommand(command)
-        if completed:
-            completed = self.waitForComplete()
-        return completed
+    def queueCommand(self, command, window=None):
+        """
+        In streaming mode, sends a command as soon as there is space in the window and returns without waiting for it to complete.
+        Use waitForComplete() to wait for every queued command. If not streaming this is the same as sendSingleCommand().
+        window waits until fewer than window commands are in flight, if it is smaller than the stream window.
+        Returns False if the device stopped (ESTOP or reset) or the connection was lost.
+        """
+        return self.__run(self.__comm.send(command, window))
 
     def waitForComplete(self):
         """
         Waits for the device to send back either a READY signal or a CMD_COMPLETE signal.
         Returns true or false indicating if waitForComplete ended correctly.
         """
-        if self.__debug:
-            print("---------------WAIT FOR COMPLETE---------------")
-        data = ""
-        while True:
-            # Check device is still connected
-            if not self.testConnectionNoOutput():
-                return False
-            newData = self.__device.readline()
-
-            try:
-                data += newData.decode()
+        return self.__run(self.__comm.waitForComplete())
 
-            except UnicodeDecodeError:
-                if self.__debug:
-                    print("Unicdode Decode Error")
-                if self.__debug:
-                    print(str(data))
-                continue
+    def startStreaming(self):
+        """
+        Asks the device to start streaming mode. Does nothing if no stream window was given or already streaming.
+        Returns True if streaming mode is being used.
+        """
+        return self.__run(self.__comm.startStreaming())
 
-            data = data.replace("\n", "")
+    def isStreaming(self):
+        return self.__comm.isStreaming()
 
-            # Check if major error as occured
-            if("ESTOP_PRESSED" in data):
-                return False
-            elif "POLARGRAPH ON!" in data:
-                # Check if major error as occured
-                if self.__debug:
-                    print("device Reset.")
-                return False
-            elif "CMD_COMPLETE" in data:
-                # Wait is complete if this was received
-                if self.__debug:
-                    print("CMD_COMPLETE Received: " + data)
-                break
-            elif "READY" in data:
-                # Wait is complete if this was received
-                if self.__debug:
-                    print("READY Received: " + data)
-                break
-            elif data != "":
-                if self.__debug:
-                    print("Other Received: " + data)
-            
-            time.sleep(self.__loopWaitTime)
-        
-        if self.__debug:
-            print("---------------\n")
-        
-        return True
+    def numInFlight(self):
+        return self.__comm.numInFlight()
 
-    def __sendCommand(self, command):
+    def setBinaryFrames(self, binaryFrames):
         """
-        Sends a command to the device, 
-        waits for the command to be sent back, verifies if the command is correct.
+        Used the next time streaming starts, ex.) on the next startComm().
         """
-        # If command is missing components add them
-        if(",END" not in command):
-            command += ",END"
-        elif("END" not in command):
-            command += "END"
-        if("\n" not in command):
-            command += "\n"
-        
-        if self.__debug:
-            print("---------------SEND COMMAND---------------")
-            print("Sending: " + command)
+        self.__comm.setBinaryFrames(binaryFrames)
 
-        # Send the data to the device, checks that the command sent correctly
-        if not self.__sendData(command):
-            self.__userFeedbackQueue.put("Failed to Send Command.\nInternal Error.")
-            return False
-        else:
-            self.__userFeedbackQueue.put(command)
-        
-        
-        # Waits for the command to be sent back from the device, verifies the command matches
-        checkCommand = command.replace("\n", "") # Remove newlines from command
-        startTime = time.time()
-        data = ""
-        while True:
-            # Check that the wait for received command has not errored out
-            if (time.time()-startTime) > self.__loopTimeout:
-                break
-            
-            # Read the current data from the device
-            newData = self.__device.readline()
-            try:
-                data += newData.decode()
-            except UnicodeDecodeError:
-                if self.__debug:
-                    print("Unicdode Decode Error")
-                if self.__debug:
-                    print(str(data))
-                continue
-            
-            # Remove newlines from data
-            data = data.replace("\n", "")
-            
-            # Check data is not empty
-            if data != "":
-                if self.__debug:
-                    print("Received: " + data)
-            else:
-                continue
-            
-            # Check incoming data for error
-            if "POLARGRAPH ON!" in data:
-                # The device reset and a major error must have occured
-                if self.__debug:
-                    print("device Reset.")
-                return False
-            elif checkCommand in data:
-                # the command was received correctly and the device sent back the same command
-                break
-            elif "READY" in data:
-                # Some kind of error occured, resend the command
-                self.__sendData(command)
-            
-            # Added delay to allow buffer to receive entire commands and to reduce processing
-            time.sleep(self.__loopWaitTime)
-        
-        if self.__debug:
-            print("Sending:" + "CHECKED" )
+    def isBinary(self):
+        return self.__comm.isBinary()
 
-        # Send back CHECKED to indicate that the command was verified and the device can execute the command
-        if not self.__sendData("CHECKED\n"):
-            return False
-        
-        # Allow at least one self.__loopWaitTime to occur
-        time.sleep(self.__loopWaitTime)
-        # Read in the serial buffer to clear it
-        data = self.__device.readline()
-        
-        if self.__debug:
-            print("---------------\n")
-        return True
+    def getAsyncComm(self):
+        return self.__comm, self.__loop
 
-    def __sendData(self, data):
+    def __run(self, coroutine):
         """
-        Encodes and sends string over serial.
+        Runs a coroutine on the event loop thread and waits for its result.
         """
-        if len(data) >= self.__maxCharacters:
-            if self.__debug:
-                print("Too much data.")
-            return False
-        
-        encodedData = data.encode()
-        
-        self.__device.write(encodedData)
-
-        #Give device a chance to process
-        time.sleep(self.__loopWaitTime)
-        return True
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
 
     # REGION Comm selction start and end, testing connection
     def testConnection(self):
         """
         Tests for any comm connection, adds an error to userFeedbackQueue if needed.
         """
-        if self.testConnectionNoOutput():
-            return True
-        else:
-            self.__userFeedbackQueue.put("Device Not Connected.")
-            return False
-    
+        return self.__comm.testConnection()
+
     def testConnectionNoOutput(self):
         """
         Tests for any comm connection without adding anything to the userFeedbackQueue.
         """
-        if self.__device is None:
-            return False
-        elif not self.__device.is_open:
-            return False
-        else:
-            return True
-        
+        return self.__comm.testConnectionNoOutput()
+
     def endComm(self):
         """
-        Closes connection of Comm port. 
+        Closes connection of Comm port.
         Checks that port is open first.
+        Runs on the event loop, so a coroutine waiting on the device never sees the connection half closed.
         """
-        if self.testConnectionNoOutput():
-            self.__device.close()
+        self.__run(self.__endComm())
+
+    async def __endComm(self):
+        self.__comm.endComm()
 
     def startComm(self, port):
         """
-        Starts serial communication with the specified port. 
+        Starts serial communication with the specified port.
         """
-        try:
-            self.__device = serial.Serial(port=port, baudrate=self.__baudRate, timeout=1)
-            self.__userFeedbackQueue.put(f"Connected to {port}.")
-            #devices and other devices reset when connected, this delay gives them a chance to boot properly
-            time.sleep(self.__bootDelay) 
-            if self.__debug:
-                print(f"Connected to {port}.")
-        except serial.SerialException as e:
-            self.__userFeedbackQueue.put(f"Failed to connect to {port}: {e}")
-            if self.__debug:
-                print(e)
-            self.__device = None
+        self.__run(self.__comm.startComm(port))
 
+    def connectDevice(self, device, name, bootDelay=0.0):
+        """
+        Uses a device that is already open, anything with the same methods as serial.Serial, ex.) a PolargraphEmulator.
+        Waits bootDelay seconds for the device to boot. name is shown to the user.
+        """
+        self.__run(self.__comm.connectDevice(device, name, bootDelay))
 
     def getPortsDesciptions(self):
         """
@@ -0,0 +1,666 @@
+import os
+import math
+import time
+import random
+import threading
+from collections import deque
+
+from BinaryFrame import BinaryFrame, BINARY_FRAME_SYNC, BINARY_FRAME_LENGTH
+from TimeEstimator import (PrintTimeEstimator, STEPS_PER_LENGTH, MAX_EVER_SPEED, SEGMENT_END_DELAY,
+                           PEN_UP_POSITION, PEN_DOWN_POSITION, PEN_LIFT_SPEED)
+
+# These match PolargraphGCODEController.ino
+INLENGTH = 80
+READY_STR = "READY"
+COMMAND_COMPLETE = "CMD_COMPLETE"
+ESTOP_PRESSED = "ESTOP_PRESSED"
+CHECKED = "CHECKED"
+DEFAULT_SPEED = 25
+STREAM_SLOTS = 8
+STREAM_SEQ_MOD = 256
+# pos.ino
+MAX_POS_X = 600.0
+MAX_POS_Y = 800.0
+INTERPOLATION_LENGTH = 0.05 # mm between positions of linear moves and arcs
+PEN_MOVE_TIME = (PEN_DOWN_POSITION - PEN_UP_POSITION + 1)*PEN_LIFT_SPEED
+
+class PolargraphEmulator:
+    """
+    Software stand in for the plotter, it speaks the same serial protocol as the firmware (comms.ino, util.ino).
+    It can be used in place of a serial.Serial (write, read, readline, in_waiting, reset_input_buffer, close),
+    or served on a pseudo terminal with servePty() so USBComm can connect to it like a real port (linux only).
+
+    Protocol:
+    READY every readyInterval seconds while idle, each received line is echoed, CHECKED runs the last line
+    (RUNNING, Running Commands, CMD_COMPLETE), POLARGRAPH ON! after a reset, ESTOP_PRESSED while the estop is pressed.
+    Streaming mode (C17) is supported with S<seq> frames or binary frames (see BinaryFrame), ACK and NAK.
+    Batches of linear moves (C18) are run like CMD_Polyline().
+
+    baudRate -> Bytes take 10/baudRate seconds each on the wire, in both directions.
+    echoLatency -> Extra seconds before each reply line, ex.) USB latency.
+    timeScale -> Multiplies the time commands take to run, 0 runs them instantly.
+    garbleRate -> Chance (0-1) that each byte sent by the device is replaced with a random byte.
+    inputGarbleRate -> Chance (0-1) that each byte received by the device is replaced with a random byte.
+    resetEvery -> The device resets after this many commands, 0 never resets.
+    streaming -> If False, C17 is ignored like older firmware.
+    seed -> Seed of the random garbled bytes.
+
+    reset() -> Resets the device, like pressing the reset button.
+    pressEstop(), releaseEstop() -> Presses or releases the estop button.
+    servePty() -> Serves the emulator on a pseudo terminal and returns the port name to connect to.
+    commandsRun -> List of every command that was run, in order.
+    position() -> Returns the current (X, Y) of the pen.
+    bytesReceived, bytesSent -> Bytes on the wire in each direction.
+    """
+    def __init__(self, baudRate=1000000, echoLatency=0.0, timeScale=1.0, garbleRate=0.0, inputGarbleRate=0.0, resetEvery=0, streaming=True, 
+                 seed=None, timeout=1):
+        self.baudrate = baudRate
+        self.timeout = timeout
+        self.is_open = True
+        self.__echoLatency = echoLatency
+        self.__timeScale = timeScale
+        self.__garbleRate = garbleRate
+        self.__inputGarbleRate = inputGarbleRate
+        self.__resetEvery = resetEvery
+        self.__streamingSupported = streaming
+        self.__random = random.Random(seed)
+        self.__readyInterval = 0.5
+        # Partly received lines are thrown away after 100ms with no new bytes
+        self.__partialLineTimeout = 0.1
+        # Minimum time to calculate one interpolated position, same as PrintTimeEstimator
+        self.__positionTime = 0.0002
+        self.__estimator = PrintTimeEstimator()
+
+        self.commandsRun = []
+        self.bytesReceived = 0
+        self.bytesSent = 0
+
+        # Bytes from the host, (time the last byte arrives, bytes)
+        self.__input = deque()
+        self.__inputReady = threading.Condition()
+        self.__inputWireFree = 0.0
+        # Bytes from the device, (time they can be read, bytes)
+        self.__output = deque()
+        self.__outputReady = threading.Condition()
+        self.__outputWireFree = 0.0
+
+        self.__estop = False
+        self.__resetRequested = False
+        self.__closed = threading.Event()
+        self.__ptyThreads = []
+        self.__ptyFds = ()
+        self.__resetState()
+
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    # REGION serial.Serial interface
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Emulator is closed.")
+        data = bytearray(data)
+        if self.__inputGarbleRate > 0:
+            for i in range(len(data)):
+                if self.__random.random() < self.__inputGarbleRate:
+                    data[i] = self.__random.randrange(256)
+        data = bytes(data)
+        with self.__inputReady:
+            now = time.perf_counter()
+            self.__inputWireFree = max(now, self.__inputWireFree) + len(data)*10/self.baudrate
+            self.__input.append((self.__inputWireFree, data))
+            self.bytesReceived += len(data)
+            self.__inputReady.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        """
+        Reads up to size bytes, waits up to timeout seconds for them.
+        """
+        data = bytearray()
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        with self.__outputReady:
+            while len(data) < size:
+                data += self.__takeOutput(size - len(data))
+                if len(data) >= size or not self.__waitOutput(deadline):
+                    break
+        return bytes(data)
+
+    def readline(self):
+        """
+        Reads up to and including a newline, waits up to timeout seconds.
+        """
+        data = bytearray()
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        with self.__outputReady:
+            while True:
+                data += self.__takeOutput(None, untilNewline=True)
+                if data.endswith(b"\n") or not self.__waitOutput(deadline):
+                    break
+        return bytes(data)
+
+    @property
+    def in_waiting(self):
+        with self.__outputReady:
+            now = time.perf_counter()
+            return sum(len(chunk) for ready, chunk in self.__output if ready <= now)
+
+    def reset_input_buffer(self):
+        with self.__outputReady:
+            now = time.perf_counter()
+            while self.__output and self.__output[0][0] <= now:
+                self.__output.popleft()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self.__closed.set()
+        with self.__inputReady:
+            self.__inputReady.notify_all()
+        with self.__outputReady:
+            self.__outputReady.notify_all()
+        for fd in self.__ptyFds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.__ptyFds = ()
+
+    # REGION Fault injection
+    def reset(self):
+        """
+        Resets the device on its next loop, any command running is stopped and any received bytes are lost.
+        """
+        self.__resetRequested = True
+        with self.__inputReady:
+            self.__inputReady.notify_all()
+
+    def pressEstop(self):
+        self.__estop = True
+        with self.__inputReady:
+            self.__inputReady.notify_all()
+
+    def releaseEstop(self):
+        self.__estop = False
+
+    def position(self):
+        return self.__currentXpos, self.__currentYpos
+
+    def servePty(self):
+        """
+        Opens a pseudo terminal and copies bytes between it and the emulator.
+        Returns the name of the port, ex.) /dev/pts/3, to pass to USBComm.startComm(). Linux only.
+        """
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.__ptyFds = (master, slave)
+
+        def hostToDevice():
+            while not self.__closed.is_set():
+                try:
+                    data = os.read(master, 4096)
+                except OSError:
+                    return
+                if data:
+                    self.write(data)
+
+        def deviceToHost():
+            while not self.__closed.is_set():
+                # Waits for one byte, then takes everything that has arrived
+                data = self.read(1)
+                if data:
+                    data += self.read(self.in_waiting)
+                    try:
+                        os.write(master, data)
+                    except OSError:
+                        return
+
+        # The emulator is read by deviceToHost, so reads should not wait long
+        self.timeout = 0.01
+        for target in (hostToDevice, deviceToHost):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.__ptyThreads.append(thread)
+        return os.ttyname(slave)
+
+    # REGION Wire
+    def __println(self, line):
+        """
+        Serial.println(), the line is readable once it has been sent over the wire.
+        """
+        data = bytearray((line + "\r\n").encode())
+        if self.__garbleRate > 0:
+            for i in range(len(data)):
+                if self.__random.random() < self.__garbleRate:
+                    data[i] = self.__random.randrange(256)
+        with self.__outputReady:
+            now = time.perf_counter()
+            start = max(now + self.__echoLatency, self.__outputWireFree)
+            self.__outputWireFree = start + len(data)*10/self.baudrate
+            self.__output.append((self.__outputWireFree, bytes(data)))
+            self.bytesSent += len(data)
+            self.__outputReady.notify_all()
+
+    def __takeOutput(self, size, untilNewline=False):
+        """
+        Takes bytes that have arrived from the output, called with __outputReady held.
+        """
+        data = bytearray()
+        now = time.perf_counter()
+        while self.__output and self.__output[0][0] <= now:
+            ready, chunk = self.__output[0]
+            take = len(chunk)
+            if size is not None:
+                take = min(take, size - len(data))
+            if untilNewline and b"\n" in chunk[:take]:
+                take = chunk.index(b"\n") + 1
+            data += chunk[:take]
+            if take < len(chunk):
+                self.__output[0] = (ready, chunk[take:])
+            else:
+                self.__output.popleft()
+            if (size is not None and len(data) >= size) or (untilNewline and data.endswith(b"\n")):
+                break
+        return data
+
+    def __waitOutput(self, deadline):
+        """
+        Waits until more output has arrived, returns False if the deadline passed first.
+        """
+        now = time.perf_counter()
+        if deadline is not None and now >= deadline:
+            return False
+        wait = None if deadline is None else deadline - now
+        if self.__output:
+            # Something is on the wire, wait for it to arrive
+            arrive = self.__output[0][0] - now
+            wait = arrive if wait is None else min(wait, arrive)
+        self.__outputReady.wait(max(wait, 0) if wait is not None else 0.05)
+        return self.is_open
+
+    def __nextByte(self, deadline):
+        """
+        Device side Serial.read(), returns the next byte from the host or None if nothing arrives before deadline.
+        """
+        with self.__inputReady:
+            while True:
+                if self.__closed.is_set() or self.__resetRequested:
+                    return None
+                now = time.perf_counter()
+                if self.__input and self.__input[0][0] <= now:
+                    ready, chunk = self.__input[0]
+                    if len(chunk) > 1:
+                        self.__input[0] = (ready, chunk[1:])
+                    else:
+                        self.__input.popleft()
+                    return chunk[0]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self.__input:
+                    wait = min(wait, self.__input[0][0] - now)
+                self.__inputReady.wait(max(wait, 0))
+
+    # REGION Firmware
+    def __resetState(self):
+        self.__currentXpos = 0.0
+        self.__currentYpos = 0.0
+        self.__relativeCoords = False
+        self.__isPenUp = True
+        self.__speed = DEFAULT_SPEED
+        self.__lastCommand = ""
+        self.__streamMode = False
+        self.__ring = deque()
+        self.__streamLine = bytearray()
+        self.__streamExpectedSeq = 0
+        self.__streamBinary = False
+        self.__numCommands = 0
+
+    def __boot(self):
+        """
+        setup()
+        """
+        with self.__inputReady:
+            self.__input.clear()
+        self.__resetRequested = False
+        self.__resetState()
+        self.__println("POLARGRAPH ON!")
+        # servo_setup() moves the pen down and back up
+        self.__runFor(2*PEN_MOVE_TIME)
+        self.__println("SETUP COMPLETE!")
+
+    def __run(self):
+        self.__boot()
+        while not self.__closed.is_set():
+            if self.__resetRequested:
+                self.__boot()
+            if self.__streamMode:
+                self.__streamLoop()
+                continue
+
+            line = self.__waitForNextCommand()
+            if line is None:
+                continue
+            # send command to be checked
+            self.__println(line)
+            if line == CHECKED:
+                self.__println("RUNNING")
+                self.__parseAndExecuteCommand(self.__lastCommand)
+                if self.__resetRequested:
+                    continue
+                self.__println(COMMAND_COMPLETE)
+            else:
+                self.__lastCommand = line
+
+    def __waitForNextCommand(self):
+        """
+        comms_waitForNextCommand(), READY every readyInterval while idle, partial lines time out.
+        """
+        buf = bytearray()
+        idleTime = time.perf_counter()
+        lastRxTime = idleTime
+        while not self.__closed.is_set() and not self.__resetRequested:
+            now = time.perf_counter()
+            if buf and (now - lastRxTime) > self.__partialLineTimeout:
+                buf.clear()
+            self.__checkEstop()
+            if (now - idleTime) > self.__readyInterval:
+                self.__println(READY_STR)
+                idleTime = now
+
+            deadline = idleTime + self.__readyInterval
+            if buf:
+                deadline = min(deadline, lastRxTime + self.__partialLineTimeout)
+            ch = self.__nextByte(deadline)
+            if ch is None:
+                continue
+            lastRxTime = time.perf_counter()
+            if ch == ord("\n") or ch == ord(";"):
+                return buf[:INLENGTH].decode("latin-1")
+            buf.append(ch)
+        return None
+
+    def __checkEstop(self):
+        """
+        EstopPressed()
+        """
+        if self.__estop:
+            self.__println(ESTOP_PRESSED)
+            return True
+        return False
+
+    def __parseAndExecuteCommand(self, command):
+        """
+        comms_parseAndExecuteCommand(), comms_extractParams() and util_processCommand()
+        """
+        if ",END" not in command:
+            self.__println(f"MSG,E,Comm ({command}) not parsed.")
+            return
+        params = command[:command.index(",END")].split(",")
+        name = params[0]
+        values = []
+        for param in params[1:5]:
+            try:
+                values.append(float(param))
+            except ValueError:
+                # atof() returns 0 for anything it can't read
+                values.append(0.0)
+        values += [0.0]*(4 - len(values))
+
+        self.__println("Running Commands")
+        self.commandsRun.append(command)
+        self.__numCommands += 1
+        if name == "C18":
+            # CMD_Polyline() reads every param, not only the first 4
+            self.__polyline(params[1:])
+        else:
+            self.__execute(name, values)
+        if self.__resetEvery and self.__numCommands >= self.__resetEvery:
+            self.__resetRequested = True
+
+    def __execute(self, name, values):
+        X, Y, I, J = values
+        if name == "C00":
+            self.__moveTo(X, Y, relative=self.__relativeCoords)
+        elif name == "C01":
+            self.__moveTo(X, Y, relative=self.__relativeCoords, segmentEnd=True)
+        elif name in ("C02", "C03"):
+            self.__arcTo(X, Y, I, J, clockwise=(name == "C02"))
+        elif name == "C05":
+            self.__moveTo(X, Y, relative=True)
+        elif name == "C06":
+            self.__penUp()
+            self.__moveTo(0.0, 0.0, relative=False)
+        elif name == "C07":
+            self.__speed = X
+        elif name == "C10":
+            if self.__isPenUp:
+                self.__runFor(PEN_MOVE_TIME)
+                self.__isPenUp = False
+        elif name == "C11":
+            self.__penUp()
+        elif name == "C16":
+            self.__currentXpos = 0.0
+            self.__currentYpos = 0.0
+        elif name == "C90":
+            self.__relativeCoords = False
+        elif name == "C91":
+            self.__relativeCoords = True
+        elif name == "C17":
+            self.__setStreamMode(int(X), int(Y) == 1)
+        # C04 pause, C12 stop motors, C13/C14 user input and C15 test do nothing here
+
+    def __polyline(self, params):
+        """
+        CMD_Polyline(), pairs of X, Y offsets in 0.01mm added up from where the move starts.
+        Stops at the first param that is not a whole number, like strtol().
+        """
+        startX, startY = self.__currentXpos, self.__currentYpos
+        offsetX, offsetY = 0, 0
+        for index in range(0, len(params) - 1, 2):
+            try:
+                dx, dy = int(params[index]), int(params[index + 1])
+            except ValueError:
+                return
+            offsetX += dx
+            offsetY += dy
+            self.__moveTo(startX + offsetX/100.0, startY + offsetY/100.0, relative=False, segmentEnd=True)
+            if self.__estop or self.__resetRequested:
+                return
+
+    def __penUp(self):
+        if not self.__isPenUp:
+            self.__runFor(PEN_MOVE_TIME)
+            self.__isPenUp = True
+
+    def __validPosition(self, X, Y):
+        """
+        checkValidPosition()
+        """
+        if X < 0 or X > MAX_POS_X:
+            self.__println("Invalid Position X")
+            return False
+        if Y > 0 or Y < -MAX_POS_Y:
+            self.__println("Invalid Position Y")
+            return False
+        return True
+
+    def __moveTo(self, X, Y, relative, segmentEnd=False):
+        if relative:
+            X += self.__currentXpos
+            Y += self.__currentYpos
+        if not self.__validPosition(X, Y):
+            return
+        distance = math.hypot(X - self.__currentXpos, Y - self.__currentYpos)
+        if segmentEnd:
+            seconds = self.__interpolatedTime(distance) + SEGMENT_END_DELAY
+        else:
+            seconds = self.__directTime(X, Y)
+        if self.__runFor(seconds):
+            self.__currentXpos = X
+            self.__currentYpos = Y
+
+    def __arcTo(self, X, Y, I, J, clockwise):
+        if self.__relativeCoords:
+            X += self.__currentXpos
+            Y += self.__currentYpos
+        if not self.__validPosition(X, Y):
+            return
+        disX = X - self.__currentXpos
+        disY = Y - self.__currentYpos
+        radius = math.hypot(disX - I, disY - J)
+        start = math.atan2(-J, -I) % (2*math.pi)
+        end = math.atan2(disY - J, disX - I) % (2*math.pi)
+        angle = (start - end) if clockwise else (end - start)
+        if angle < 0:
+            angle += 2*math.pi
+        if self.__runFor(self.__interpolatedTime(radius*angle) + 2*SEGMENT_END_DELAY):
+            self.__currentXpos = X
+            self.__currentYpos = Y
+
+    def __stepsPerSecond(self):
+        return max(self.__speed, 0.01)/100*MAX_EVER_SPEED
+
+    def __directTime(self, X, Y):
+        """
+        movePositionDirect(), both motors step at the same speed so it takes as long as the motor with more steps.
+        """
+        L, R = self.__estimator.calcMotorPos([self.__currentXpos, X], [self.__currentYpos, Y])
+        steps = max(abs(L[1] - L[0]), abs(R[1] - R[0]))
+        return float(steps)/self.__stepsPerSecond()
+
+    def __interpolatedTime(self, length):
+        """
+        Linear moves and arcs step through positions INTERPOLATION_LENGTH apart. A belt never changes by more 
+        than the distance moved, so this is the time to move length mm of belt, or to calculate every position.
+        """
+        numPositions = math.ceil(length/INTERPOLATION_LENGTH)
+        return max(length*STEPS_PER_LENGTH/self.__stepsPerSecond(), numPositions*self.__positionTime)
+
+    def __runFor(self, seconds):
+        """
+        The device is busy for seconds (scaled by timeScale). In streaming mode frames are still received.
+        Returns False if the estop was pressed or the device reset.
+        """
+        end = time.perf_counter() + seconds*self.__timeScale
+        while True:
+            if self.__checkEstop() or self.__resetRequested:
+                return False
+            now = time.perf_counter()
+            if now >= end:
+                return True
+            if self.__streamMode:
+                ch = self.__nextByte(min(end, now + 0.01))
+                if ch is not None:
+                    self.__streamByte(ch)
+            else:
+                time.sleep(min(end - now, 0.01))
+
+    # REGION Streaming
+    def __setStreamMode(self, window, binary=False):
+        """
+        comms_setStreamMode(), older firmware (streaming=False) does nothing.
+        """
+        if not self.__streamingSupported:
+            return
+        self.__ring.clear()
+        self.__streamLine = bytearray()
+        self.__streamExpectedSeq = 0
+        self.__streamMode = window > 0
+        self.__streamBinary = self.__streamMode and binary
+        if self.__streamBinary:
+            self.__println(f"STREAM,{STREAM_SLOTS},1")
+        elif self.__streamMode:
+            self.__println(f"STREAM,{STREAM_SLOTS}")
+
+    def __streamLoop(self):
+        """
+        comms_streamLoop()
+        """
+        idleTime = time.perf_counter()
+        while self.__streamMode and not self.__closed.is_set() and not self.__resetRequested:
+            if self.__checkEstop():
+                self.__setStreamMode(0)
+                return
+            if not self.__ring:
+                now = time.perf_counter()
+                if (now - idleTime) > self.__readyInterval:
+                    self.__println(READY_STR)
+                    idleTime = now
+                ch = self.__nextByte(idleTime + self.__readyInterval)
+                if ch is not None:
+                    self.__streamByte(ch)
+                continue
+
+            seq, command = self.__ring.popleft()
+            self.__lastCommand = command
+            self.__parseAndExecuteCommand(command)
+            if self.__resetRequested:
+                return
+            self.__println(f"ACK,{seq}")
+            idleTime = time.perf_counter()
+
+    def __streamByte(self, ch):
+        """
+        comms_streamPoll() for one byte.
+        """
+        if self.__streamBinary:
+            self.__binaryByte(ch)
+            return
+        if ch == ord("\r"):
+            return
+        if ch != ord("\n"):
+            self.__streamLine.append(ch)
+            return
+        line = bytes(self.__streamLine)
+        self.__streamLine = bytearray()
+        if len(line) > INLENGTH:
+            self.__println(f"NAK,{self.__streamExpectedSeq}")
+        elif line:
+            self.__streamFrame(line.decode("latin-1"))
+
+    def __streamFrame(self, frame):
+        """
+        comms_streamFrame()
+        """
+        if not frame.startswith("S"):
+            return
+        seqText, _, command = frame[1:].partition(",")
+        if (not seqText.isdigit()) or (not _) or int(seqText) != self.__streamExpectedSeq or len(self.__ring) >= STREAM_SLOTS:
+            self.__println(f"NAK,{self.__streamExpectedSeq}")
+            return
+        self.__ring.append((int(seqText), command))
+        self.__streamExpectedSeq = (self.__streamExpectedSeq + 1) % STREAM_SEQ_MOD
+
+    def __binaryByte(self, ch):
+        """
+        comms_binaryPoll() for one byte.
+        """
+        if not self.__streamLine and ch != BINARY_FRAME_SYNC:
+            # Wait for the start of a frame
+            return
+        self.__streamLine.append(ch)
+        if len(self.__streamLine) < BINARY_FRAME_LENGTH:
+            return
+        decoded = BinaryFrame.decode(bytes(self.__streamLine))
+        self.__streamLine = bytearray()
+        # comms_binaryFrame()
+        if decoded is None or decoded[0] != self.__streamExpectedSeq or len(self.__ring) >= STREAM_SLOTS:
+            self.__println(f"NAK,{self.__streamExpectedSeq}")
+            return
+        self.__ring.append(decoded)
+        self.__streamExpectedSeq = (self.__streamExpectedSeq + 1) % STREAM_SEQ_MOD
+
+if __name__ == "__main__":
+    # Serves an emulated plotter on a pseudo terminal, connect to the printed port from the application
+    emulator = PolargraphEmulator()
+    port = emulator.servePty()
+    print(f"Emulated plotter on {port}, press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.close()
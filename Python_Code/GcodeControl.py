@@ -1,9 +1,20 @@
-import subprocess
 from PlotPoints import plotPoints
-import re #Used to process gcode commands quickly
+from GcodeLexer import GcodeLexer
+from CommandPipeline import CommandPipeline
+from ProgramCache import ProgramCache
+from Simulator import PolargraphSimulator
+from PointsFile import PointsFile
+from TimeEstimator import PrintTimeEstimator
+from ArcFitter import ArcFitter
+from PathSimplifier import PathSimplifier
+from StrokeOrderer import StrokeOrderer
+from PenLiftOptimizer import PenLiftOptimizer
+from MoveBatcher import MoveBatcher
+from JobJournal import JobJournal
+from GcodeProgram import GcodeProgram, OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW, OP_PAUSE, OP_MOVE_RELATIVE, OP_PEN_DOWN, OP_PEN_UP, OP_ABSOLUTE, OP_RELATIVE
 import time
 import os
-import sys
+from collections import deque
 
 class GcodeControler:
     """
@@ -14,6 +25,14 @@ class GcodeControler:
     setGcodeFile() -> Returns Result)(bool) and Output(Str) indicating if the file was found and updated.
     setSpeed(), getSpeed() -> sets/gets the speed variable (0-100)
     getQuickDistance() -> returns a short distance in mm of speed/20. This is the distance the plotter will jog with the jog buttons
+    setArcTolerance() -> Sets how far (mm) arcs fitted to runs of G01 moves may be from the moves, 0 or None turns arc fitting off (see ArcFitter)
+    setSimplifyTolerance() -> Sets how far (mm) simplified G01 moves may be from the original drawing, 0 or None turns simplifying off (see PathSimplifier)
+    setReorderStrokes() -> Sets if strokes are reordered to shorten the pen up travel before a program is sent or exported (see StrokeOrderer)
+    setJoinTolerance() -> Sets how close (mm) the end of a stroke must be to the start of the next to draw them without lifting the pen, 0 or None turns it off (see PenLiftOptimizer)
+    setBatchMoves() -> Sets if runs of G01 moves are sent as C18 batch commands while a file runs, the plotter needs firmware with C18 (see MoveBatcher)
+    getOptimizationReport() -> Returns a string with how many commands, how much travel and how many servo moves the last optimized program saved
+    getSimulationSettings() -> Returns a dict of the file and settings a simulation depends on, ex.) to simulate in another process (see SimulationWorker)
+    applySimulationSettings(settings) -> Sets the file and settings from getSimulationSettings()
 
     # REGION Switch Pen Up/Down
     switchPen() -> Switches if the pen is or up or down, used with the Pen Up/Down button
@@ -24,26 +43,50 @@ class GcodeControler:
     resumeGcode() -> Resumes any GCODE files that are running on the device
     stopGcode(self) -> Stops any GCODE files that are running on the device
     runGcode(self) -> Runs a GCODE file on the device. Intended to be run as a seperate thread.
+    getResumableJob() -> Returns (True, description) if the last file run stopped before it finished and can be resumed, or (False, reason).
+    resumeJob() -> Re-homes, restores the pen, position and G90/G91, and runs the last file from the last command the device completed. Intended to be run as a seperate thread.
 
     # REGION Simulation Commands
-    plotPoints() -> Plots any points in the points.txt file. Uses some internal variables to also calculate the time of the plot.
-    generateCommandsFile() -> Generates file "polargraphCmds.txt" that is used by GeneratePoints.exe to generate "points.txt.
-    fileWriteSingleCommand() -> Writes a single command to the 
+    simulateFile(onStage) -> Parses, converts (polargraphCmds.txt and ArduinoCommands.txt) and simulates the file in one go,
+                             onStage(stage) is called as each stage starts. Returns (result, text).
+    getSimulation() -> Returns (points, TimeEstimate) of the last simulation, (None, None) if there is none.
+    plotPoints() -> Plots the simulated points, with an estimate of how long the program takes (see PrintTimeEstimator).
+    generatePoints() -> Simulates the last file or command that was converted, the points are saved to "points.npy" for plotPoints().
+    generateCommandsFile() -> Generates file "polargraphCmds.txt" with the commands sent to the plotter, and keeps the program to be simulated.
+    fileWriteSingleCommand() -> Writes a single command to "polargraphCmds.txt", and keeps it to be simulated.
     generateArduinoCommands() -> Generates code for polargraph device that would run the GCODE directly.
 
     """
-    def __init__(self, arduinoComms, queue):
+    def __init__(self, arduinoComms, progress):
         # Set externally, the file the original GCODE commands are read from
         self.__gcodeFile = None
         self.__ArduinoComms = arduinoComms
-        self.__percentageQueue = queue
+        # Latest progress of the file being run for the GUI, see ProgressChannel
+        self.__progress = progress
+        # Splits each line of the GCODE file into words
+        self.__lexer = GcodeLexer()
+        # Parsed programs are kept on disk so simulating, exporting and running a file only parses it once
+        self.__programCache = ProgramCache()
+        # How far the file being run got, so it can be resumed after a reset, ESTOP or lost connection
+        self.__journal = JobJournal()
+        # Runs of G01 moves within this distance (mm) of an arc are replaced by a G02 or G03, set externally
+        self.__arcTolerance = None
+        # Pen down G01 moves closer than this (mm) to the drawing are removed before a program is sent or exported, set externally
+        self.__simplifyTolerance = None
+        # Strokes are drawn in an order that travels less with the pen up, set externally
+        self.__reorderStrokes = False
+        # Strokes that end closer than this (mm) to the start of the next are drawn without lifting the pen, set externally
+        self.__joinTolerance = None
+        self.__optimizationReport = ""
+        # Runs of G01 moves are sent as batch commands (C18), one handshake for several moves, set externally
+        self.__batchMoves = False
         
         # USed to calculate amount of time for movement, set externally
         self.__speed = 20
         
-        # Used to calculate amount of time for movement, these values are set when the simulation is made.
-        self.__numServoMoves = 0
-        self.__numCommands = 0
+        # Program that generatePoints() simulates, and the points it generates for plotPoints()
+        self.__simProgram = None
+        self.__simPoints = None
 
         # Flag used to determine the current position of the pen
         self.__penIsUp = True
@@ -54,8 +97,10 @@ class GcodeControler:
 
         # Constants
         self.__debug = False
+        # Number of batches of converted commands that are read ahead of the command being sent while a file runs
+        self.__pipelineDepth = 8
         # Two files where information is stored
-        self.__pointsFile = "points.txt"
+        self.__pointsFile = "points.npy"
         self.__generatedCommandsFile = "polargraphCmds.txt"
         self.__ArduinoCommandsFile = "ArduinoCommands.txt"
         # Used to define a function that can be run on the actual plotter. It plots the GCODE points using the functions directly.
@@ -82,6 +127,47 @@ class GcodeControler:
     def getSpeed(self):
         return self.__speed
 
+    def setArcTolerance(self, tolerance):
+        if tolerance is None or tolerance <= 0:
+            self.__arcTolerance = None
+        else:
+            self.__arcTolerance = tolerance
+
+    def setSimplifyTolerance(self, tolerance):
+        if tolerance is None or tolerance <= 0:
+            self.__simplifyTolerance = None
+        else:
+            self.__simplifyTolerance = tolerance
+
+    def setReorderStrokes(self, reorder):
+        self.__reorderStrokes = reorder
+
+    def setJoinTolerance(self, tolerance):
+        # 0 still joins strokes that meet, None leaves the pen moves as they are
+        if tolerance is None or tolerance < 0:
+            self.__joinTolerance = None
+        else:
+            self.__joinTolerance = tolerance
+
+    def setBatchMoves(self, batch):
+        self.__batchMoves = batch
+
+    def getOptimizationReport(self):
+        return self.__optimizationReport
+
+    def getSimulationSettings(self):
+        return {"file": self.__gcodeFile, "speed": self.__speed, "arcTolerance": self.__arcTolerance,
+                "simplifyTolerance": self.__simplifyTolerance, "reorderStrokes": self.__reorderStrokes,
+                "joinTolerance": self.__joinTolerance}
+
+    def applySimulationSettings(self, settings):
+        self.__gcodeFile = settings["file"]
+        self.setSpeed(settings["speed"])
+        self.setArcTolerance(settings["arcTolerance"])
+        self.setSimplifyTolerance(settings["simplifyTolerance"])
+        self.setReorderStrokes(settings["reorderStrokes"])
+        self.setJoinTolerance(settings["joinTolerance"])
+
     def getQuickDistance(self):
         """
         Returns a short distance relative to the current speed.
@@ -113,15 +199,21 @@ class GcodeControler:
     def stopGcode(self):
         self.__stopGcode = True
 
-    def runGcode(self):
+    def runGcode(self, checkpoint=None):
+        """
+        Runs the GCODE file, or resumes it from a checkpoint of the job journal (see resumeJob()).
+        """
         self.__stopGcode = False
         self.__gcodePaused = False
 
         if not self.__ArduinoComms.testConnection():
             return
 
-        commands = self.__parseCommands(self.__gcodeFile)
-        #If file could not be read returns error str
+        # Streaming stops after an ESTOP, ask for it again
+        self.__ArduinoComms.startStreaming()
+
+        commands = self.__streamCommands(self.__gcodeFile, checkpoint)
+        #If file could not be opened returns error str
         if isinstance(commands, str):
             error = commands
             if self.__debug:
@@ -131,6 +223,8 @@ class GcodeControler:
         completed = self.__ArduinoComms.waitForComplete()
         
         if not completed:
+            commands.close()
+            self.__progress.stop()
             return False, "FAILED, Comms Problem"
 
         #Set Speed
@@ -139,17 +233,21 @@ class GcodeControler:
         # Disable user input
         self.__ArduinoComms.sendSingleCommand('C14')
 
-        #Put pen up
-        self.__penIsUp = True
-        self.__ArduinoComms.sendSingleCommand('C10,END')
+        if checkpoint is None:
+            #Put pen up
+            self.__penIsUp = True
+            self.__ArduinoComms.sendSingleCommand('C10,END')
+        elif not self.__restoreState(checkpoint):
+            commands.close()
+            self.__progress.stop()
+            self.__ArduinoComms.sendSingleCommand('C13')
+            return False, "FAILED, Comms Problem"
 
         unexpectedExit = False
-        numCommands = len(commands)
-        curCommand = 0
-        for command in commands:
-            curCommand += 1
-            percentageComplete = round((curCommand/numCommands)*100)
-            self.__percentageQueue.put(str(percentageComplete)+"%")
+        # Journal checkpoints of the commands sent that may not be complete yet, oldest first
+        sentCheckpoints = deque()
+        for command, fractionRead, commandCheckpoint in commands:
+            self.__progress.update(commandCheckpoint[0], fractionRead)
 
             # If program is paused, wait for resume or stop
             while(self.__gcodePaused):
@@ -158,32 +256,53 @@ class GcodeControler:
                 time.sleep(0.01)
 
             if self.__stopGcode:
-                self.__percentageQueue.put("")
+                self.__progress.stop()
                 self.__stopGcode = False
                 unexpectedExit = True
                 self.__gcodePaused = False
                 break
             
             #Don't send pause command to machine, just pause current program execution
-            if("G04" in command):
+            if command is None:
+                # Streamed commands after the pause are not sent yet, the ones before it finish first
+                if self.__ArduinoComms.isStreaming() and not self.__ArduinoComms.waitForComplete():
+                    unexpectedExit = True
+                    break
                 self.__gcodePaused = True
                 continue
 
-            command = self.__processCommand(command)
-            if not self.__ArduinoComms.sendSingleCommand(command):
+            # Waits only for space in the stream window, or for the command to complete if not streaming
+            if not self.__ArduinoComms.queueCommand(command):
+                commands.close()
+                # The job can be resumed from the last command that completed
+                self.__journal.flush()
                 #Enable user input
                 self.__ArduinoComms.sendSingleCommand('C13')
-                self.__percentageQueue.put("")
+                self.__progress.stop()
                 return False, "FAILED, Comms Problem"
 
-        self.__percentageQueue.put("")
+            # Streamed commands complete in the order they were sent, the ones no longer in flight are done
+            sentCheckpoints.append(commandCheckpoint)
+            numComplete = len(sentCheckpoints) - self.__ArduinoComms.numInFlight()
+            if numComplete > 0:
+                for _ in range(numComplete - 1):
+                    sentCheckpoints.popleft()
+                self.__journal.record(*sentCheckpoints.popleft())
+
+        commands.close()
+        self.__progress.stop()
             
 
         if not unexpectedExit:
             if not self.__ArduinoComms.waitForComplete():
+                self.__journal.flush()
                 # Move Home
                 self.__ArduinoComms.sendSingleCommand("C06")
+            else:
+                self.__journal.finish()
         else:
+            # A stopped job can be resumed too
+            self.__journal.flush()
             if self.__debug:
                 print("Unexpected Exit.")
 
@@ -191,32 +310,127 @@ class GcodeControler:
         self.__ArduinoComms.sendSingleCommand('C13')
         self.__ArduinoComms.waitForComplete()
 
+    def getResumableJob(self):
+        """
+        Returns (True, description) if the last job stopped before it finished and can be resumed.
+        Returns (False, reason) if there is no job, or its file or the optimization settings changed since it ran.
+        """
+        checkpoint = self.__journal.load()
+        if checkpoint is None:
+            return False, "No GCODE Run to Resume."
+        file = checkpoint["file"]
+        try:
+            fingerprint = self.__jobFingerprint(file)
+        except OSError:
+            return False, "File of the Last GCODE Run Does Not Exist."
+        if fingerprint != checkpoint["fingerprint"]:
+            return False, "File or Settings Changed Since the Last GCODE Run.\nIt Can't Be Resumed."
+        total = f" of {checkpoint['totalRows']}" if checkpoint.get("totalRows") else ""
+        return True, f"Resuming {os.path.basename(file)}\nFrom Command {checkpoint['rowsDone']}{total}."
+
+    def resumeJob(self):
+        """
+        Resumes the last job from the last command the device completed, the commands before it are not sent again.
+        """
+        result, output = self.getResumableJob()
+        if not result:
+            return False, output
+        checkpoint = self.__journal.load()
+        self.__gcodeFile = checkpoint["file"]
+        return self.runGcode(checkpoint)
+
+    def __restoreState(self, checkpoint):
+        """
+        Puts the device back the way it was at a checkpoint: moves home, then to the position with the pen up,
+        then sets the pen and G90/G91. After a reset the device thinks it is home wherever the pen is,
+        so the pen should be moved home (Set Home) before resuming.
+        """
+        commands = ["C06", "C90", f"C00,{checkpoint['X']:f},{checkpoint['Y']:f}", "C10" if checkpoint["penDown"] else "C11"]
+        if checkpoint["relative"]:
+            commands.append("C91")
+        for command in commands:
+            if not self.__ArduinoComms.sendSingleCommand(command):
+                return False
+        self.__penIsUp = not checkpoint["penDown"]
+        return True
+
+    def __jobFingerprint(self, file):
+        """
+        Identifies a file and the settings that change its program, a job is only resumed if none of them changed.
+        """
+        info = os.stat(file)
+        return (f"{info.st_size}:{info.st_mtime_ns}:{self.__arcTolerance}:{self.__simplifyTolerance}:"
+                f"{self.__reorderStrokes}:{self.__joinTolerance}")
+
     # REGION Simulation Commands
+    def simulateFile(self, onStage=None):
+        """
+        Does what generateCommandsFile(), generateArduinoCommands() and generatePoints() do, but the file is only parsed
+        and optimized once. onStage(stage) is called with "parse", "convert" and "simulate" as each stage starts.
+        """
+        if onStage is None:
+            onStage = lambda stage: None
+        onStage("parse")
+        commands = self.__parseCommands(self.__gcodeFile)
+        if isinstance(commands, str):
+            return False, commands
+
+        onStage("convert")
+        commands = self.__optimizeProgram(commands)
+        self.__simProgram = commands
+        for write in (self.__writeCommandsFile, self.__writeArduinoCommandsFile):
+            result, text = write(commands)
+            if not result:
+                return result, text
+
+        onStage("simulate")
+        result, text = self.generatePoints()
+        if not result:
+            return result, text
+        return True, f"Simulation Complete. {self.__optimizationReport}".strip()
+
+    def getSimulation(self):
+        if self.__simPoints is None:
+            return None, None
+        return self.__simPoints, PrintTimeEstimator().estimate(self.__simProgram, self.__simPoints, self.__speed)
+
     def plotPoints(self):
         """
-        Plots the points currently in the __pointsFile.
+        Plots the points made by generatePoints().
         """
         if self.__debug:
             print("Preparing to plot.")
         # Seperate class calls plotPoints and returns result string to user
-        pointPlotter = plotPoints(self.__pointsFile)
+        pointPlotter = plotPoints(self.__pointsFile, self.__simPoints)
         if self.__debug:
             print("Plotting Points")
-        return pointPlotter.plotPoints(self.__speed, self.__numServoMoves, self.__numCommands)
+        timeEstimate = PrintTimeEstimator().estimate(self.__simProgram, self.__simPoints, self.__speed)
+        return pointPlotter.plotPoints(timeEstimate)
 
     def generatePoints(self):
         """
-        Tries to run executable that generates points. Returns string indicating result.
+        Simulates the program kept by generateCommandsFile() or fileWriteSingleCommand(). Returns string indicating result.
         """
-        path = "GeneratePoints.exe"
-        if hasattr(sys, '_MEIPASS'):
-            # Running as a PyInstaller bundle
-            path = os.path.join(sys._MEIPASS, path)
-        
+        if self.__simProgram is None:
+            return False, "Nothing to Simulate."
+        # Release the last points first, on windows a memory mapped file can't be replaced while it is open
+        self.__simPoints = None
         try:
-            subprocess.run(path, check=True) # check=True raises CalledProcessError if it fails
-        except subprocess.CalledProcessError:
-            return False, "Failed to Generate Points." 
+            points = PolargraphSimulator().simulate(self.__simProgram)
+        except Exception as e:
+            if self.__debug:
+                print(e)
+            return False, "Failed to Generate Points."
+
+        # Points are saved and memory mapped so large simulations don't stay in memory.
+        # If the file can't be written the points are kept in memory instead.
+        try:
+            PointsFile.save(self.__pointsFile, points)
+            self.__simPoints = PointsFile.load(self.__pointsFile)
+        except (OSError, ValueError) as e:
+            if self.__debug:
+                print(f"Could not save points: {e}")
+            self.__simPoints = points
 
         return True, "Generated Points."
 
@@ -234,24 +448,9 @@ class GcodeControler:
                 print(error)
             return False, error
         
-        # Try to open output file
-        try:
-            with open(self.__generatedCommandsFile, 'w', encoding='utf-8') as file:
-                for command in commands:
-                    file.write(self.__processCommand(command))
-        except FileNotFoundError:
-            error = f"Error: {self.__generatedCommandsFile} not found."
-            if self.__debug:
-                print(error)
-            return False, error
-        except Exception as e:
-            error = f"An unexpected error occurred: {e}"
-            if self.__debug:
-                print(error)
-            return False, error
-
-        #return success str if succesful
-        return True, "Successfully parsed commands."
+        commands = self.__optimizeProgram(commands)
+        self.__simProgram = commands
+        return self.__writeCommandsFile(commands)
 
     def fileWriteSingleCommand(self, command):
         """
@@ -266,6 +465,8 @@ class GcodeControler:
             command += "END"
         if("\n" not in command):
             command += "\n"
+
+        self.__simProgram = GcodeProgram.fromCommandStrings([command])
         
         try:
             with open(self.__generatedCommandsFile, 'w', encoding='utf-8') as file:
@@ -298,12 +499,42 @@ class GcodeControler:
                 print(error)
             return False, error
         
+        commands = self.__optimizeProgram(commands)
+        return self.__writeArduinoCommandsFile(commands)
+
+    def __writeCommandsFile(self, commands):
+        """
+        Writes the plotter commands of a program to self.__generatedCommandsFile.
+        """
+        # Try to open output file
+        try:
+            with open(self.__generatedCommandsFile, 'w', encoding='utf-8') as file:
+                for row in commands.rows():
+                    file.write(self.__processCommand(row))
+        except FileNotFoundError:
+            error = f"Error: {self.__generatedCommandsFile} not found."
+            if self.__debug:
+                print(error)
+            return False, error
+        except Exception as e:
+            error = f"An unexpected error occurred: {e}"
+            if self.__debug:
+                print(error)
+            return False, error
+
+        #return success str if succesful
+        return True, f"Successfully parsed commands. {self.__optimizationReport}".strip()
+
+    def __writeArduinoCommandsFile(self, commands):
+        """
+        Writes a program as arduino code to self.__ArduinoCommandsFile.
+        """
         # Try to open output file
         try:
             with open(self.__ArduinoCommandsFile, 'w', encoding='utf-8') as file:
                 file.write(self.__ArduinoGCODEHeader)
-                for command in commands:
-                    file.write(self.__processArduinoCommand(command))
+                for row in commands.rows():
+                    file.write(self.__processArduinoCommand(row))
                 file.write(self.__ArduinoGCODEFooter)
         except FileNotFoundError:
             error = f"Error: {self.__generatedCommandsFile} not found."
@@ -320,176 +551,202 @@ class GcodeControler:
         return True, "Successfully Generated Arduino Commands."
 
     # REGION Helper functions that process GCODE files and commands
-    def __processCommand(self, command):
-        output = ""
-
-        if("G00" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            #Handles case where X or Y absent but not both
-            if X==-1 and Y==-1:
-                output="" 
-            else:
-                if X==-1:
-                    X=0
-                if Y==-1:
-                    Y=0
-                output = f"C00,{X:f},{Y:f},END\n"
-
-        elif("G01" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            #Handles case where X or Y absent but not both
-            if X==-1 and Y==-1:
-                output="" 
-            else:
-                if X==-1:
-                    X=0
-                if Y==-1:
-                    Y=0
-                output = f"C01,{X:f},{Y:f},END\n"
-            
-        elif("G02" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            I = self.__findVal("I", command)
-            J = self.__findVal("J", command)
-            #All values must be present for Circular Interpolation
-            if X==-1 or Y==-1 or I==-1 or J==-1:
-                output=""
-            else:
-                output = f"C02,{X:f},{Y:f},{I:f},{J:f},END\n"
-        elif("G03" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            I = self.__findVal("I", command)
-            J = self.__findVal("J", command)
-             #All values must be present for Circular Interpolation
-            if X==-1 or Y==-1 or I==-1 or J==-1:
-                output=""
-            else:
-                output = f"C03,{X:f},{Y:f},{I:f},{J:f},END\n"
-        elif("G90" in command):
-            if self.__debug:
-                print("Absolute Coords")
-            output = "C90,END\n"
-        elif("G91" in command):
-            if self.__debug:
-                print("Relative Coords")
-            output = "C91,END\n"
-        
-        #Check for up pen or down pen, must be G01 command with Z != 0 and with no X or Y component
-        if(("Z" in command) and ("X" not in command) and ("Y" not in command) and (("G01" in command) or ("G00" in command))):
-            Z = self.__findVal("Z", command)
-            if Z == 0:
-                None
-            elif Z < 0:
-                self.__numServoMoves += 1
-                #Pen down
-                output="C10,END\n"
-            elif Z > 0:
-                self.__numServoMoves += 1
-                #Pen up
-                output="C11,END\n"
-
-        if output != "":
-            self.__numCommands += 1
-
-        return output
+    def __processCommand(self, row):
+        """
+        Formats one program row (see GcodeProgram.rows()) as a plotter command (C00-C91).
+        """
+        op, X, Y, I, J = row[0], row[1], row[2], row[3], row[4]
+
+        if op == OP_RAPID or op == OP_LINEAR:
+            return f"C{op:02d},{X:f},{Y:f},END\n"
+        elif op == OP_ARC_CW or op == OP_ARC_CCW:
+            return f"C{op:02d},{X:f},{Y:f},{I:f},{J:f},END\n"
+        elif op == OP_MOVE_RELATIVE:
+            return f"C05,{X:f},{Y:f},END\n"
+        elif op == OP_PAUSE:
+            return ""
+        else:
+            # C10, C11, C90, C91
+            return f"C{op:02d},END\n"
     
-    def __processArduinoCommand(self, command):
-        output = ""
-
-        if("G00" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            #Handles case where X or Y absent but not both
-            if X==-1 and Y==-1:
-                output="" 
-            else:
-                if X==-1:
-                    X=0
-                if Y==-1:
-                    Y=0
-                output = f"  RapidPositioning({X:f},{Y:f});\n"
-
-        elif("G01" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            #Handles case where X or Y absent but not both
-            if X==-1 and Y==-1:
-                output="" 
-            else:
-                if X==-1:
-                    X=0
-                if Y==-1:
-                    Y=0
-                output = f"  LinearInterpolation({X:f},{Y:f});\n"
-            
-        elif("G02" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            I = self.__findVal("I", command)
-            J = self.__findVal("J", command)
-            #All values must be present for Circular Interpolation
-            if X==-1 or Y==-1 or I==-1 or J==-1:
-                output=""
+    def __processArduinoCommand(self, row):
+        """
+        Formats one program row (see GcodeProgram.rows()) as a line of arduino code.
+        """
+        op, X, Y, I, J = row[0], row[1], row[2], row[3], row[4]
+
+        if op == OP_RAPID:
+            return f"  RapidPositioning({X:f},{Y:f});\n"
+        elif op == OP_LINEAR:
+            return f"  LinearInterpolation({X:f},{Y:f});\n"
+        elif op == OP_ARC_CW:
+            return f"  CircularInterpolationCW({X:f},{Y:f},{I:f},{J:f});\n"
+        elif op == OP_ARC_CCW:
+            return f"  CircularInterpolationCCW({X:f},{Y:f},{I:f},{J:f});\n"
+        elif op == OP_ABSOLUTE:
+            return "  relativeCoords = false;\n"
+        elif op == OP_RELATIVE:
+            return "  relativeCoords = true;\n"
+        elif op == OP_PEN_DOWN:
+            return "  penlift_penDown();\n"
+        elif op == OP_PEN_UP:
+            return "  penlift_penUp();\n"
+        return ""
+
+    def __streamCommands(self, file, checkpoint=None):
+        """
+        Starts reading and converting a file into plotter commands in a seperate thread.
+        Returns a CommandPipeline of (command, fractionRead, journal checkpoint), command is None for a pause (G04).
+        With a checkpoint the rows it completed are skipped, otherwise a new job is started in the journal.
+        Returns an error string if the file could not be opened.
+        """
+        startRow = 0 if checkpoint is None else checkpoint["rowsDone"]
+        try:
+            # remove quotes if present
+            file = file.replace("\"", "")
+            file = file.replace("\'", "")
+            # A program that was already parsed (by a simulation) is not parsed again
+            program = self.__programCache.load(file, hashIfChanged=False)
+            # Optimizing needs the whole program
+            if program is None and self.__isOptimizing():
+                program = self.__parseCommands(file)
+                if isinstance(program, str):
+                    return program
+            if program is not None:
+                program = self.__optimizeProgram(program)
+                rows = self.__programRows(program, startRow)
+                totalRows = len(program)
             else:
-                output = f"  CircularInterpolationCW({X:f},{Y:f},{I:f},{J:f});\n"
-        elif("G03" in command):
-            X = self.__findVal("X", command)
-            Y = self.__findVal("Y", command)
-            I = self.__findVal("I", command)
-            J = self.__findVal("J", command)
-             #All values must be present for Circular Interpolation
-            if X==-1 or Y==-1 or I==-1 or J==-1:
-                output=""
+                rows = self.__fileRows(self.__lexer.streamCommands(file), startRow)
+                totalRows = None
+            if checkpoint is None:
+                self.__journal.start(file, self.__jobFingerprint(file), totalRows)
             else:
-                output = f"  CircularInterpolationCCW({X:f},{Y:f},{I:f},{J:f});\n"
-        elif("G90" in command):
-            if self.__debug:
-                print("Absolute Coords")
-            output = "  relativeCoords = false;\n"
-        elif("G91" in command):
-            if self.__debug:
-                print("Relative Coords")
-            output = "  relativeCoords = true;\n"
-        
-        #Check for up pen or down pen, must be G01 command with Z != 0 and with no X or Y component
-        if(("Z" in command) and ("X" not in command) and ("Y" not in command) and (("G01" in command) or ("G00" in command))):
-            Z = self.__findVal("Z", command)
-            if Z == 0:
-                None
-            elif Z < 0:
-                self.__numServoMoves += 1
-                #Pen down
-                output="  penlift_penDown();\n"
-            elif Z > 0:
-                self.__numServoMoves += 1
-                #Pen up
-                output="  penlift_penUp();\n"
-
-        if output != "":
-            self.__numCommands += 1
-
-        return output
+                self.__journal.resume(checkpoint)
+            self.__progress.start(totalRows, startRow)
+        except FileNotFoundError:
+            return f"Error: File not found at {file}"
+        except Exception as e:
+            return f"An error occurred: {e}"
+
+        return CommandPipeline(self.__convertStream(self.__trackState(rows, startRow, checkpoint)), self.__pipelineDepth)
+
+    def __optimizeProgram(self, program):
+        """
+        Returns the program with arcs fitted to its pen down G01 moves, the rest simplified, its strokes reordered
+        and its pen lifts removed, for the optimizations that are on.
+        Arcs are fitted to the original moves before simplifying, and strokes are joined after reordering, which puts more of them end to end.
+        """
+        report = []
+        if self.__arcTolerance is not None:
+            numCommands = len(program)
+            program, numArcs, numReplaced = ArcFitter(self.__arcTolerance).fit(program)
+            report.append(f"Fitted {numArcs} arcs to {numReplaced} moves ({numCommands} -> {len(program)} commands).")
+        if self.__simplifyTolerance is not None:
+            simplified, numMerged, numRemoved = PathSimplifier(self.__simplifyTolerance).simplify(program)
+            report.append(f"Merged {numMerged} collinear moves, removed {numRemoved} within {self.__simplifyTolerance}mm "
+                          f"({len(program)} -> {len(simplified)} commands).")
+            program = simplified
+        if self.__reorderStrokes:
+            program, travelBefore, travelAfter = StrokeOrderer().order(program)
+            report.append(f"Pen up travel {travelBefore/1000:.2f}m -> {travelAfter/1000:.2f}m.")
+        if self.__joinTolerance is not None:
+            program, servoMovesBefore, servoMovesAfter = PenLiftOptimizer(self.__joinTolerance).optimize(program)
+            report.append(f"Pen moves {servoMovesBefore} -> {servoMovesAfter}.")
+        self.__optimizationReport = " ".join(report)
+        if self.__debug and report:
+            print(self.__optimizationReport)
+        return program
+
+    def __isOptimizing(self):
+        return (self.__arcTolerance is not None or self.__simplifyTolerance is not None
+                or self.__reorderStrokes or self.__joinTolerance is not None)
+
+    def __programRows(self, program, startRow=0):
+        """
+        Generator of (row, fractionComplete) from an already parsed program, starting at row startRow.
+        """
+        numCommands = len(program)
+        for i, row in enumerate(program.rows(startRow), start=startRow):
+            yield row, (i+1)/numCommands
+
+    def __fileRows(self, words, startRow=0):
+        """
+        Generator of (row, fractionRead) converted straight from the lines of a file, the first startRow rows are skipped.
+        """
+        penIsDown = False
+        numRows = 0
+        try:
+            for command, lineNumber, fractionRead in words:
+                row = GcodeProgram.convertWords(command, penIsDown, lineNumber)
+                if row is not None:
+                    penIsDown = (row[7] == 1)
+                    numRows += 1
+                    if numRows > startRow:
+                        yield row, fractionRead
+        finally:
+            words.close()
+
+    def __trackState(self, rows, startRow, checkpoint):
+        """
+        Generator of (row, (fraction, journal checkpoint)), the checkpoint is (rows done, G91, pen down, X, Y) after the row.
+        X, Y are absolute like currentXpos, currentYpos on the device. A resumed job starts from the state of its checkpoint.
+        """
+        if checkpoint is None:
+            relative, penDown, X, Y = False, False, 0.0, 0.0
+        else:
+            relative, penDown, X, Y = checkpoint["relative"], checkpoint["penDown"], checkpoint["X"], checkpoint["Y"]
+        rowsDone = startRow
+        try:
+            for row, fraction in rows:
+                op = row[0]
+                rowsDone += 1
+                if op == OP_ABSOLUTE:
+                    relative = False
+                elif op == OP_RELATIVE:
+                    relative = True
+                elif op == OP_MOVE_RELATIVE or (relative and op in (OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW)):
+                    X += row[1]
+                    Y += row[2]
+                elif op in (OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW):
+                    X, Y = row[1], row[2]
+                penDown = (row[7] == 1)
+                yield row, (fraction, (rowsDone, relative, penDown, X, Y))
+        finally:
+            rows.close()
+
+    def __convertStream(self, rows):
+        """
+        Generator that formats a stream of (row, (fraction, journal checkpoint)) as (plotter command, fraction, journal checkpoint).
+        Runs of G01 moves are packed into batch commands if batching is on, binary frames only carry single commands.
+        """
+        if self.__batchMoves and not self.__ArduinoComms.isBinary():
+            rows = MoveBatcher().batch(rows)
+        try:
+            for row, (fraction, checkpoint) in rows:
+                if isinstance(row, str):
+                    yield row, fraction, checkpoint
+                elif row[0] == OP_PAUSE:
+                    yield None, fraction, checkpoint
+                else:
+                    yield self.__processCommand(row), fraction, checkpoint
+        finally:
+            rows.close()
 
     def __parseCommands(self, file):
         """
-        Reads a file into a string and returns a list of gcode commands of all kinds.
+        Returns a GcodeProgram with the commands in a file.
+        The file is only read if it is not already in the program cache.
+        Returns an error string if the file could not be read.
         """
         if self.__debug:
             print("Parsing Commands)")
-        commands = []
-        txt = ""
-        self.__numServoMoves = 0
-        self.__numCommands = 0
+        program = None
         try:
             # remove quotes if present
             file = file.replace("\"", "")
             file = file.replace("\'", "")
-            with open(file, 'r') as file:
-                txt = file.read()
+            program = self.__programCache.get(file, self.__readProgram)
         except FileNotFoundError:
             if self.__debug:
                 print(f"Error: File not found at {file}")
@@ -498,72 +755,15 @@ class GcodeControler:
             if self.__debug:
                 print(f"An error occurred: {e}")
             return f"An error occurred: {e}"
-
-        txt = self.__removeParenthesesHelper(txt)
-        if self.__debug:
-            print(txt)
-        commands = self.__findCommandsHelper(txt)
         
         if self.__debug:
-                print(f"Parsed {len(commands)}")
+                print(f"Parsed {len(program)}")
         
-        return commands
+        return program
 
-    def __removeParenthesesHelper(self, text):
-        """
-        Removes parenthesis and anything in them.
-        Written by google bard.
-        """
-        return re.sub(r'\([^)]*\)', '', text)
+    def __readProgram(self, file):
+        return GcodeProgram.fromFile(file, self.__lexer)
 
-    def __findCommandsHelper(self, txt):
-        """
-        Extracts the desired commands from string of gcode file.
-        Written by google bard.
-        """
-        # Create a regex pattern to match any of the commands at the beginning of a line
-        # r"^(G00|G01|G02|G03)"
-        # ^: Matches the beginning of a line
-        # (G00|G01|G02|G03): Matches any of the specified commands
-        pattern = re.compile(r'^(G00|G01|G02|G03|G90|G91)')
-        commands = []
-        for line in txt.splitlines():
-            if pattern.search(line): # search for the pattern anywhere in the line
-                commands.append(line)
-        return commands
-
-    def __findVal(self, letter, command):
-        """
-        Finds a float value after a specified letter in Gcode command using regex.
-        If letter not found or value is invalid, returns 0.
-        Written by google bard.
-        """
-        # Construct the regex pattern:
-        # 1. Look for the 'letter' literally.
-        # 2. Optionally match a space after the letter (G-code often has spaces).
-        # 3. Capture the number:
-        #    - [-+]?: optional plus or minus sign
-        #    - \d*: zero or more digits (for cases like X.5)
-        #    - \.? : optional decimal point
-        #    - \d+ : one or more digits (for cases like X5 or X.5)
-        # The 're.IGNORECASE' flag ensures it matches 'x' or 'X'
-        pattern = re.compile(rf"{re.escape(letter)}\s*([-+]?\d*\.?\d+)", re.IGNORECASE)
-
-        match = pattern.search(command) # Use search to find it anywhere in the string
-
-        if match:
-            value_str = match.group(1) # Get the first (and only) captured group
-            try:
-                return float(value_str)
-            except ValueError:
-                # This should ideally not happen if the regex is perfect,
-                # but it's good for robustness.
-                if self.__debug:
-                    print(f"Error converting '{value_str}' to float after '{letter}' in '{command}'")
-                return -1 # Return 0 for invalid float
-        else:
-            return -1 # Return -1 if the letter or its value is not found
-    
     def countLinesReadlines(self):
         """
         Counts the number of lines in a file by reading all lines into a list.
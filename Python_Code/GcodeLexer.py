@@ -0,0 +1,131 @@
+import os
+import re
+
+# Number in a GCODE word, ex.) 10, -10.5, 10., .5
+_NUMBER = r"([-+]?(?:\d+\.?\d*|\.\d+))"
+
+# Fast path, matches a whole line written in the usual order in one scan.
+# ex.) "G01 X10.5 Y-20.25 Z-1.0 F100"
+# Captures N, G, X, Y, Z, I, J, F (in that order), any group can be None except G.
+_LINE_PATTERN = re.compile(
+    rf"\s*(?:N\s*{_NUMBER}\s*)?G\s*(\d+)"
+    + "".join(rf"\s*(?:{letter}\s*{_NUMBER})?" for letter in "XYZIJF")
+    + r"\s*$",
+    re.IGNORECASE)
+
+# Slow path, used for anything else (comments, words in a different order, more than one G code)
+# \([^)]*\) : a comment in parentheses, matched so it is skipped (no groups are captured)
+# ([A-Za-z]) : the letter of a word, G, X, Y...
+# \s* : optional space between the letter and the number
+_WORD_PATTERN = re.compile(rf"\([^)]*\)|([A-Za-z])\s*{_NUMBER}")
+
+# G codes that the plotter can use, any other line is ignored. G04 (pause) is handled on the computer, it is not sent.
+_COMMAND_CODES = (0, 1, 2, 3, 4, 90, 91)
+
+class GcodeWords:
+    """
+    Holds every word found on a single line of GCODE.
+    gCodes is a tuple of the G numbers on the line, in the order they were found.
+    X, Y, Z, I, J, F and N are floats, or None if the letter is not on the line.
+    """
+    __slots__ = ("gCodes", "X", "Y", "Z", "I", "J", "F", "N")
+
+    def __init__(self, gCodes=(), X=None, Y=None, Z=None, I=None, J=None, F=None, N=None):
+        self.gCodes = gCodes
+        self.X = X
+        self.Y = Y
+        self.Z = Z
+        self.I = I
+        self.J = J
+        self.F = F
+        self.N = N
+
+    def hasCode(self, code):
+        return code in self.gCodes
+
+class GcodeLexer:
+    """
+    Splits lines of GCODE into words. Each line is scanned once with a precompiled regex,
+    every letter is found in that one scan.
+
+    tokenize(line) -> Returns a GcodeWords with all of the words on the line.
+    isCommand(words) -> Returns if the line starts with a G code the plotter can run (G00-G03, G90, G91) or a pause (G04).
+    readCommands(file) -> Returns a list of GcodeWords for every command in a file.
+    streamCommands(file) -> Returns a generator of (GcodeWords, line number, fraction of file read) that reads the file as it goes.
+    """
+    def tokenize(self, line):
+        """
+        Finds every word on a line. Comments in parentheses are skipped.
+        If a letter is on the line more than once the first value is kept, except for G.
+        """
+        match = _LINE_PATTERN.match(line)
+        if match is not None:
+            N, G, X, Y, Z, I, J, F = match.groups()
+            return GcodeWords((int(G),),
+                              None if X is None else float(X),
+                              None if Y is None else float(Y),
+                              None if Z is None else float(Z),
+                              None if I is None else float(I),
+                              None if J is None else float(J),
+                              None if F is None else float(F),
+                              None if N is None else float(N))
+        return self.__tokenizeWords(line)
+
+    def isCommand(self, words):
+        """
+        A command must have a G code the plotter can run as its first G code.
+        """
+        return len(words.gCodes) > 0 and words.gCodes[0] in _COMMAND_CODES
+
+    def readCommands(self, file):
+        """
+        Reads a file and returns a list of GcodeWords, one for each command.
+        Raises the same errors as open().
+        """
+        commands = []
+        with open(file, 'r') as f:
+            for line in f:
+                words = self.tokenize(line)
+                if self.isCommand(words):
+                    commands.append(words)
+        return commands
+
+    def streamCommands(self, file):
+        """
+        Returns a generator that yields (GcodeWords, lineNumber, fractionRead) for each command in a file.
+        lineNumber starts at 1.
+        The file is read a buffer at a time so only a few lines are in memory at once.
+        fractionRead is how much of the file has been read (0-1), used for progress.
+        The file is opened here, so open() errors are raised before anything is yielded.
+        """
+        f = open(file, 'rb')
+        return self.__streamCommands(f, os.fstat(f.fileno()).st_size)
+
+    def __streamCommands(self, f, fileSize):
+        bytesRead = 0
+        try:
+            for lineNumber, line in enumerate(f, start=1):
+                bytesRead += len(line)
+                words = self.tokenize(line.decode('utf-8', errors='replace'))
+                if self.isCommand(words):
+                    yield words, lineNumber, (bytesRead/fileSize)
+        finally:
+            f.close()
+
+    def __tokenizeWords(self, line):
+        """
+        Finds the words one at a time. Slower, but handles any line.
+        """
+        words = GcodeWords()
+        gCodes = []
+        for letter, value in _WORD_PATTERN.findall(line):
+            if letter == "":
+                # Comment
+                continue
+            letter = letter.upper()
+            if letter == "G":
+                gCodes.append(int(float(value)))
+            elif letter in GcodeWords.__slots__ and getattr(words, letter) is None:
+                setattr(words, letter, float(value))
+        words.gCodes = tuple(gCodes)
+        return words
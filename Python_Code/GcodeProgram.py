@@ -0,0 +1,260 @@
+import numpy as np
+
+from GcodeLexer import GcodeLexer
+
+# Operation codes, these match the number of the plotter command (C00-C91) they become
+OP_RAPID = 0          # C00, G00 rapid positioning to X, Y
+OP_LINEAR = 1         # C01, G01 linear interpolation to X, Y
+OP_ARC_CW = 2         # C02, G02 clockwise arc to X, Y with center offset I, J
+OP_ARC_CCW = 3        # C03, G03 counter clockwise arc to X, Y with center offset I, J
+OP_PAUSE = 4          # G04, pauses the program on the computer, not sent to the plotter
+OP_MOVE_RELATIVE = 5  # C05, moves directly by X, Y
+OP_PEN_DOWN = 10      # C10
+OP_PEN_UP = 11        # C11
+OP_ABSOLUTE = 90      # C90, G90
+OP_RELATIVE = 91      # C91, G91
+
+# One row for each command. Values that a command does not use are NaN.
+# pen is the state of the pen after the command runs (1 down, 0 up).
+# line is the line number in the source file (starting at 1), 0 if there is no source file.
+PROGRAM_DTYPE = np.dtype([
+    ("op", np.uint8),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("i", np.float64),
+    ("j", np.float64),
+    ("z", np.float32),
+    ("f", np.float32),
+    ("pen", np.uint8),
+    ("line", np.uint32),
+])
+
+class GcodeProgram:
+    """
+    Compact array backed version of a GCODE program.
+    Each command is one row of a NumPy structured array (see PROGRAM_DTYPE),
+    so whole programs can be processed with vectorized NumPy operations.
+    Only commands the plotter can run are stored, lines that don't become a command are dropped when the program is built.
+
+    fromFile(file) -> Reads and converts a GCODE file into a program.
+    fromArray(array) -> Makes a program from a structured array, ex.) one loaded from the cache.
+    fromCommandStrings(commands) -> Makes a program from plotter commands, ex.) ["C01,10.0,-20.0,END"].
+    convertWords(words) -> Converts one line of GcodeWords into a row tuple, or None if the line is not a command.
+    commands -> The structured array of commands.
+    rows(start) -> Generator of row tuples (op, x, y, i, j, z, f, pen, line), fast to use in a python loop.
+    numCommands(), numServoMoves() -> Number of commands sent to the plotter, and number of pen commands.
+    relativeMode() -> For each command, if it runs in relative coordinates (after a G91).
+    positions() -> The X and Y of the pen after each command, starting from home.
+    travelDistance() -> Length in mm of the moves made with the pen up.
+    select(mask) -> Returns a program with only the commands where mask is True.
+    """
+    def __init__(self, commands):
+        self.commands = commands
+
+    def __len__(self):
+        return len(self.commands)
+
+    @classmethod
+    def fromArray(cls, array):
+        return cls(array)
+
+    @classmethod
+    def fromFile(cls, file, lexer=None):
+        """
+        Reads a GCODE file and converts it to a program. Raises the same errors as open().
+        """
+        if lexer is None:
+            lexer = GcodeLexer()
+        builder = GcodeProgramBuilder()
+        with open(file, 'r') as f:
+            for lineNumber, line in enumerate(f, start=1):
+                words = lexer.tokenize(line)
+                if lexer.isCommand(words):
+                    builder.appendWords(words, lineNumber)
+        return builder.build()
+
+    @classmethod
+    def fromCommandStrings(cls, commands):
+        """
+        Makes a program from a list of plotter command strings (C00-C91).
+        Commands that the simulation does not use (like C07 set speed) or that have the wrong number of values are skipped.
+        """
+        nan = np.nan
+        # Number of values each command needs
+        numValues = {OP_RAPID: 2, OP_LINEAR: 2, OP_ARC_CW: 4, OP_ARC_CCW: 4, OP_MOVE_RELATIVE: 2,
+                     OP_PEN_DOWN: 0, OP_PEN_UP: 0, OP_ABSOLUTE: 0, OP_RELATIVE: 0}
+        builder = GcodeProgramBuilder()
+        penIsDown = False
+        for lineNumber, command in enumerate(commands, start=1):
+            segments = command.strip().split(",")
+            if segments[-1] == "END":
+                segments.pop()
+            try:
+                op = int(segments[0].strip().upper().lstrip("C"))
+                values = [float(value) for value in segments[1:]]
+            except ValueError:
+                continue
+            if numValues.get(op) != len(values):
+                continue
+            if op == OP_PEN_DOWN:
+                penIsDown = True
+            elif op == OP_PEN_UP:
+                penIsDown = False
+            values += [nan]*(4 - len(values))
+            builder.append((op, values[0], values[1], values[2], values[3], nan, nan, 1 if penIsDown else 0, lineNumber))
+        return builder.build()
+
+    @staticmethod
+    def convertWords(words, penIsDown=False, lineNumber=0):
+        """
+        Decides which command a line of GCODE becomes.
+        Returns a row tuple (op, x, y, i, j, z, f, pen, line) or None if the line is not a command.
+        penIsDown is the pen state before the command, used to fill in the pen column.
+        """
+        nan = np.nan
+        X = words.X
+        Y = words.Y
+        Z = nan if words.Z is None else words.Z
+        F = nan if words.F is None else words.F
+        pen = 1 if penIsDown else 0
+        row = None
+
+        #Check for up pen or down pen, must be G00 or G01 command with Z != 0 and with no X or Y component
+        if (words.Z is not None) and (X is None) and (Y is None) and (words.hasCode(0) or words.hasCode(1)) and words.Z != 0:
+            if words.Z < 0:
+                row = (OP_PEN_DOWN, nan, nan, nan, nan, Z, F, 1, lineNumber)
+            else:
+                row = (OP_PEN_UP, nan, nan, nan, nan, Z, F, 0, lineNumber)
+        elif words.hasCode(0) or words.hasCode(1):
+            #Handles case where X or Y absent but not both
+            if not (X is None and Y is None):
+                if X is None:
+                    X = 0.0
+                if Y is None:
+                    Y = 0.0
+                op = OP_RAPID if words.hasCode(0) else OP_LINEAR
+                row = (op, X, Y, nan, nan, Z, F, pen, lineNumber)
+        elif words.hasCode(2) or words.hasCode(3):
+            I = words.I
+            J = words.J
+            #All values must be present for Circular Interpolation
+            if not (X is None or Y is None or I is None or J is None):
+                op = OP_ARC_CW if words.hasCode(2) else OP_ARC_CCW
+                row = (op, X, Y, I, J, Z, F, pen, lineNumber)
+        elif words.hasCode(90):
+            row = (OP_ABSOLUTE, nan, nan, nan, nan, Z, F, pen, lineNumber)
+        elif words.hasCode(91):
+            row = (OP_RELATIVE, nan, nan, nan, nan, Z, F, pen, lineNumber)
+        elif words.hasCode(4):
+            row = (OP_PAUSE, nan, nan, nan, nan, Z, F, pen, lineNumber)
+
+        return row
+
+    def rows(self, start=0):
+        """
+        Yields each command as a plain tuple (op, x, y, i, j, z, f, pen, line).
+        Rows are converted a block at a time, which is much faster than indexing the array one row at a time.
+        """
+        blockSize = 65536
+        for blockStart in range(start, len(self.commands), blockSize):
+            for row in self.commands[blockStart:blockStart+blockSize].tolist():
+                yield row
+
+    def numCommands(self):
+        """
+        Number of commands that are sent to the plotter (pauses are not sent).
+        """
+        return int(np.count_nonzero(self.commands["op"] != OP_PAUSE))
+
+    def numServoMoves(self):
+        ops = self.commands["op"]
+        return int(np.count_nonzero((ops == OP_PEN_DOWN) | (ops == OP_PEN_UP)))
+
+    def relativeMode(self):
+        """
+        True for each command that runs in relative coordinates. The plotter starts in absolute coordinates,
+        a G90 or G91 changes the mode of the commands after it.
+        """
+        ops = self.commands["op"]
+        isModeChange = (ops == OP_ABSOLUTE) | (ops == OP_RELATIVE)
+        # Index of the last mode change before each command, -1 if there was none
+        lastChange = np.maximum.accumulate(np.where(isModeChange, np.arange(len(ops)), -1))
+        lastChange = np.concatenate(([-1], lastChange[:-1]))
+        return (lastChange >= 0) & (ops[np.maximum(lastChange, 0)] == OP_RELATIVE)
+
+    def positions(self):
+        """
+        Returns arrays of the X and Y of the pen after each command, the plotter starts at home (0, 0).
+        Moves in absolute coordinates go to X, Y. Moves in relative coordinates and C05 move by X, Y.
+        Commands that don't move keep the position of the command before them.
+        Moves to invalid positions, which the plotter skips, are not checked for.
+        """
+        ops = self.commands["op"]
+        num = len(ops)
+        isMove = ops <= OP_ARC_CCW
+        relative = self.relativeMode()
+        isAbsoluteMove = isMove & ~relative
+        isRelativeMove = (isMove & relative) | (ops == OP_MOVE_RELATIVE)
+
+        positions = []
+        for column in ("x", "y"):
+            values = self.commands[column]
+            # Total of the relative moves up to each command
+            offsets = np.cumsum(np.where(isRelativeMove, values, 0.0))
+            # Last absolute move before or at each command, -1 if there was none (home)
+            lastAbsolute = np.maximum.accumulate(np.where(isAbsoluteMove, np.arange(num), -1))
+            anchor = np.where(lastAbsolute >= 0, values[np.maximum(lastAbsolute, 0)], 0.0)
+            anchorOffset = np.where(lastAbsolute >= 0, offsets[np.maximum(lastAbsolute, 0)], 0.0)
+            positions.append(anchor + offsets - anchorOffset)
+        return positions[0], positions[1]
+
+    def travelDistance(self):
+        """
+        Length in mm of the moves made with the pen up, each move counted as a straight line.
+        """
+        x, y = self.positions()
+        previousX = np.concatenate(([0.0], x[:-1]))
+        previousY = np.concatenate(([0.0], y[:-1]))
+        commands = self.commands
+        isTravel = (commands["op"] <= OP_ARC_CCW) & (commands["pen"] == 0)
+        return float(np.hypot(x - previousX, y - previousY)[isTravel].sum())
+
+    def select(self, mask):
+        return GcodeProgram(self.commands[mask])
+
+class GcodeProgramBuilder:
+    """
+    Builds a GcodeProgram one row at a time. Rows are collected in python lists
+    and moved into NumPy blocks every blockSize rows, so building a large program does not hold millions of tuples.
+    """
+    def __init__(self, blockSize=65536):
+        self.__blockSize = blockSize
+        self.__rows = []
+        self.__blocks = []
+        self.__penIsDown = False
+
+    def appendWords(self, words, lineNumber=0):
+        """
+        Converts and adds a line of GcodeWords. Returns the row that was added, or None if the line was not a command.
+        """
+        row = GcodeProgram.convertWords(words, self.__penIsDown, lineNumber)
+        if row is not None:
+            self.append(row)
+        return row
+
+    def append(self, row):
+        self.__penIsDown = (row[7] == 1)
+        self.__rows.append(row)
+        if len(self.__rows) >= self.__blockSize:
+            self.__flush()
+
+    def build(self):
+        self.__flush()
+        if len(self.__blocks) == 0:
+            return GcodeProgram(np.zeros(0, dtype=PROGRAM_DTYPE))
+        return GcodeProgram(np.concatenate(self.__blocks))
+
+    def __flush(self):
+        if self.__rows:
+            self.__blocks.append(np.array(self.__rows, dtype=PROGRAM_DTYPE))
+            self.__rows = []
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+
+class JobJournal:
+    """
+    Crash safe record of how far a GCODE file got on the plotter, so a long plot can be resumed after a reset,
+    an ESTOP or a lost connection instead of being started again from the first line.
+    A checkpoint is the number of program rows the device completed, and the state after them: G90/G91, the pen
+    and the position of the pen (X, Y in absolute coordinates).
+
+    Writing to disk is kept out of the way of the commands being sent. record() only keeps the latest checkpoint,
+    it is written at most every writeInterval seconds. Each write goes to a temporary file that is fsynced and renamed
+    over the journal, so after a crash the journal holds either the old or the new checkpoint, never half of one.
+
+    start(file, fingerprint, totalRows) -> Starts a new job, the saved job (if any) is replaced.
+    resume(checkpoint) -> Carries on recording a job that was loaded with load().
+    record(rowsDone, relative, penDown, X, Y) -> Keeps the latest checkpoint, and writes it if writeInterval has passed.
+    flush() -> Writes the latest checkpoint now, ex.) when a job stops.
+    finish() -> Removes the journal, the job completed.
+    load() -> Returns the saved checkpoint (dict), or None if there is no job to resume.
+    """
+    def __init__(self, journalFile=None, writeInterval=1.0):
+        if journalFile is None:
+            base = os.environ.get("LOCALAPPDATA", os.path.join(os.path.expanduser("~"), ".cache"))
+            journalFile = os.path.join(base, "GCODE_Plotter", "job.json")
+        self.__journalFile = journalFile
+        self.__writeInterval = writeInterval
+        self.__checkpoint = None
+        self.__written = True
+        self.__lastWriteTime = 0.0
+        self.__debug = False
+
+    def start(self, file, fingerprint, totalRows):
+        self.__checkpoint = {"file": file, "fingerprint": fingerprint, "totalRows": totalRows, "rowsDone": 0,
+                             "relative": False, "penDown": False, "X": 0.0, "Y": 0.0}
+        self.__written = False
+        self.flush()
+
+    def resume(self, checkpoint):
+        self.__checkpoint = dict(checkpoint)
+        self.__written = True
+
+    def record(self, rowsDone, relative, penDown, X, Y):
+        if self.__checkpoint is None:
+            return
+        self.__checkpoint.update({"rowsDone": rowsDone, "relative": relative, "penDown": penDown, "X": X, "Y": Y})
+        self.__written = False
+        if time.perf_counter() - self.__lastWriteTime >= self.__writeInterval:
+            self.flush()
+
+    def flush(self):
+        if self.__checkpoint is None or self.__written:
+            return
+        self.__checkpoint["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        tempFile = self.__journalFile + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.__journalFile), exist_ok=True)
+            with open(tempFile, 'w') as file:
+                json.dump(self.__checkpoint, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tempFile, self.__journalFile)
+        except OSError as e:
+            # A job can still run without its journal, it just can't be resumed
+            if self.__debug:
+                print(f"Journal not written: {e}")
+        self.__written = True
+        self.__lastWriteTime = time.perf_counter()
+
+    def finish(self):
+        self.__checkpoint = None
+        self.__written = True
+        try:
+            os.remove(self.__journalFile)
+        except OSError:
+            pass
+
+    def load(self):
+        try:
+            with open(self.__journalFile, 'r') as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(checkpoint, dict) or "rowsDone" not in checkpoint:
+            return None
+        return checkpoint
@@ -0,0 +1,92 @@
+from GcodeProgram import OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW, OP_MOVE_RELATIVE, OP_ABSOLUTE, OP_RELATIVE
+
+# This matches CMD_POLYLINE in PolargraphGCODEController.ino
+BATCH_COMMAND = "C18"
+# Offsets are sent in 0.01mm
+BATCH_SCALE = 100
+# Longest batch command, with "S255," in front when streaming and the newline it is under USBComm's 70 character limit
+BATCH_MAX_CHARACTERS = 62
+# pos.ino, the plotter skips moves outside of these
+MAX_POS_X = 600.0
+MAX_POS_Y = 800.0
+
+class MoveBatcher:
+    """
+    Packs runs of G01 moves into batch commands, "C18,dx1,dy1,dx2,dy2,...,END", so the handshake
+    (echo, CHECKED, CMD_COMPLETE) or stream ACK is paid once for several moves.
+    Each X, Y pair is a linear move by that many 0.01mm from the end of the move before it (see CMD_Polyline() in util.ino).
+    Points are rounded from the start of the batch, not from the point before, so rounding never adds up along a batch,
+    and the next batch starts from where the plotter really is.
+
+    Only G01 moves in absolute coordinates are packed, and only when the host knows where the pen is
+    (after an absolute move to a valid position). Moves to the edge of the drawing area, where rounding could make
+    the plotter skip them, are never packed. Everything else is passed through unchanged.
+
+    batch(rows) -> Generator of (item, progress) from a generator of (row, progress), item is a batch command string or a row
+                   that was not packed. progress is passed through as it is, a batch gets the progress of its last move.
+    """
+    def batch(self, rows):
+        relative = False
+        # Where the plotter is after the commands sent so far, None when it is not known
+        position = None
+        # G01 rows waiting to be packed, they start from position
+        pending = []
+        pendingProgress = 0.0
+        try:
+            for row, progress in rows:
+                op = row[0]
+                if op == OP_LINEAR and not relative and position is not None and self.__validPosition(row[1], row[2]):
+                    if pending and len(self.__pack(position, pending + [row])) > BATCH_MAX_CHARACTERS:
+                        command, position = self.__flush(position, pending)
+                        yield command, pendingProgress
+                        pending = []
+                    pending.append(row)
+                    pendingProgress = progress
+                    continue
+
+                if pending:
+                    command, position = self.__flush(position, pending)
+                    yield command, pendingProgress
+                    pending = []
+                yield row, progress
+
+                if op == OP_ABSOLUTE:
+                    relative = False
+                elif op == OP_RELATIVE:
+                    relative = True
+                elif op in (OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW) and not relative:
+                    position = (row[1], row[2]) if self.__validPosition(row[1], row[2]) else None
+                elif op in (OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW, OP_MOVE_RELATIVE):
+                    position = None
+            if pending:
+                command, position = self.__flush(position, pending)
+                yield command, pendingProgress
+        finally:
+            rows.close()
+
+    def __flush(self, start, pending):
+        """
+        Returns (batch command or the row of a single move, where the plotter is after it).
+        """
+        if len(pending) == 1:
+            row = pending[0]
+            return row, (row[1], row[2])
+        endX, endY = self.__points(start, pending)[-1]
+        return self.__pack(start, pending), (start[0] + endX/BATCH_SCALE, start[1] + endY/BATCH_SCALE)
+
+    def __pack(self, start, pending):
+        offsets = []
+        previousX, previousY = 0, 0
+        for pointX, pointY in self.__points(start, pending):
+            offsets.append(f"{pointX - previousX},{pointY - previousY}")
+            previousX, previousY = pointX, pointY
+        return f"{BATCH_COMMAND},{','.join(offsets)},END\n"
+
+    def __points(self, start, pending):
+        # Rounded from the start of the batch, so rounding never adds up
+        return [(round((row[1] - start[0])*BATCH_SCALE), round((row[2] - start[1])*BATCH_SCALE)) for row in pending]
+
+    def __validPosition(self, X, Y):
+        # Points right on the edge are treated as invalid, the plotter may round them either way
+        margin = 1/BATCH_SCALE
+        return margin <= X <= MAX_POS_X - margin and -MAX_POS_Y + margin <= Y <= -margin
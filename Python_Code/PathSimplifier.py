@@ -0,0 +1,65 @@
+import numpy as np
+
+from GcodeProgram import OP_LINEAR
+from PointDecimator import PointDecimator, METHOD_DOUGLAS_PEUCKER
+
+class PathSimplifier:
+    """
+    Removes G01 commands that barely change the drawing, so fewer commands are sent to the plotter.
+    Only runs of pen down G01 moves in absolute coordinates are changed, every other command is kept as it is.
+    First collinear moves are merged, moves that continue along the same line (within 0.000001mm),
+    then Douglas-Peucker removes moves so the drawing never moves more than tolerance (mm) from the original.
+
+    tolerance -> Max distance in mm between the original and the simplified drawing, 0 only merges collinear moves.
+
+    simplify(program) -> Returns (simplified GcodeProgram, number of collinear moves merged, number of moves removed by Douglas-Peucker).
+    """
+    def __init__(self, tolerance=0.05):
+        self.__tolerance = tolerance
+        # Moves are collinear if the middle point is less than this (mm) from the line through its neighbours
+        self.__collinearTolerance = 1e-6
+
+    def simplify(self, program):
+        num = len(program)
+        if num == 0:
+            return program, 0, 0
+
+        commands = program.commands
+        x, y = program.positions()
+        inRun = (commands["op"] == OP_LINEAR) & (commands["pen"] == 1) & ~program.relativeMode()
+        if np.count_nonzero(inRun) < 2:
+            return program, 0, 0
+
+        # Every run gets its own label, every other command its own label too
+        runStarts = inRun & ~np.concatenate(([False], inRun[:-1]))
+        label = np.cumsum(runStarts | ~inRun)
+        # The point a run starts from is the position before its first move, it belongs to the run
+        startIndices = np.flatnonzero(runStarts)
+        startIndices = startIndices[startIndices > 0]
+        label[startIndices - 1] = label[startIndices]
+        # The plotter starts at home, a run at the very start of the program starts from there
+        x = np.concatenate(([0.0], x))
+        y = np.concatenate(([0.0], y))
+        label = np.concatenate(([label[0]], label))
+
+        keep = np.ones(num + 1, dtype=bool)
+        numMerged = self.__douglasPeucker(x, y, label, keep, self.__collinearTolerance)
+        numRemoved = 0
+        if self.__tolerance > self.__collinearTolerance:
+            numRemoved = self.__douglasPeucker(x, y, label, keep, self.__tolerance)
+
+        # Drop the home point added at the start
+        return program.select(keep[1:]), numMerged, numRemoved
+
+    def __douglasPeucker(self, x, y, label, keep, tolerance):
+        """
+        Douglas-Peucker of the points still kept, the first and last point of every label are always kept.
+        Marks removed points in keep and returns how many were removed.
+        """
+        kept = np.flatnonzero(keep)
+        decimator = PointDecimator(METHOD_DOUGLAS_PEUCKER, maxPoints=0, tolerance=tolerance)
+        indices, _ = decimator.decimate(x[kept], y[kept], label[kept])
+        keptAgain = np.zeros(len(kept), dtype=bool)
+        keptAgain[indices] = True
+        keep[kept[~keptAgain]] = False
+        return len(kept) - len(indices)
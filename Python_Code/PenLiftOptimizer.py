@@ -0,0 +1,86 @@
+import numpy as np
+
+from GcodeProgram import GcodeProgram, OP_LINEAR, OP_ARC_CCW, OP_PAUSE, OP_PEN_DOWN, OP_PEN_UP
+from TimeEstimator import PrintTimeEstimator
+
+class PenLiftOptimizer:
+    """
+    Removes pen moves that don't change the drawing, each one is a servo sweep on the plotter.
+    Pen commands that don't change the pen state (a pen up when the pen is already up) are removed.
+    When a stroke ends at the same motor position (calcMotorPos() in pos.ino) as the next one starts, the pen up,
+    the travel and the pen down between them are removed and the two strokes are drawn as one. The motors don't move
+    between them, so the ink drawn is the same. If the ends don't meet exactly they are joined with a G01, which the
+    plotter runs without a step.
+    With a tolerance, strokes that end within tolerance (mm) of the start of the next are joined as well.
+    That G01 draws up to tolerance mm that was not drawn before.
+    Strokes are never joined over a pause (G04), or when the travel between them is in relative coordinates.
+
+    tolerance -> Max distance in mm between the end of a stroke and the start of the next one for them to be joined
+                 even if the motors move, 0 only joins strokes that meet.
+
+    optimize(program) -> Returns (optimized GcodeProgram, servo moves before, servo moves after).
+    """
+    def __init__(self, tolerance=0.0):
+        self.__tolerance = tolerance
+        self.__estimator = PrintTimeEstimator()
+
+    def optimize(self, program):
+        servoMovesBefore = program.numServoMoves()
+        if len(program) == 0:
+            return program, servoMovesBefore, servoMovesBefore
+
+        commands = program.commands.copy()
+        ops = commands["op"]
+        x, y = program.positions()
+        relative = program.relativeMode()
+
+        # Pen state before each command, the pen starts up
+        penBefore = np.concatenate(([0], commands["pen"][:-1]))
+        keep = ~(((ops == OP_PEN_DOWN) & (penBefore == 1)) | ((ops == OP_PEN_UP) & (penBefore == 0)))
+
+        # Pen ups and the pen down that follows each, of the pen commands that are left
+        penCommands = np.flatnonzero(keep & ((ops == OP_PEN_DOWN) | (ops == OP_PEN_UP)))
+        isUp = ops[penCommands] == OP_PEN_UP
+        pairs = np.flatnonzero(isUp[:-1] & ~isUp[1:])
+        ups = penCommands[pairs]
+        downs = penCommands[pairs + 1]
+
+        # Gaps that can be joined, the same motor position or close enough, with no pause and no relative move between
+        isMove = ops <= OP_ARC_CCW
+        numPauses = np.concatenate(([0], np.cumsum(ops == OP_PAUSE)))
+        numRelativeMoves = np.concatenate(([0], np.cumsum(isMove & relative)))
+        distance = np.hypot(x[downs] - x[ups], y[downs] - y[ups])
+        leftUp, rightUp = self.__estimator.calcMotorPos(x[ups], y[ups])
+        leftDown, rightDown = self.__estimator.calcMotorPos(x[downs], y[downs])
+        sameMotorPos = (leftUp == leftDown) & (rightUp == rightDown)
+        join = (sameMotorPos | (distance <= self.__tolerance)) & (numPauses[downs] == numPauses[ups]) \
+            & (numRelativeMoves[downs] == numRelativeMoves[ups]) & ~relative[downs]
+        ups = ups[join]
+        downs = downs[join]
+        if len(ups) == 0 and keep.all():
+            return program, servoMovesBefore, servoMovesBefore
+
+        # Everything in a joined gap now runs with the pen down, the travel moves are removed
+        inGap = np.zeros(len(ops) + 1, dtype=np.int64)
+        np.add.at(inGap, ups, 1)
+        np.add.at(inGap, downs + 1, -1)
+        inGap = np.cumsum(inGap[:-1]) > 0
+        keep &= ~(inGap & isMove)
+        keep[ups] = False
+        keep[downs] = False
+        commands["pen"][inGap] = 1
+
+        # The last travel move of a gap becomes a G01 to the start of the next stroke, if the ends don't meet
+        numMoves = np.cumsum(isMove)
+        hasMove = numMoves[downs] > numMoves[ups]
+        lastMove = np.maximum.accumulate(np.where(isMove, np.arange(len(ops)), -1))[downs]
+        joinWithMove = lastMove[hasMove & (distance[join] > 0)]
+        keep[joinWithMove] = True
+        commands["op"][joinWithMove] = OP_LINEAR
+        commands["x"][joinWithMove] = x[joinWithMove]
+        commands["y"][joinWithMove] = y[joinWithMove]
+        commands["i"][joinWithMove] = np.nan
+        commands["j"][joinWithMove] = np.nan
+
+        optimized = GcodeProgram(commands[keep])
+        return optimized, servoMovesBefore, optimized.numServoMoves()
@@ -1,24 +1,35 @@
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.widgets import CheckButtons
 import numpy as np
-import re
+
+from PointsFile import PointsFile
+from Simulator import POINT_DTYPE
+from PointDecimator import PointDecimator, METHOD_MINMAX
 
 class plotPoints:
     """
-    This class reads points from a file, and then plots them.
+    This class reads points from a file, or is given them directly, and then plots them.
     It can optionally label the order of the points.
-    It is instantiated with the filename, which cannot be changed.
-    It simply plots the points in the the points.txt file, which are generated by 
-    GeneratePoints.exe. It is not aware of when the plotter pen is down or up, but usually
-    the plotter is up only for G00 (rapid position commands) where only the endpoints are in the points.txt file.
-    This makes a convincing simulation.
+    It is instantiated with the filename, which cannot be changed. The file is read with PointsFile, 
+    either a memory mapped points.npy or a legacy points.txt. If points (an array from PolargraphSimulator) 
+    are given the file is not read. Pen down strokes are drawn as solid lines, and pen up travel as a dashed
+    layer that can be hidden with the "Travel moves" check box. Points from a legacy points.txt have no pen state,
+    so they are all drawn as strokes.
+    Large simulations are reduced to a preview before they are drawn (see PointDecimator). The preview can be made
+    beforehand with preview(), ex.) in a worker process, and given as points with the number of points it was made from
+    (numPoints) and its error bound, then it is drawn as it is.
     
-    #Speed is the speed of the machine in mm/sec, all three inputs are used to calculate the 
-    time it will take for the machine to plot the device.
-    plotPoints.plotPoints(speed, numServoMoves, numCommands)
+    #timeEstimate is a TimeEstimate of the program, shown in the title if it is given.
+    plotPoints.plotPoints(timeEstimate)
+    plotPoints.preview(points) -> Returns (preview points, error bound in mm) of a POINT_DTYPE array, the points themselves if they are few enough.
 
     """
-    def __init__(self, __filename):
+    def __init__(self, __filename, points=None, numPoints=None, errorBound=0.0):
         self.__filename = __filename
+        self.__points = points
+        # Number of points a preview given as points was made from, None if the points were not reduced yet
+        self.__previewOf = numPoints
         
         # List of points
         self.__x_coords = None
@@ -28,16 +39,25 @@ class plotPoints:
         self.__add_text = False
         # Max number of points before it reduces points so plot will actually generate
         self.__maxPoints = 800000
-        # Aproximate time for one command (sec)
-        self.__singleCommandTime = 0.005
-        # Aproximate time for on servo move (sec)
-        self.__servoMoveTime = 0.3
+        # How points are reduced (see PointDecimator), and the number of pixel columns the error is measured against
+        self.__decimationMethod = METHOD_MINMAX
+        self.__previewColumns = 2000
+        # Max distance (mm) between the reduced points and the real path
+        self.__errorBound = errorBound
 
         self.__numPoints = 0
         self.__x_coords = []
         self.__y_coords = []
+        self.__pen = None
+
+        # Drawn layers, pen down strokes and pen up travel
+        self.__strokeColor = "tab:blue"
+        self.__travelColor = "tab:gray"
+        self.__strokeLines = None
+        self.__travelLines = None
+        self.__travelToggle = None
     
-    def plotPoints(self, speed, numServoMoves, numCommands):
+    def plotPoints(self, timeEstimate=None):
         """
         Plots the points in a readable display. This function is called externally.
         """
@@ -56,11 +76,14 @@ class plotPoints:
                         ha='center')
 
         #Plot everything
-        plt.plot(self.__x_coords, self.__y_coords, linestyle='', marker='o', markersize=3)
+        self.__drawPaths(plt.gca())
         
-        programTime = self.__getPredictedTime(speed, numServoMoves, numCommands)
-
-        plt.title(f"Polargraph Simulation.\nMax Estimated time {programTime:.2f} minutes.")
+        title = "Polargraph Simulation."
+        if timeEstimate is not None:
+            title += "\n" + timeEstimate.summary()
+        if self.__errorBound > 0:
+            title += f"\nPreview of {len(self.__x_coords)} of {self.__numPoints} points, within {self.__errorBound:.2f}mm."
+        plt.title(title)
         plt.xlabel("X-axis")
         plt.ylabel("Y-axis")
 
@@ -69,6 +92,7 @@ class plotPoints:
 
         # Autoscale the x-axis 
         ax.autoscale(enable=True, axis='x')
+        ax.autoscale_view()
 
         # Get the x-axis limits
         x_min, x_max = ax.get_xlim()
@@ -89,143 +113,109 @@ class plotPoints:
         #Set axes to always be an equal ratio
         ax.set_aspect('equal')
 
+        self.__addTravelToggle()
+
         plt.show()
 
         return True, "Points Plotted in Seperate Window"
 
-    def __getPointsFromFile(self):
+    def preview(self, points):
         """
-        Gets points from a file, does some error checking and reduces points if needed.
+        Reduces points the same way plotPoints() does, so they can be drawn without being reduced again.
         """
-        points = self.__readPointsFromFileHelper()
-
-        if isinstance(points, str):
-            error = points
-            print(error)
-            return False, error
-
-        self.__numPoints = len(points)
-
-        try:
-            self.__x_coords, self.__y_coords = zip(*points)
-        except ValueError:
-            error = "No Points to plot."
-            print(error)
-            return False, error
-        
-        #Reduce points if needed
-        self.__reducePoints()
+        decimator = PointDecimator(self.__decimationMethod, self.__maxPoints, self.__previewColumns)
+        indices, errorBound = decimator.decimate(points["x"], points["y"], points["pen"])
+        if len(indices) == len(points):
+            return np.asarray(points, dtype=POINT_DTYPE), errorBound
+        return np.asarray(points[indices], dtype=POINT_DTYPE), errorBound
 
-        return True, "Success."
-
-    def __readPointsFromFileHelper(self):
+    def __drawPaths(self, ax):
         """
-        Reads points of the form (X,Y) from a text file, assuming they might be on the same line.
-        Returns them as a list of tuples. Faster version with regular expressions.
+        Draws pen down strokes as solid lines and pen up travel as a dashed layer that can be hidden.
+        Each layer is one LineCollection, so drawing takes about the same time no matter how many strokes there are.
         """
-        points = []
-        try:
-            with open(self.__filename, 'r') as file:
-                content = file.read()
-                # Regular expression to find patterns like (X,Y)
-                # It looks for:
-                # \( : a literal opening parenthesis
-                # \s* : zero or more whitespace characters
-                # (-?\d+\.?\d*) : a number (integer or float, possibly negative) for X
-                # \s*,\s* : a comma surrounded by zero or more whitespace characters
-                # (-?\d+\.?\d*) : a number (integer or float, possibly negative) for Y
-                # \) : a literal closing parenthesis
-                pattern = r'\(\s*(-?\d+\.?\d*)\s*,\s*(-?\d+\.?\d*)\s*\)'
-                
-                for match in re.finditer(pattern, content):
-                    try:
-                        x = float(match.group(1))
-                        y = float(match.group(2))
-                        points.append((x, y))
-                    except ValueError:
-                        # This case should be rare if the regex is robust, 
-                        # but it's good for safety if numbers are malformed.
-                        print(f"Warning: Could not convert coordinates to numbers in: {match.group(0)}")
-        except FileNotFoundError:
-            print(f"Error: File not found at path: {self.__filename}")
-        return points
+        strokes, travel = self.__splitByPen()
+        self.__strokeLines = LineCollection(strokes, colors=self.__strokeColor, linewidths=1)
+        self.__travelLines = LineCollection(travel, colors=self.__travelColor, linewidths=0.75, linestyles='dashed')
+        ax.add_collection(self.__travelLines)
+        ax.add_collection(self.__strokeLines)
 
-    def __reducePoints(self):
+    def __splitByPen(self):
         """
-        Reduces number of points so they will be less than or close to max points.
+        Splits the path into runs where the pen stays down (strokes) or up (travel).
+        Returns two lists of (N, 2) arrays, one line for each run.
+        The path starts at home (0, 0), like the plotter.
         """
-        #Calculate point reduction
-        self.__numPoints = len(self.__x_coords)
+        x = np.concatenate(([0.0], self.__x_coords))
+        y = np.concatenate(([0.0], self.__y_coords))
+        # pen[i] is the pen while moving from point i to point i+1
+        pen = np.ones(len(self.__x_coords), dtype=np.uint8) if self.__pen is None else np.asarray(self.__pen)
+        path = np.column_stack((x, y))
+
+        runStarts = np.concatenate(([0], np.flatnonzero(pen[1:] != pen[:-1]) + 1))
+        runEnds = np.concatenate((runStarts[1:], [len(pen)]))
+        strokes = []
+        travel = []
+        for start, end in zip(runStarts.tolist(), runEnds.tolist()):
+            if pen[start]:
+                strokes.append(path[start:end + 1])
+            else:
+                travel.append(path[start:end + 1])
+        return strokes, travel
+
+    def __addTravelToggle(self):
+        """
+        Adds a check box to show or hide the travel moves.
+        """
+        fig = plt.gcf()
+        toggleAx = fig.add_axes([0.01, 0.01, 0.2, 0.06], frameon=False)
+        # Kept so the check box still works after this function returns
+        self.__travelToggle = CheckButtons(toggleAx, ["Travel moves"], [self.__travelLines.get_visible()])
 
-        pointsPerStep = 1
-        if (self.__numPoints > self.__maxPoints):
-            pointsPerStep = round(self.__numPoints/self.__maxPoints)
+        def toggleTravel(label):
+            self.__travelLines.set_visible(not self.__travelLines.get_visible())
+            fig.canvas.draw_idle()
 
-        if pointsPerStep != 1:
-            #Reduce number of points to managable amount
-            __x_coords = []
-            __y_coords = []
-            for i in range(self.__numPoints):
-                if i % pointsPerStep:
-                    __x_coords.append(self.__x_coords[i])
-                    __y_coords.append(self.__y_coords[i])
+        self.__travelToggle.on_clicked(toggleTravel)
 
-    def __getPredictedTime(self, speed, numServoMoves, numCmds):
+    def __getPointsFromFile(self):
         """
-        Returns estimated time of a program in minutes.
+        Gets points from a file, does some error checking and reduces points if needed.
         """
-        self.__x_coords = np.pad(self.__x_coords, (1, 1), 'constant', constant_values=0)
-        self.__y_coords = np.pad(self.__y_coords, (1, 1), 'constant', constant_values=0)
+        points = self.__points
+        if points is None:
+            try:
+                points = PointsFile.load(self.__filename)
+            except FileNotFoundError:
+                return False, f"Error: File not found at path: {self.__filename}"
+            except (OSError, ValueError) as e:
+                return False, f"Could not read points. {e}"
 
-        distance = self.__calculate_line_distance_numpy()
-
-        # speed(1 to 100)*10 = actualSpeed (steps/second)
-        # speed(steps/sec)/10 = speed(mm/sec)
-        # speed(1 to 100) = actualSpeed(mm/sec)
-        moveTime = distance/speed
+        self.__numPoints = len(points)
+        if self.__numPoints == 0:
+            return False, "No Points to plot."
 
-        commsTime = numCmds*self.__singleCommandTime
-        servoTime = numServoMoves*self.__servoMoveTime
-        
-        totalTimeMinutes = (moveTime + commsTime + servoTime)/60
+        self.__x_coords = points["x"]
+        self.__y_coords = points["y"]
+        self.__pen = points["pen"]
         
-        return totalTimeMinutes
+        #Reduce points if needed, a preview made with preview() already was
+        if self.__previewOf is None:
+            self.__reducePoints()
+        else:
+            self.__numPoints = self.__previewOf
 
+        return True, "Success."
 
-    def __calculate_line_distance_numpy(self):
+    def __reducePoints(self):
         """
-        Generated by google bard.
-        Calculates the total distance of a line defined by arrays of x and y coordinates
-        using NumPy for efficiency.
-
-        Args:
-            __x_coords (np.array or list): An array or list of x-coordinates.
-            __y_coords (np.array or list): An array or list of y-coordinates.
-
-        Returns:
-            float: The total length of the line.
+        Reduces number of points so they will be less than or close to max points, see PointDecimator.
         """
-        if len(self.__x_coords) != len(self.__y_coords):
-            raise ValueError("__x_coords and __y_coords must have the same number of points.")
-        if len(self.__x_coords) < 2:
-            return 0.0 # A line needs at least two points to have a length
-
-        # Ensure they are NumPy arrays for efficient computation
-        __x_coords = np.asarray(self.__x_coords)
-        __y_coords = np.asarray(self.__y_coords)
-
-        # Calculate differences between consecutive points
-        # __x_coords[1:] gives all elements from the second to the end
-        # __x_coords[:-1] gives all elements from the beginning to the second to last
-        dx = __x_coords[1:] - __x_coords[:-1]
-        dy = __y_coords[1:] - __y_coords[:-1]
-
-        # Calculate squared Euclidean distances for each segment
-        # np.hypot(dx, dy) is a more numerically stable way to calculate sqrt(dx^2 + dy^2)
-        # especially for very large or very small dx, dy values, preventing overflow/underflow.
-        segment_distances = np.hypot(dx, dy)
-
-        # Sum all segment distances to get the total length
-        total_distance = np.sum(segment_distances)
-
-        return total_distance
\ No newline at end of file
+        self.__numPoints = len(self.__x_coords)
+        decimator = PointDecimator(self.__decimationMethod, self.__maxPoints, self.__previewColumns)
+        indices, self.__errorBound = decimator.decimate(self.__x_coords, self.__y_coords, self.__pen)
+        if len(indices) < self.__numPoints:
+            self.__x_coords = np.asarray(self.__x_coords)[indices]
+            self.__y_coords = np.asarray(self.__y_coords)[indices]
+            if self.__pen is not None:
+                self.__pen = np.asarray(self.__pen)[indices]
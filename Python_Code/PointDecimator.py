@@ -0,0 +1,227 @@
+import numpy as np
+
+# Decimation methods
+METHOD_STRIDE = "stride"
+METHOD_MINMAX = "minmax"
+METHOD_DOUGLAS_PEUCKER = "douglas-peucker"
+METHODS = (METHOD_STRIDE, METHOD_MINMAX, METHOD_DOUGLAS_PEUCKER)
+
+class PointDecimator:
+    """
+    Reduces the number of points in a path so large simulations can be previewed quickly.
+    The first and last point are always kept, and so are the points on both sides of a pen up/down change,
+    so strokes and travel moves stay seperate.
+
+    Methods:
+    stride -> Keeps every n-th point so the result is about maxPoints. Fastest, but has no error bound of its own.
+    minmax -> Splits the drawing into `columns` pixel columns. For every run of points in one column it keeps
+        the first, last, lowest and highest point. A removed point is never more than one column width from the path.
+    douglas-peucker -> Keeps the fewest points so no removed point is more than tolerance (mm) from the path.
+        The tolerance defaults to one column width. Slowest, but keeps the fewest points.
+
+    With maxPoints above 0 the result never has more than maxPoints points. If a method keeps too many (ex.) a zigzag that crosses a column
+    at every point, or the pen going up and down every few points) minmax is done again with fewer, wider columns,
+    (down to 1/16 of them), and if that is still too many the kept points are strided down to maxPoints, even if pen changes are lost.
+    The error bound is widened to match, for the stride it is measured with maxError().
+    With maxPoints 0 every path is decimated and nothing is capped, ex.) to simplify a path to a tolerance.
+
+    decimate(x, y, pen) -> Returns (indices of the kept points, max distance of a removed point from the kept path in mm).
+    maxError(x, y, indices) -> Distance in mm of the removed point furthest from the path through the kept points.
+    """
+    def __init__(self, method=METHOD_MINMAX, maxPoints=800000, columns=2000, tolerance=None):
+        if method not in METHODS:
+            raise ValueError(f"Unknown decimation method {method}, must be one of {METHODS}.")
+        self.__method = method
+        self.__maxPoints = maxPoints
+        self.__columns = columns
+        self.__tolerance = tolerance
+        # Points worked on at once
+        self.__blockSize = 65536
+
+    def decimate(self, x, y, pen=None):
+        """
+        Returns the sorted indices of the points to keep, and the error bound of the result in mm.
+        The bound is the column width for minmax and the tolerance for douglas-peucker, for stride it is measured with maxError().
+        Nothing is removed if there are maxPoints or fewer points, and never more than maxPoints are kept.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        num = len(x)
+        if num <= max(self.__maxPoints, 2):
+            return np.arange(num), 0.0
+
+        if self.__method == METHOD_STRIDE:
+            keep = self.__mustKeep(num, pen)
+            step = int(np.ceil(num/self.__maxPoints))
+            keep[::step] = True
+            indices = np.flatnonzero(keep)
+            # Stride has no bound of its own, so the error is measured
+            return self.__capPoints(x, y, indices, None)
+        elif self.__method == METHOD_MINMAX:
+            columns = self.__columns
+            # Some paths (ex.) a zigzag across the drawing) don't merge however wide the columns are, those are strided
+            minColumns = max(1, self.__columns//16)
+            while True:
+                keep = self.__mustKeep(num, pen)
+                errorBound = self.__columnWidth(x, y, columns)
+                self.__minMax(x, y, keep, errorBound)
+                numKept = int(np.count_nonzero(keep))
+                if self.__maxPoints <= 0 or numKept <= self.__maxPoints or columns <= minColumns:
+                    break
+                # Wider columns keep fewer points, about in proportion
+                columns = max(minColumns, min(columns - 1, int(columns*self.__maxPoints/numKept)))
+        else:
+            keep = self.__mustKeep(num, pen)
+            errorBound = self.__getTolerance(x, y)
+            self.__douglasPeucker(x, y, keep, errorBound)
+        return self.__capPoints(x, y, np.flatnonzero(keep), errorBound)
+
+    def maxError(self, x, y, indices):
+        """
+        Every removed point is measured against the segment between the kept points on either side of it.
+        This is stricter than the minmax bound, which is the distance to any part of the kept path in the same column.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(indices) == len(x):
+            return 0.0
+        keep = np.zeros(len(x), dtype=bool)
+        keep[indices] = True
+        # Segment of every point, between the kept points before and after it
+        segment = np.minimum(np.cumsum(keep) - 1, len(indices) - 2)
+        keptX = x[indices]
+        keptY = y[indices]
+        maxDistanceSquared = 0.0
+        # Done in blocks, small arrays stay in the cpu cache which is much faster than working on every point at once
+        for start in range(0, len(x), self.__blockSize):
+            block = slice(start, start + self.__blockSize)
+            blockSegment = segment[block]
+            distanceSquared = self.__segmentDistanceSquared(x[block], y[block], keptX[blockSegment], keptY[blockSegment], 
+                                                            keptX[blockSegment + 1], keptY[blockSegment + 1])
+            maxDistanceSquared = max(maxDistanceSquared, float(np.max(distanceSquared)))
+        return float(np.sqrt(maxDistanceSquared))
+
+    def __mustKeep(self, num, pen):
+        """
+        Marks the first and last point, and the points on both sides of every pen change.
+        """
+        keep = np.zeros(num, dtype=bool)
+        keep[0] = True
+        keep[-1] = True
+        if pen is not None:
+            pen = np.asarray(pen)
+            change = np.flatnonzero(pen[1:] != pen[:-1])
+            keep[change] = True
+            keep[change + 1] = True
+        return keep
+
+    def __capPoints(self, x, y, indices, errorBound):
+        """
+        Strides the kept points down to maxPoints if there are more (and maxPoints is not 0), the first and last point are still kept.
+        Returns (indices, error bound), the bound is measured if the points were strided or errorBound is None.
+        """
+        maxPoints = max(self.__maxPoints, 2)
+        if self.__maxPoints > 0 and len(indices) > maxPoints:
+            # Every step-th point, with the last point taking the place of the last one picked
+            step = int(np.ceil((len(indices) - 1)/(maxPoints - 1)))
+            indices = np.concatenate((indices[:-1:step], indices[-1:]))
+            errorBound = None
+        if errorBound is None:
+            errorBound = self.maxError(x, y, indices)
+        return indices, errorBound
+
+    def __getTolerance(self, x, y):
+        if self.__tolerance is not None:
+            return self.__tolerance
+        return self.__columnWidth(x, y, self.__columns)
+
+    def __columnWidth(self, x, y, columns):
+        # Columns cover the larger side of the drawing, as the plot has equal axes
+        extent = max(np.max(x) - np.min(x), np.max(y) - np.min(y))
+        if extent <= 0:
+            return 1.0
+        return extent/columns
+
+    def __minMax(self, x, y, keep, columnWidth):
+        """
+        Marks the first, last, lowest and highest point of each run of points in the same pixel column.
+        The path through those points covers every height the removed points were at, inside the same column,
+        so a removed point is at most one column width from it.
+        """
+        column = np.floor((x - np.min(x))/columnWidth).astype(np.int64)
+        # Start index of every run of points in the same column
+        runStarts = np.concatenate(([0], np.flatnonzero(column[1:] != column[:-1]) + 1))
+        runEnds = np.concatenate((runStarts[1:], [len(x)]))
+        keep[runStarts] = True
+        keep[runEnds - 1] = True
+
+        # Lowest and highest point of each run
+        runMin = np.minimum.reduceat(y, runStarts)
+        runMax = np.maximum.reduceat(y, runStarts)
+        run = np.repeat(np.arange(len(runStarts)), runEnds - runStarts)
+        for extreme in (runMin, runMax):
+            isExtreme = np.flatnonzero(y == extreme[run])
+            keep[isExtreme[self.__firstOfEachRun(run[isExtreme])]] = True
+
+    def __douglasPeucker(self, x, y, keep, tolerance):
+        """
+        Douglas-Peucker done in blocks of points, the ends of every block are kept.
+        """
+        last = len(x) - 1
+        for start in range(0, last, self.__blockSize):
+            end = min(start + self.__blockSize, last)
+            keep[start] = True
+            keep[end] = True
+            # Views, so the block marks the points in keep
+            self.__douglasPeuckerBlock(x[start:end + 1], y[start:end + 1], keep[start:end + 1], tolerance)
+
+    def __douglasPeuckerBlock(self, x, y, keep, tolerance):
+        """
+        Douglas-Peucker done for every segment at once. Each pass finds the furthest point of every segment
+        and keeps it if it is more than tolerance from the segment. Segments with no such point are finished 
+        and their points are not looked at again.
+        """
+        toleranceSquared = tolerance*tolerance
+        # Points in segments that are not finished, always in order
+        active = np.arange(len(x))
+        while len(active) > 0:
+            indices = np.flatnonzero(keep)
+            keptX = x[indices]
+            keptY = y[indices]
+            # Segment of every point, between the kept points before and after it
+            segment = np.minimum(np.cumsum(keep)[active] - 1, len(indices) - 2)
+            distance = self.__segmentDistanceSquared(x[active], y[active], keptX[segment], keptY[segment], keptX[segment + 1], keptY[segment + 1])
+            distance[keep[active]] = 0
+
+            # Furthest point of every segment, active points are in order so each segment is one run
+            groupStarts = np.concatenate(([0], np.flatnonzero(segment[1:] != segment[:-1]) + 1))
+            group = np.repeat(np.arange(len(groupStarts)), np.diff(groupStarts, append=len(segment)))
+            groupMax = np.maximum.reduceat(distance, groupStarts)
+            split = groupMax > toleranceSquared
+            if not np.any(split):
+                return
+
+            candidates = np.flatnonzero(split[group] & (distance == groupMax[group]))
+            keep[active[candidates[self.__firstOfEachRun(group[candidates])]]] = True
+            active = active[split[group]]
+
+    def __firstOfEachRun(self, values):
+        """
+        Index of the first of each run of equal values, used to pick one point per group when several are equal.
+        """
+        return np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+
+    def __segmentDistanceSquared(self, x, y, startX, startY, endX, endY):
+        """
+        Squared distance from each point (x, y) to the segment from (startX, startY) to (endX, endY).
+        Squared so no square root is needed for every point.
+        """
+        dx = endX - startX
+        dy = endY - startY
+        lengthSquared = dx*dx + dy*dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((x - startX)*dx + (y - startY)*dy)/lengthSquared
+        t = np.where(lengthSquared > 0, np.clip(t, 0, 1), 0)
+        offsetX = x - (startX + t*dx)
+        offsetY = y - (startY + t*dy)
+        return offsetX*offsetX + offsetY*offsetY
@@ -0,0 +1,84 @@
+import os
+import re
+import numpy as np
+
+from Simulator import POINT_DTYPE
+
+# First bytes of every .npy file
+_NPY_MAGIC = b"\x93NUMPY"
+
+# Legacy points.txt, points of the form (X,Y), possibly many on one line
+# \( : a literal opening parenthesis
+# \s* : zero or more whitespace characters
+# (-?\d+\.?\d*) : a number (integer or float, possibly negative) for X
+# \s*,\s* : a comma surrounded by zero or more whitespace characters
+# (-?\d+\.?\d*) : a number (integer or float, possibly negative) for Y
+# \) : a literal closing parenthesis
+_TEXT_POINT_PATTERN = re.compile(rb"\(\s*(-?\d+\.?\d*)\s*,\s*(-?\d+\.?\d*)\s*\)")
+
+class PointsFile:
+    """
+    Reads and writes simulated points.
+    Points are saved as a .npy file holding a POINT_DTYPE array (x, y, pen), so it has a small header
+    followed by the raw values. Loading memory maps the file, the points are only read from disk
+    when they are used and are never copied into python objects.
+    The older points.txt text format, "(X,Y)" points, is still read. It has no pen state so every point is treated as pen down.
+
+    save(file, points) -> Writes a POINT_DTYPE array to a .npy file.
+    load(file) -> Returns a POINT_DTYPE array from a .npy or points.txt file. Raises OSError or ValueError.
+    """
+    @staticmethod
+    def save(file, points):
+        """
+        Writes the points to file. The file is written under a temporary name first, so a half written
+        file is never loaded. Raises OSError if the file can't be written.
+        """
+        with open(file + ".tmp", 'wb') as f:
+            np.save(f, np.asarray(points, dtype=POINT_DTYPE), allow_pickle=False)
+        os.replace(file + ".tmp", file)
+
+    @staticmethod
+    def load(file):
+        """
+        Loads points from a .npy file (memory mapped) or from a legacy points.txt file.
+        A .npy file can also hold a plain (N, 2) or (N, 3) array of x, y and optionally pen.
+        """
+        with open(file, 'rb') as f:
+            isNpy = f.read(len(_NPY_MAGIC)) == _NPY_MAGIC
+        if isNpy:
+            return PointsFile.__loadNpy(file)
+        return PointsFile.__loadText(file)
+
+    @staticmethod
+    def __loadNpy(file):
+        points = np.load(file, mmap_mode='r', allow_pickle=False)
+        if points.dtype.names is not None:
+            if "x" not in points.dtype.names or "y" not in points.dtype.names:
+                raise ValueError(f"{file} does not have x and y points.")
+            if points.dtype == POINT_DTYPE:
+                # Used as is, no copy
+                return points
+            converted = np.zeros(len(points), dtype=POINT_DTYPE)
+            converted["x"] = points["x"]
+            converted["y"] = points["y"]
+            converted["pen"] = points["pen"] if "pen" in points.dtype.names else 1
+            return converted
+
+        if points.ndim != 2 or points.shape[1] not in (2, 3):
+            raise ValueError(f"{file} does not have x and y points.")
+        converted = np.zeros(len(points), dtype=POINT_DTYPE)
+        converted["x"] = points[:, 0]
+        converted["y"] = points[:, 1]
+        converted["pen"] = points[:, 2] if points.shape[1] == 3 else 1
+        return converted
+
+    @staticmethod
+    def __loadText(file):
+        with open(file, 'rb') as f:
+            content = f.read()
+        values = np.array(_TEXT_POINT_PATTERN.findall(content), dtype=np.float64).reshape(-1, 2)
+        points = np.zeros(len(values), dtype=POINT_DTYPE)
+        points["x"] = values[:, 0]
+        points["y"] = values[:, 1]
+        points["pen"] = 1
+        return points
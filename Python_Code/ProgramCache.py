@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import tempfile
+import numpy as np
+
+from GcodeProgram import GcodeProgram, PROGRAM_DTYPE
+
+# Changed whenever parsing or converting a file gives a different program, so older cached programs are not used
+CACHE_VERSION = 2
+
+class ProgramCache:
+    """
+    On disk cache of parsed GCODE programs, shared by simulation, export and running a file.
+    Programs are stored by the hash of the file contents, so a program is only parsed once
+    even if the file is copied or renamed. The path, size and modified time of each file are kept
+    so an unchanged file is not read again just to hash it.
+    When the cache is larger than maxBytes the least recently used programs are removed. When a program was used is only
+    updated every lastUsedInterval seconds, so loading a program normally doesn't write the index.
+    The cache is shared by processes as well as threads (the simulation worker parses files in its own process),
+    so every change to the index is made holding a lock file, and temporary files get unique names.
+    Program files the index doesn't list (ex.) left by a process that was ended) are removed with the other evicted programs.
+    The index records CACHE_VERSION and PROGRAM_DTYPE, a cache made by a different version is emptied when it is read,
+    and an entry that does not hold a PROGRAM_DTYPE array is removed instead of being used.
+
+    load(file, hashIfChanged) -> Returns the cached program for a file, or None if it is not cached.
+    store(file, program) -> Saves a parsed GcodeProgram for a file.
+    get(file, parse) -> Returns the cached program, or calls parse(file), stores and returns the result.
+    clear() -> Removes every cached program.
+    """
+    def __init__(self, directory=None, maxBytes=512*1024*1024):
+        if directory is None:
+            base = os.environ.get("LOCALAPPDATA", os.path.join(os.path.expanduser("~"), ".cache"))
+            directory = os.path.join(base, "GCODE_Plotter", "ProgramCache")
+        self.__directory = directory
+        self.__maxBytes = maxBytes
+        self.__indexFile = os.path.join(directory, "index.json")
+        # Programs in a cache made with another version or dtype are not used
+        self.__format = f"{CACHE_VERSION}:{PROGRAM_DTYPE.descr}"
+        # Cache can be used by the GUI and the GCODE thread at the same time
+        self.__lock = threading.Lock()
+        # and by other processes, which take the lock file
+        self.__lockFile = os.path.join(directory, "index.lock")
+        # Seconds to wait for the lock file before the cache is skipped, and age of a lock file left by a process that was ended
+        self.__lockTimeout = 10.0
+        self.__staleLockTime = 60.0
+        # Seconds before the last use of a program is updated again, eviction doesn't need it to be exact
+        self.__lastUsedInterval = 60*60
+        # The index read by __readIndex() was changed and has to be written
+        self.__indexChanged = False
+        self.__debug = False
+        # Size of blocks read when hashing a file
+        self.__hashBlockSize = 1024*1024
+
+    def load(self, file, hashIfChanged=True):
+        """
+        Returns the cached program for a file, or None if it is not cached or can't be read.
+        If hashIfChanged is False a file that is not already known by its path, size and modified time 
+        is not read to find its hash, it is just treated as not cached.
+        """
+        with self.__lock:
+            if not self.__acquireLockFile():
+                return None
+            try:
+                index = self.__readIndex()
+                fileHash = self.__hashFile(file, index, hashIfChanged)
+                if fileHash is None:
+                    return None
+                program = self.__readEntry(fileHash, index)
+                if self.__indexChanged:
+                    self.__writeIndex(index)
+                return program
+            finally:
+                self.__releaseLockFile()
+
+    def store(self, file, program):
+        """
+        Saves a program for a file. Errors writing the cache are ignored, the cache is only a speed up.
+        """
+        with self.__lock:
+            if not self.__acquireLockFile():
+                return
+            try:
+                index = self.__readIndex()
+                fileHash = self.__hashFile(file, index)
+                if fileHash is None:
+                    return
+                self.__writeEntry(fileHash, program, index)
+                self.__evict(index)
+                self.__writeIndex(index)
+            finally:
+                self.__releaseLockFile()
+
+    def get(self, file, parse):
+        """
+        Returns the cached program for a file. If it is not cached, parse(file) is called.
+        If parse returns a GcodeProgram it is stored, anything else (like an error string) is returned without storing.
+        """
+        program = self.load(file)
+        if program is not None:
+            if self.__debug:
+                print(f"Cache hit {file}")
+            return program
+        program = parse(file)
+        if isinstance(program, GcodeProgram):
+            self.store(file, program)
+        return program
+
+    def clear(self):
+        with self.__lock:
+            if not self.__acquireLockFile():
+                return
+            try:
+                index = self.__readIndex()
+                for fileHash in list(index["entries"]):
+                    self.__removeEntry(fileHash, index)
+                index["files"] = {}
+                self.__removeUnlisted(index)
+                self.__writeIndex(index)
+            finally:
+                self.__releaseLockFile()
+
+    # REGION Helpers, all called with the lock held
+    def __acquireLockFile(self):
+        """
+        Creates the lock file, waiting while another process has it. Returns False if it was not free within lockTimeout seconds.
+        A lock file older than staleLockTime seconds was left by a process that was ended, it is removed.
+        """
+        deadline = time.perf_counter() + self.__lockTimeout
+        while True:
+            try:
+                os.makedirs(self.__directory, exist_ok=True)
+                os.close(os.open(self.__lockFile, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.__lockFile) > self.__staleLockTime:
+                        os.remove(self.__lockFile)
+                        continue
+                except OSError:
+                    # Released while it was checked
+                    continue
+            except OSError as e:
+                if self.__debug:
+                    print(f"Could not lock cache: {e}")
+                return False
+            if time.perf_counter() > deadline:
+                if self.__debug:
+                    print("Cache is locked by another process.")
+                return False
+            time.sleep(0.01)
+
+    def __releaseLockFile(self):
+        try:
+            os.remove(self.__lockFile)
+        except OSError:
+            pass
+
+    def __hashFile(self, file, index, hashIfChanged=True):
+        """
+        Returns the content hash of a file. The hash is reused if the path, size and modified time have not changed.
+        Returns None if the file can't be read, or if it has changed and hashIfChanged is False.
+        """
+        try:
+            path = os.path.abspath(file)
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        known = index["files"].get(path)
+        if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns:
+            return known["hash"]
+        if not hashIfChanged:
+            return None
+
+        sha = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    block = f.read(self.__hashBlockSize)
+                    if not block:
+                        break
+                    sha.update(block)
+        except OSError:
+            return None
+
+        fileHash = sha.hexdigest()
+        index["files"][path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": fileHash}
+        self.__indexChanged = True
+        return fileHash
+
+    def __entryPath(self, fileHash):
+        return os.path.join(self.__directory, fileHash + ".npy")
+
+    def __readEntry(self, fileHash, index):
+        entry = index["entries"].get(fileHash)
+        if entry is None:
+            return None
+        try:
+            # The array is read into memory rather than memory mapped, 
+            # a mapped file can't be removed or replaced on windows while it is open
+            with open(self.__entryPath(fileHash), 'rb') as f:
+                commands = np.load(f, allow_pickle=False)
+            if commands.dtype != PROGRAM_DTYPE:
+                raise ValueError(f"cached program has dtype {commands.dtype}")
+        except Exception as e:
+            if self.__debug:
+                print(f"Could not read cache entry: {e}")
+            self.__removeEntry(fileHash, index)
+            return None
+        if time.time() - entry["lastUsed"] > self.__lastUsedInterval:
+            entry["lastUsed"] = time.time()
+            self.__indexChanged = True
+        return GcodeProgram.fromArray(commands)
+
+    def __writeEntry(self, fileHash, program, index):
+        path = self.__entryPath(fileHash)
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            # Write to a temporary file first so a half written entry is never read
+            self.__replaceFile(path, lambda f: np.save(f, program.commands, allow_pickle=False), 'wb')
+            size = os.path.getsize(path)
+        except OSError as e:
+            if self.__debug:
+                print(f"Could not write cache entry: {e}")
+            return
+        index["entries"][fileHash] = {"size": size, "lastUsed": time.time()}
+
+    def __removeEntry(self, fileHash, index):
+        index["entries"].pop(fileHash, None)
+        self.__indexChanged = True
+        try:
+            os.remove(self.__entryPath(fileHash))
+        except OSError:
+            pass
+
+    def __evict(self, index):
+        """
+        Removes the least recently used programs until the cache is under maxBytes.
+        The most recent program is always kept.
+        """
+        entries = index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for fileHash in sorted(entries, key=lambda h: entries[h]["lastUsed"]):
+            if total <= self.__maxBytes or len(entries) <= 1:
+                break
+            total -= entries[fileHash]["size"]
+            self.__removeEntry(fileHash, index)
+
+        # Forget files whose programs are no longer cached
+        index["files"] = {path: known for path, known in index["files"].items() if known["hash"] in entries}
+        self.__removeUnlisted(index)
+
+    def __removeUnlisted(self, index):
+        """
+        Removes programs and temporary files the index doesn't list. With the lock file held no other process is writing them.
+        """
+        try:
+            names = os.listdir(self.__directory)
+        except OSError:
+            return
+        for name in names:
+            fileHash, extension = os.path.splitext(name)
+            if (extension == ".npy" and fileHash not in index["entries"]) or extension == ".tmp":
+                try:
+                    os.remove(os.path.join(self.__directory, name))
+                except OSError:
+                    pass
+
+    def __readIndex(self):
+        self.__indexChanged = False
+        try:
+            with open(self.__indexFile, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if "entries" in index and "files" in index:
+                if index.get("format") == self.__format:
+                    return index
+                # Made by another version, its programs may not match what parsing the file gives now
+                for fileHash in list(index["entries"]):
+                    self.__removeEntry(fileHash, index)
+        except (OSError, ValueError, AttributeError):
+            pass
+        return {"format": self.__format, "entries": {}, "files": {}}
+
+    def __writeIndex(self, index):
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            self.__replaceFile(self.__indexFile, lambda f: json.dump(index, f), 'w')
+        except OSError as e:
+            if self.__debug:
+                print(f"Could not write cache index: {e}")
+
+    def __replaceFile(self, path, write, mode):
+        """
+        Calls write(f) on a new temporary file, then renames it over path. The temporary name is unique to this write.
+        """
+        handle, tempPath = tempfile.mkstemp(dir=self.__directory, suffix=".tmp")
+        try:
+            with open(handle, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+                write(f)
+            os.replace(tempPath, path)
+        except BaseException:
+            try:
+                os.remove(tempPath)
+            except OSError:
+                pass
+            raise
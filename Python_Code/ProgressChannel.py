@@ -0,0 +1,128 @@
+import time
+import threading
+from collections import deque
+
+class ProgressState:
+    """
+    Progress of a GCODE run at one moment.
+    done -> Commands (program rows) sent, with the handshake each one is also complete.
+    total -> Number of commands in the run, None if it is not known (a file run without parsing it first).
+    fraction -> Fraction (0-1) of the run done.
+    commandsPerSecond -> Commands sent per second over the last few seconds.
+    etaSeconds -> Seconds left at the rate of the last few seconds, None until there is a rate.
+    running -> False once the run ended.
+
+    text() -> Returns the progress as a short string for a label, ex.) "42% 120 cmd/s\\nETA 1:02:03".
+    """
+    __slots__ = ("done", "total", "fraction", "commandsPerSecond", "etaSeconds", "running")
+
+    def __init__(self, done=0, total=None, fraction=0.0, commandsPerSecond=0.0, etaSeconds=None, running=False):
+        self.done = done
+        self.total = total
+        self.fraction = fraction
+        self.commandsPerSecond = commandsPerSecond
+        self.etaSeconds = etaSeconds
+        self.running = running
+
+    def text(self):
+        if not self.running:
+            return ""
+        text = f"{round(self.fraction*100)}% {self.commandsPerSecond:.0f} cmd/s"
+        if self.etaSeconds is not None:
+            minutes, seconds = divmod(int(self.etaSeconds), 60)
+            hours, minutes = divmod(minutes, 60)
+            text += f"\nETA {hours}:{minutes:02d}:{seconds:02d}"
+        return text
+
+class ProgressChannel:
+    """
+    Latest progress of a GCODE run, shared between the thread that runs it and the GUI.
+    Only the latest state is kept, so nothing piles up however many commands a run sends.
+    The run calls update() for every command, but the rate and ETA are only worked out and published
+    every publishInterval seconds. The GUI polls as often as it likes and only gets something when it changed.
+    The rate and ETA are measured over the last rateWindow seconds, so they follow changes in speed (short moves, arcs, pauses).
+
+    start(total, done) -> A run started, done is more than 0 when a run is resumed.
+    update(done, fraction) -> Commands sent so far and the fraction of the run done, cheap enough to call for every command.
+    stop() -> The run ended.
+    setCommand(command) -> The last command sent to the device, ex.) by USBComm.
+    poll() -> Returns the new ProgressState, or None if it did not change since the last poll.
+    pollCommand() -> Returns the last command sent, or None if it did not change since the last poll.
+    """
+    def __init__(self, publishInterval=0.2, rateWindow=10.0):
+        self.__publishInterval = publishInterval
+        self.__rateWindow = rateWindow
+        self.__lock = threading.Lock()
+
+        # Written by the run
+        self.__total = None
+        self.__done = 0
+        self.__fraction = 0.0
+        self.__running = False
+        self.__lastPublishTime = 0.0
+        # (time, done, fraction) at each publish within the rate window
+        self.__samples = deque()
+
+        # Published state, read by the GUI
+        self.__state = ProgressState()
+        self.__version = 0
+        self.__polledVersion = 0
+        self.__command = None
+        self.__polledCommand = None
+
+    def start(self, total=None, done=0):
+        self.__total = total
+        self.__done = done
+        self.__fraction = done/total if total else 0.0
+        self.__running = True
+        self.__samples.clear()
+        self.__publish(time.perf_counter())
+
+    def update(self, done, fraction):
+        self.__done = done
+        self.__fraction = fraction
+        now = time.perf_counter()
+        if now - self.__lastPublishTime >= self.__publishInterval:
+            self.__publish(now)
+
+    def stop(self):
+        self.__running = False
+        self.__publish(time.perf_counter())
+
+    def setCommand(self, command):
+        self.__command = command
+
+    def poll(self):
+        with self.__lock:
+            if self.__version == self.__polledVersion:
+                return None
+            self.__polledVersion = self.__version
+            return self.__state
+
+    def pollCommand(self):
+        command = self.__command
+        if command is self.__polledCommand:
+            return None
+        self.__polledCommand = command
+        return command
+
+    def __publish(self, now):
+        self.__lastPublishTime = now
+        samples = self.__samples
+        samples.append((now, self.__done, self.__fraction))
+        while len(samples) > 2 and now - samples[0][0] > self.__rateWindow:
+            samples.popleft()
+
+        commandsPerSecond = 0.0
+        etaSeconds = None
+        firstTime, firstDone, firstFraction = samples[0]
+        if now > firstTime:
+            commandsPerSecond = (self.__done - firstDone)/(now - firstTime)
+            fractionPerSecond = (self.__fraction - firstFraction)/(now - firstTime)
+            if fractionPerSecond > 0:
+                etaSeconds = (1 - self.__fraction)/fractionPerSecond
+
+        state = ProgressState(self.__done, self.__total, self.__fraction, commandsPerSecond, etaSeconds, self.__running)
+        with self.__lock:
+            self.__state = state
+            self.__version += 1
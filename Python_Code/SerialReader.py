@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+
+import serial
+
+# Kinds of lines the device sends
+EVENT_ECHO = "echo"         # Any other line, ex.) a command sent back, RUNNING or a message
+EVENT_READY = "ready"       # READY
+EVENT_COMPLETE = "complete" # CMD_COMPLETE
+EVENT_ESTOP = "estop"       # ESTOP_PRESSED
+EVENT_RESET = "reset"       # POLARGRAPH ON!, the device reset
+EVENT_STREAM = "stream"     # STREAM,<slots>
+EVENT_ACK = "ack"           # ACK,<seq>
+EVENT_NAK = "nak"           # NAK,<seq>
+EVENT_CLOSED = "closed"     # The connection was lost or closed, no more events will come
+
+class SerialEvent:
+    """
+    One line from the device.
+    kind -> One of the EVENT_ kinds.
+    text -> The line without the line ending.
+    value -> The number after the comma of STREAM, ACK and NAK, otherwise None.
+    time -> time.perf_counter() when the line was read.
+    """
+    __slots__ = ("kind", "text", "value", "time")
+
+    def __init__(self, kind, text="", value=None, eventTime=0.0):
+        self.kind = kind
+        self.text = text
+        self.value = value
+        self.time = eventTime
+
+class SerialReader:
+    """
+    Reads everything the device sends in its own thread, splits it into lines and turns each line into a SerialEvent.
+    Senders wait on nextEvent() instead of polling the port, the waiting thread wakes as soon as a line arrives
+    and nothing runs while the device is quiet.
+
+    sink -> Optional function called with each SerialEvent in the reader thread instead of queueing it for nextEvent(),
+            ex.) to hand the events to an asyncio event loop (see AsyncUSBComm).
+
+    start() -> Starts the reader thread.
+    stop() -> Stops the reader thread, waits for it to finish.
+    isRunning() -> Returns if the reader thread is running.
+    nextEvent(timeout) -> Returns the next SerialEvent, or None if there is none within timeout seconds (None waits forever, 0 does not wait).
+    clear() -> Throws away every event that has not been taken yet.
+    """
+    def __init__(self, device, sink=None):
+        self.__device = device
+        self.__events = queue.Queue()
+        self.__put = self.__events.put if sink is None else sink
+        # Bytes received after the last newline
+        self.__buffer = bytearray()
+        # Lines longer than this without a newline are garbage, the device never sends them
+        self.__maxLineLength = 1024
+        self.__running = False
+        self.__thread = None
+
+    def start(self):
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            # The read in the thread returns within the device timeout
+            self.__thread.join(timeout=2)
+        self.__thread = None
+
+    def isRunning(self):
+        return self.__running
+
+    def nextEvent(self, timeout=None):
+        try:
+            if timeout == 0:
+                return self.__events.get_nowait()
+            return self.__events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        while True:
+            try:
+                self.__events.get_nowait()
+            except queue.Empty:
+                return
+
+    def __run(self):
+        while self.__running:
+            try:
+                # Waits for the first byte, then takes everything that has already arrived
+                data = self.__device.read(1)
+                if data:
+                    waiting = self.__device.in_waiting
+                    if waiting:
+                        data += self.__device.read(waiting)
+            except (serial.SerialException, OSError, TypeError, AttributeError):
+                # Port closed or unplugged
+                break
+            if data:
+                self.__frame(data)
+            elif not self.__device.is_open:
+                break
+        self.__running = False
+        self.__put(SerialEvent(EVENT_CLOSED, eventTime=time.perf_counter()))
+
+    def __frame(self, data):
+        """
+        Adds data to the buffer and dispatches every complete line.
+        """
+        self.__buffer += data
+        end = self.__buffer.rfind(b"\n")
+        if end < 0:
+            if len(self.__buffer) > self.__maxLineLength:
+                self.__buffer.clear()
+            return
+        now = time.perf_counter()
+        for line in self.__buffer[:end].split(b"\n"):
+            line = line.strip()
+            if line:
+                self.__put(self.__parseLine(bytes(line), now))
+        del self.__buffer[:end + 1]
+
+    def __parseLine(self, line, now):
+        if line.startswith(b"ACK,"):
+            return SerialEvent(EVENT_ACK, line.decode("latin-1"), self.__parseValue(line), now)
+        if line.startswith(b"NAK,"):
+            return SerialEvent(EVENT_NAK, line.decode("latin-1"), self.__parseValue(line), now)
+        if line.startswith(b"STREAM,"):
+            return SerialEvent(EVENT_STREAM, line.decode("latin-1"), self.__parseValue(line), now)
+        # The rest are found anywhere in the line, a garbled byte before them still counts
+        if b"ESTOP_PRESSED" in line:
+            kind = EVENT_ESTOP
+        elif b"POLARGRAPH ON!" in line:
+            kind = EVENT_RESET
+        elif b"CMD_COMPLETE" in line:
+            kind = EVENT_COMPLETE
+        elif b"READY" in line:
+            kind = EVENT_READY
+        else:
+            kind = EVENT_ECHO
+        return SerialEvent(kind, line.decode("latin-1"), None, now)
+
+    def __parseValue(self, line):
+        try:
+            return int(line.split(b",")[1])
+        except (IndexError, ValueError):
+            return None
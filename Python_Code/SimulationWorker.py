@@ -0,0 +1,166 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+
+import numpy as np
+
+from Simulator import POINT_DTYPE
+
+# Stages of a simulation, in order. "render" reduces the points to the preview that is drawn.
+SIMULATION_STAGES = ("parse", "convert", "simulate", "render")
+
+# Messages from the worker process
+MESSAGE_STAGE = "stage"
+MESSAGE_DONE = "done"
+MESSAGE_FAILED = "failed"
+
+class SimulationResult:
+    """
+    A finished simulation, handed from the worker process to the GUI.
+    points -> Preview of the simulated points (POINT_DTYPE), copied out of shared memory.
+    numPoints -> Number of points simulated, the preview has fewer if they were reduced.
+    errorBound -> Max distance (mm) of the preview from the simulated path.
+    timeEstimate -> TimeEstimate of the program.
+    text -> Result for the user, with the optimization report.
+    """
+    def __init__(self, points, numPoints, errorBound, timeEstimate, text):
+        self.points = points
+        self.numPoints = numPoints
+        self.errorBound = errorBound
+        self.timeEstimate = timeEstimate
+        self.text = text
+
+class SimulationWorker:
+    """
+    Simulates a GCODE file in a seperate process, so the GUI keeps running however big the file is.
+    The worker parses, converts (polargraphCmds.txt and ArduinoCommands.txt), simulates (points.npy) and reduces the points
+    to the preview that is drawn, the same steps as GcodeControler.simulateFile() and plotPoints.preview().
+    The preview is handed back in a block of shared memory instead of being pickled through a queue.
+    Only drawing the figure is left for the GUI thread.
+
+    start(settings) -> Starts simulating with the settings of a GcodeControler (see GcodeControler.getSimulationSettings()).
+    poll() -> Returns a list of (kind, value) since the last poll, (MESSAGE_STAGE, (stage number, stage)), (MESSAGE_DONE, SimulationResult)
+              or (MESSAGE_FAILED, text). Called from the GUI thread, ex.) every mainLoop().
+    cancel() -> Stops the simulation, the worker process is ended right away.
+    isRunning() -> Returns if a simulation was started and has not finished, failed or been cancelled.
+
+    A spawned process imports this module again, not main.py, so the worker only needs what is imported here.
+    """
+    def __init__(self):
+        # "spawn" is the only start method on windows, it is used everywhere so the worker behaves the same
+        self.__context = multiprocessing.get_context("spawn")
+        self.__process = None
+        self.__messages = None
+
+    def start(self, settings):
+        self.cancel()
+        self.__messages = self.__context.Queue()
+        self.__process = self.__context.Process(target=_simulate, args=(settings, self.__messages), daemon=True)
+        self.__process.start()
+
+    def poll(self):
+        if self.__process is None:
+            return []
+        messages = []
+        if self.__readMessages(messages):
+            return messages
+
+        if not self.__process.is_alive():
+            # The result can be sent after the queue was read and before the process ended, read it again
+            self.__process.join()
+            if not self.__readMessages(messages):
+                # Ended without a result, ex.) it ran out of memory
+                messages.append((MESSAGE_FAILED, "Simulation Stopped Unexpectedly."))
+                self.__finish()
+        return messages
+
+    def cancel(self):
+        if self.__process is None:
+            return
+        self.__process.terminate()
+        self.__finish()
+
+    def isRunning(self):
+        return self.__process is not None
+
+    def __readMessages(self, messages):
+        """
+        Adds the messages waiting in the queue to messages.
+        Returns True if the simulation finished or failed, the worker is then finished.
+        """
+        while True:
+            try:
+                kind, value = self.__messages.get_nowait()
+            except queue.Empty:
+                return False
+            if kind == MESSAGE_DONE:
+                value = self.__readResult(*value)
+            messages.append((kind, value))
+            if kind in (MESSAGE_DONE, MESSAGE_FAILED):
+                self.__finish()
+                return True
+
+    def __finish(self):
+        self.__process.join()
+        # A result sent just before the process was cancelled, or after it failed, is never read
+        try:
+            while True:
+                kind, value = self.__messages.get_nowait()
+                if kind == MESSAGE_DONE:
+                    self.__releaseMemory(value[0])
+        except queue.Empty:
+            pass
+        self.__messages.close()
+        self.__process = None
+        self.__messages = None
+
+    def __readResult(self, memoryName, numPreview, numPoints, errorBound, timeEstimate, text):
+        """
+        Copies the preview out of shared memory and frees it.
+        """
+        memory = shared_memory.SharedMemory(name=memoryName)
+        try:
+            points = np.ndarray((numPreview,), dtype=POINT_DTYPE, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+            memory.unlink()
+        return SimulationResult(points, numPoints, errorBound, timeEstimate, text)
+
+    def __releaseMemory(self, memoryName):
+        try:
+            memory = shared_memory.SharedMemory(name=memoryName)
+        except FileNotFoundError:
+            return
+        memory.close()
+        memory.unlink()
+
+def _simulate(settings, messages):
+    """
+    Runs in the worker process. Sends (MESSAGE_STAGE, (number, stage)) as each stage starts, then
+    (MESSAGE_DONE, (shared memory name, preview size, points simulated, error bound, TimeEstimate, text)) or (MESSAGE_FAILED, text).
+    """
+    # Only imported in the worker, the GUI process doesn't need them for a simulation
+    from GcodeControl import GcodeControler
+    from PlotPoints import plotPoints
+
+    def onStage(stage):
+        messages.put((MESSAGE_STAGE, (SIMULATION_STAGES.index(stage) + 1, stage)))
+
+    try:
+        gcodeControl = GcodeControler(None, None)
+        gcodeControl.applySimulationSettings(settings)
+        result, text = gcodeControl.simulateFile(onStage)
+        if not result:
+            messages.put((MESSAGE_FAILED, text))
+            return
+
+        onStage("render")
+        points, timeEstimate = gcodeControl.getSimulation()
+        preview, errorBound = plotPoints(None).preview(points)
+        memory = shared_memory.SharedMemory(create=True, size=max(preview.nbytes, 1))
+        np.ndarray(preview.shape, dtype=POINT_DTYPE, buffer=memory.buf)[:] = preview
+        # The GUI unlinks it once it copied the preview
+        memory.close()
+        messages.put((MESSAGE_DONE, (memory.name, len(preview), len(points), errorBound, timeEstimate, text)))
+    except Exception as e:
+        messages.put((MESSAGE_FAILED, f"Simulation Failed. {e}"))
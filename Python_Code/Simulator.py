@@ -0,0 +1,292 @@
+import numpy as np
+
+from GcodeProgram import (OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW, OP_MOVE_RELATIVE,
+                          OP_ABSOLUTE, OP_RELATIVE)
+
+# One row for each position the plotter moves to. pen is 1 if the pen is down while moving to the point.
+POINT_DTYPE = np.dtype([
+    ("x", np.float64),
+    ("y", np.float64),
+    ("pen", np.uint8),
+])
+
+# These match the defines in pos.ino
+# distance the firmware moves between interpolated positions (mm)
+INTERPOLATION_DISTANCE = 0.05
+# mm, max machine location from home
+MAX_POS_X = 600.0
+MAX_POS_Y = 800.0 # negative distance from home ex. 800 checks if Y>-800
+
+# Kinds of movement, used to generate the points of every command at once (see PolargraphSimulator.moves())
+MOVE_NONE = 0
+MOVE_DIRECT = 1
+MOVE_LINEAR = 2
+MOVE_ARC_CW = 3
+MOVE_ARC_CCW = 4
+
+class PolargraphSimulator:
+    """
+    Simulates the firmware moving through a GcodeProgram and returns every position it moves to.
+    It follows the interpolation in pos.ino (LinearInterpolation, CircularInterpolationCW/CCW),
+    including the INTERPOLATION_DISTANCE step, relative/absolute coordinates and checkValidPosition.
+    Commands with an invalid end position are skipped, like on the plotter.
+    The positions of all commands are generated at once with NumPy.
+
+    simulate(program) -> Returns a structured array of points (see POINT_DTYPE).
+    moves(program) -> Returns the kind of move (MOVE_*) of every command and the number of steps of every arc.
+    """
+    def __init__(self):
+        # Max number of points generated at once, limits the size of temporary arrays
+        self.__blockPoints = 1 << 22
+
+    def simulate(self, program):
+        commands = program.commands
+        kind, startX, startY, endX, endY = self.__resolveMoves(commands)
+
+        arcs = self.__arcs(kind, commands, startX, startY, endX, endY)
+        numPoints = self.__numPoints(kind, startX, startY, endX, endY, arcs[0])
+        pointEnds = np.cumsum(numPoints)
+        total = int(pointEnds[-1]) if len(pointEnds) else 0
+        points = np.zeros(total, dtype=POINT_DTYPE)
+
+        # Points are made a block of commands at a time so the temporary arrays stay small
+        firstCommand = 0
+        while firstCommand < len(commands):
+            pointStart = int(pointEnds[firstCommand] - numPoints[firstCommand])
+            # Always take at least one command, even if it has more than __blockPoints points
+            lastCommand = int(np.searchsorted(pointEnds, pointStart + self.__blockPoints, side='right'))
+            lastCommand = max(lastCommand, firstCommand + 1)
+            block = np.arange(firstCommand, lastCommand)
+            pointEnd = int(pointEnds[lastCommand - 1])
+            self.__blockPointsFill(points[pointStart:pointEnd], block, kind, commands, startX, startY, endX, endY, numPoints, arcs)
+            firstCommand = lastCommand
+
+        return points
+
+    def moves(self, program):
+        """
+        Returns (kind, arcSteps), arrays with one value for each command.
+        kind is the MOVE_* the firmware does for the command, MOVE_NONE if it does not move.
+        arcSteps is the number of interpolated steps of each arc, 0 for other commands.
+        """
+        commands = program.commands
+        kind, startX, startY, endX, endY = self.__resolveMoves(commands)
+        arcSteps = self.__arcs(kind, commands, startX, startY, endX, endY)[0]
+        return kind, arcSteps
+
+    def __blockPointsFill(self, points, block, kind, commands, startX, startY, endX, endY, numPoints, arcs):
+        """
+        Generates the points of the commands in block, into points.
+        """
+        blockNumPoints = numPoints[block]
+        if len(points) == 0:
+            return
+        # For every point, the command it belongs to and its index within that command
+        commandIndex = np.repeat(block, blockNumPoints)
+        offsets = np.cumsum(blockNumPoints) - blockNumPoints
+        local = np.arange(len(points)) - np.repeat(offsets, blockNumPoints)
+        # The last point of every command is always the end position
+        isLast = (local == (numPoints[commandIndex] - 1))
+
+        x = endX[commandIndex]
+        y = endY[commandIndex]
+
+        self.__linearPoints(x, y, kind, commandIndex, local, isLast, startX, startY, endX, endY, numPoints)
+        self.__arcPoints(x, y, kind, commandIndex, local, isLast, commands, startX, startY, arcs)
+
+        points["x"] = x
+        points["y"] = y
+        points["pen"] = commands["pen"][commandIndex]
+
+    def __resolveMoves(self, commands):
+        """
+        Finds the start and end position of every command, and which kind of move it is.
+        Commands that are not moves, or are skipped because their end is invalid, are MOVE_NONE.
+        """
+        ops = commands["op"]
+        hasRelative = np.any((ops == OP_RELATIVE) | (ops == OP_MOVE_RELATIVE))
+        if hasRelative:
+            return self.__resolveMovesLoop(commands)
+        return self.__resolveMovesAbsolute(commands)
+
+    def __resolveMovesAbsolute(self, commands):
+        """
+        Every target is an absolute position, so this can be done without a loop.
+        Each command starts where the last valid move before it ended.
+        """
+        ops = commands["op"]
+        num = len(commands)
+        endX = commands["x"].astype(np.float64)
+        endY = commands["y"].astype(np.float64)
+
+        kind = np.zeros(num, dtype=np.uint8)
+        kind[ops == OP_RAPID] = MOVE_DIRECT
+        kind[ops == OP_LINEAR] = MOVE_LINEAR
+        kind[ops == OP_ARC_CW] = MOVE_ARC_CW
+        kind[ops == OP_ARC_CCW] = MOVE_ARC_CCW
+        with np.errstate(invalid='ignore'):
+            kind[~self.__validPositions(endX, endY)] = MOVE_NONE
+        isMove = kind != MOVE_NONE
+
+        # Index of the last move up to and including each command, -1 if there is none
+        lastMove = np.maximum.accumulate(np.where(isMove, np.arange(num), -1))
+        # The start of each command is the end of the last move before it
+        previousMove = np.concatenate(([-1], lastMove[:-1]))
+        hasPrevious = previousMove >= 0
+        startX = np.where(hasPrevious, endX[np.maximum(previousMove, 0)], 0.0)
+        startY = np.where(hasPrevious, endY[np.maximum(previousMove, 0)], 0.0)
+
+        return kind, startX, startY, endX, endY
+
+    def __resolveMovesLoop(self, commands):
+        """
+        Same as __resolveMovesAbsolute() but handles relative coordinates, which need the position after every command.
+        """
+        num = len(commands)
+        kind = np.zeros(num, dtype=np.uint8)
+        startX = np.zeros(num)
+        startY = np.zeros(num)
+        endX = np.zeros(num)
+        endY = np.zeros(num)
+        moveKinds = {OP_RAPID: MOVE_DIRECT, OP_LINEAR: MOVE_LINEAR, OP_ARC_CW: MOVE_ARC_CW, OP_ARC_CCW: MOVE_ARC_CCW}
+
+        currentXpos = 0.0
+        currentYpos = 0.0
+        relativeCoords = False
+        ops = commands["op"].tolist()
+        xs = commands["x"].tolist()
+        ys = commands["y"].tolist()
+        for index in range(num):
+            op = ops[index]
+            startX[index] = currentXpos
+            startY[index] = currentYpos
+            if op == OP_ABSOLUTE:
+                relativeCoords = False
+                continue
+            elif op == OP_RELATIVE:
+                relativeCoords = True
+                continue
+            elif op == OP_MOVE_RELATIVE:
+                # C05 always moves relative to the current position
+                X = currentXpos + xs[index]
+                Y = currentYpos + ys[index]
+                moveKind = MOVE_DIRECT
+            elif op in moveKinds:
+                X = xs[index]
+                Y = ys[index]
+                if relativeCoords:
+                    X += currentXpos
+                    Y += currentYpos
+                moveKind = moveKinds[op]
+            else:
+                continue
+
+            if not self.__validPosition(X, Y):
+                continue
+            kind[index] = moveKind
+            endX[index] = X
+            endY[index] = Y
+            currentXpos = X
+            currentYpos = Y
+
+        return kind, startX, startY, endX, endY
+
+    def __numPoints(self, kind, startX, startY, endX, endY, arcSteps):
+        """
+        Number of points each command moves through, including its end position.
+        """
+        numPoints = np.zeros(len(kind), dtype=np.int64)
+        numPoints[kind == MOVE_DIRECT] = 1
+
+        linear = kind == MOVE_LINEAR
+        travelDis = np.hypot(endX[linear] - startX[linear], endY[linear] - startY[linear])
+        numSteps = (travelDis/INTERPOLATION_DISTANCE).astype(np.int64)
+        # Steps 1 to numSteps-1, then the end position
+        numPoints[linear] = np.maximum(numSteps - 1, 0) + 1
+
+        arc = (kind == MOVE_ARC_CW) | (kind == MOVE_ARC_CCW)
+        # Steps 1 to numSteps, then the end position
+        numPoints[arc] = arcSteps[arc] + 1
+        return numPoints
+
+    def __arcs(self, kind, commands, startX, startY, endX, endY):
+        """
+        Matches CircularInterpolationCW_PreCalc() and CircularInterpolationCCW_PreCalc().
+        Returns arrays of numSteps, interpolationAng, startAng and radius, the values are 0 for commands that are not arcs.
+        """
+        num = len(kind)
+        numSteps = np.zeros(num, dtype=np.int64)
+        interpolationAng = np.zeros(num)
+        startAng = np.zeros(num)
+        radius = np.zeros(num)
+        arc = (kind == MOVE_ARC_CW) | (kind == MOVE_ARC_CCW)
+        if not np.any(arc):
+            return numSteps, interpolationAng, startAng, radius
+
+        twoPi = 2*np.pi
+        I = commands["i"][arc]
+        J = commands["j"][arc]
+        disX = endX[arc] - startX[arc]
+        disY = endY[arc] - startY[arc]
+
+        arcRadius = np.hypot(disX - I, disY - J)
+        # atan2 returns -PI to PI, change to 0 to 2PI
+        arcStart = np.mod(np.arctan2(-J, -I), twoPi)
+        arcEnd = np.mod(np.arctan2(disY - J, disX - I), twoPi)
+        arcLength = np.where(kind[arc] == MOVE_ARC_CW, arcStart - arcEnd, arcEnd - arcStart)
+        arcLength = np.where(arcLength < 0, arcLength + twoPi, arcLength)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arcAng = INTERPOLATION_DISTANCE/arcRadius
+            steps = np.floor(arcLength/arcAng)
+        # Avoids divide by zero, and an arc that starts and ends in the same place is not drawn
+        noArc = (arcRadius < 1e-9) | ((np.abs(disX) < 1e-9) & (np.abs(disY) < 1e-9))
+        steps = np.where(noArc | ~np.isfinite(steps), 0, steps)
+
+        numSteps[arc] = steps.astype(np.int64)
+        interpolationAng[arc] = np.where(noArc, 0, arcAng)
+        startAng[arc] = arcStart
+        radius[arc] = arcRadius
+        return numSteps, interpolationAng, startAng, radius
+
+    def __linearPoints(self, x, y, kind, commandIndex, local, isLast, startX, startY, endX, endY, numPoints):
+        """
+        Fills in the points between the start and end of each linear move.
+        """
+        mask = (kind[commandIndex] == MOVE_LINEAR) & ~isLast
+        if not np.any(mask):
+            return
+        cmd = commandIndex[mask]
+        # numPoints = numSteps for linear moves with more than one point
+        fraction = (local[mask] + 1)/numPoints[cmd]
+        x[mask] = (endX[cmd] - startX[cmd])*fraction + startX[cmd]
+        y[mask] = (endY[cmd] - startY[cmd])*fraction + startY[cmd]
+
+    def __arcPoints(self, x, y, kind, commandIndex, local, isLast, commands, startX, startY, arcs):
+        """
+        Fills in the points around each arc.
+        """
+        pointKind = kind[commandIndex]
+        mask = ((pointKind == MOVE_ARC_CW) | (pointKind == MOVE_ARC_CCW)) & ~isLast
+        if not np.any(mask):
+            return
+        cmd = commandIndex[mask]
+        numSteps, interpolationAng, startAng, radius = arcs
+        step = local[mask] + 1
+        direction = np.where(kind[cmd] == MOVE_ARC_CW, -1.0, 1.0)
+        angle = startAng[cmd] + direction*step*interpolationAng[cmd]
+        x[mask] = startX[cmd] + np.cos(angle)*radius[cmd] + commands["i"][cmd]
+        y[mask] = startY[cmd] + np.sin(angle)*radius[cmd] + commands["j"][cmd]
+
+    def __validPositions(self, X, Y):
+        """
+        Vectorized checkValidPosition(). The firmware checks a float, so the values are rounded to float32 first.
+        """
+        X = X.astype(np.float32)
+        Y = Y.astype(np.float32)
+        return (X >= 0) & (X <= MAX_POS_X) & (Y <= 0) & (Y >= -MAX_POS_Y)
+
+    def __validPosition(self, X, Y):
+        X = float(np.float32(X))
+        Y = float(np.float32(Y))
+        return (0 <= X <= MAX_POS_X) and (-MAX_POS_Y <= Y <= 0)
@@ -0,0 +1,322 @@
+import math
+
+import numpy as np
+
+from GcodeProgram import GcodeProgram, OP_RAPID, OP_ARC_CW, OP_ARC_CCW, OP_PAUSE, OP_MOVE_RELATIVE, OP_PEN_DOWN, OP_PEN_UP
+
+class StrokeOrderer:
+    """
+    Reorders the strokes of a program so the pen travels less while it is up.
+    A stroke is everything from a pen down (C10) to the next pen up (C11). Strokes are put in nearest neighbour order,
+    found with a grid of stroke ends, then improved with 2-opt. A stroke is drawn backwards when that is shorter,
+    as long as it only has moves in it. The pen up moves between strokes become one G00 to the start of the next stroke,
+    other commands between strokes stay in the same place. A pause (G04) is never moved past, strokes are only
+    reordered between pauses. Programs with relative moves are not changed.
+
+    twoOptWindow -> Number of strokes after each stroke that 2-opt tries to reverse the order of.
+    maxPasses -> Max number of 2-opt passes over the strokes.
+
+    A 2-opt pass finds the best reversal after every stroke at once with NumPy, then makes the ones that don't overlap.
+
+    order(program) -> Returns (reordered GcodeProgram, pen up travel before in mm, pen up travel after in mm).
+    """
+    def __init__(self, twoOptWindow=40, maxPasses=8):
+        self.__twoOptWindow = twoOptWindow
+        self.__maxPasses = maxPasses
+        # 2-opt stops when a pass would make the travel less than this fraction shorter
+        self.__minPassGain = 0.002
+        # Offsets of the grid cells in each ring around the pen, after the last ring every stroke that is left is checked
+        maxSearchRing = 3
+        self.__rings = [[(dx, dy) for dx in range(-ring, ring + 1) for dy in range(-ring, ring + 1)
+                         if max(abs(dx), abs(dy)) == ring] for ring in range(maxSearchRing + 1)]
+
+    def order(self, program):
+        travelBefore = program.travelDistance()
+        commands = program.commands
+        ops = commands["op"]
+        if len(ops) == 0 or program.relativeMode().any() or (ops == OP_MOVE_RELATIVE).any():
+            return program, travelBefore, travelBefore
+
+        # Strokes start where the pen goes down and end where it goes up again
+        penBefore = np.concatenate(([0], commands["pen"][:-1]))
+        starts = np.flatnonzero((ops == OP_PEN_DOWN) & (penBefore == 0))
+        ups = np.flatnonzero((ops == OP_PEN_UP) & (penBefore == 1))
+        # A last stroke that never lifts the pen stays at the end with everything after it
+        starts = starts[starts < ups[-1]] if len(ups) else starts[:0]
+        ends = ups[np.searchsorted(ups, starts)]
+        numStrokes = len(starts)
+        if numStrokes < 2:
+            return program, travelBefore, travelBefore
+
+        x, y = program.positions()
+        # The pen is at the start of a stroke when it goes down, and at the end when it goes up
+        startX, startY = x[starts], y[starts]
+        endX, endY = x[ends], y[ends]
+        # Strokes with only moves between the pen down and pen up can be drawn backwards
+        isMove = ops <= OP_ARC_CCW
+        numMoves = np.cumsum(isMove)
+        reversible = (numMoves[ends] - numMoves[starts]) == (ends - starts - 1)
+
+        # Commands between strokes, the pen is up there. Pauses split the strokes into groups that are ordered on their own.
+        gapStarts = np.concatenate(([0], ends + 1))
+        gapEnds = np.concatenate((starts, [len(ops)]))
+        isPause = ops == OP_PAUSE
+        numPauses = np.concatenate(([0], np.cumsum(isPause)))
+        group = np.cumsum(numPauses[gapEnds[:-1]] - numPauses[gapStarts[:-1]] > 0)
+
+        # The travel before the first stroke is replaced too, so the pen starts from home
+        penX, penY = 0.0, 0.0
+        tour = []
+        flipped = []
+        for groupStart, groupEnd in self.__groupRanges(group):
+            strokes = np.arange(groupStart, groupEnd)
+            orderInGroup, flippedInGroup = self.__nearestNeighbour(penX, penY, startX[strokes], startY[strokes],
+                                                                   endX[strokes], endY[strokes], reversible[strokes])
+            orderInGroup, flippedInGroup = self.__twoOpt(penX, penY, startX[strokes], startY[strokes],
+                                                         endX[strokes], endY[strokes], reversible[strokes],
+                                                         orderInGroup, flippedInGroup)
+            tour.append(strokes[orderInGroup])
+            flipped.append(flippedInGroup)
+            last = strokes[orderInGroup[-1]]
+            if flippedInGroup[-1]:
+                penX, penY = float(startX[last]), float(startY[last])
+            else:
+                penX, penY = float(endX[last]), float(endY[last])
+        tour = np.concatenate(tour)
+        flipped = np.concatenate(flipped)
+
+        reordered = GcodeProgram(self.__build(commands, x, y, starts, ends, gapStarts, gapEnds, tour, flipped))
+        travelAfter = reordered.travelDistance()
+        # Keep the original order if it was already better, 2-opt only works on straight line distances
+        if travelAfter >= travelBefore:
+            return program, travelBefore, travelBefore
+        return reordered, travelBefore, travelAfter
+
+    def __groupRanges(self, group):
+        changes = np.flatnonzero(np.diff(group)) + 1
+        bounds = np.concatenate(([0], changes, [len(group)]))
+        return zip(bounds[:-1].tolist(), bounds[1:].tolist())
+
+    def __nearestNeighbour(self, penX, penY, startX, startY, endX, endY, reversible):
+        """
+        Greedy order, always goes to the closest end of a stroke that is not drawn yet.
+        The ends are put in a grid so only the cells around the pen are searched.
+        Returns the order of the strokes and if each one is drawn backwards.
+        """
+        numStrokes = len(startX)
+        # Entry i < numStrokes is the start of stroke i, numStrokes + i is its end
+        pointX = np.concatenate((startX, endX))
+        pointY = np.concatenate((startY, endY))
+        pointXList = pointX.tolist()
+        pointYList = pointY.tolist()
+
+        used = bytearray(numStrokes)
+        order = []
+        flipped = []
+        remaining = np.flatnonzero(np.concatenate((np.ones(numStrokes, dtype=bool), reversible)))
+        grid = self.__buildGrid(remaining, pointX, pointY)
+        gridSize = len(remaining)
+        for step in range(numStrokes):
+            # The grid is made again with bigger cells as it empties, so there are always ends close to the pen
+            if 8*(numStrokes - step) < gridSize:
+                remaining = self.__unused(remaining, used, numStrokes)
+                grid = self.__buildGrid(remaining, pointX, pointY)
+                gridSize = len(remaining)
+            best = self.__searchGrid(grid, pointXList, pointYList, penX, penY)
+            if best < 0:
+                # Nothing close by, check every stroke end that is left
+                remaining = self.__unused(remaining, used, numStrokes)
+                distances = (pointX[remaining] - penX)**2 + (pointY[remaining] - penY)**2
+                best = int(remaining[np.argmin(distances)])
+            if best < numStrokes:
+                stroke = best
+                penX, penY = pointXList[stroke + numStrokes], pointYList[stroke + numStrokes]
+            else:
+                stroke = best - numStrokes
+                penX, penY = pointXList[stroke], pointYList[stroke]
+            used[stroke] = 1
+            # Both ends of the stroke are taken out of the grid
+            cells, _, _, _, cellOf = grid
+            for entry in (stroke, stroke + numStrokes):
+                key = cellOf.get(entry)
+                if key is not None:
+                    cells[key].remove(entry)
+            order.append(stroke)
+            flipped.append(best >= numStrokes)
+        return np.array(order, dtype=np.int64), np.array(flipped, dtype=bool)
+
+    def __buildGrid(self, entries, pointX, pointY):
+        """
+        Returns (cells, minX, minY, cellSize, cellOf), cells is a dict of (column, row) -> list of the stroke ends in that cell,
+        cellOf is a dict of stroke end -> (column, row).
+        """
+        entryX = pointX[entries]
+        entryY = pointY[entries]
+        minX, minY = float(entryX.min()), float(entryY.min())
+        area = max(float(entryX.max()) - minX, 1e-3)*max(float(entryY.max()) - minY, 1e-3)
+        # About two stroke ends in each cell
+        cellSize = max(math.sqrt(2*area/len(entries)), 1e-3)
+        cellX = ((entryX - minX)//cellSize).astype(np.int64)
+        cellY = ((entryY - minY)//cellSize).astype(np.int64)
+        cells = {}
+        cellOf = {}
+        for entry, cx, cy in zip(entries.tolist(), cellX.tolist(), cellY.tolist()):
+            cells.setdefault((cx, cy), []).append(entry)
+            cellOf[entry] = (cx, cy)
+        return cells, minX, minY, cellSize, cellOf
+
+    def __unused(self, entries, used, numStrokes):
+        strokeOf = np.where(entries < numStrokes, entries, entries - numStrokes)
+        return entries[np.frombuffer(used, dtype=np.uint8)[strokeOf] == 0]
+
+    def __searchGrid(self, grid, pointX, pointY, penX, penY):
+        """
+        Returns the closest stroke end in the grid, searching rings of cells around the pen. -1 if none are close.
+        """
+        cells, minX, minY, cellSize, _ = grid
+        gridX = (penX - minX)/cellSize
+        gridY = (penY - minY)/cellSize
+        centerX = math.floor(gridX)
+        centerY = math.floor(gridY)
+        # Distance from the pen to the closest side of its cell
+        edge = min(gridX - centerX, centerX + 1 - gridX, gridY - centerY, centerY + 1 - gridY)*cellSize
+        best = -1
+        bestDistance = math.inf
+        for ring, offsets in enumerate(self.__rings):
+            for dx, dy in offsets:
+                entries = cells.get((centerX + dx, centerY + dy))
+                if not entries:
+                    continue
+                for entry in entries:
+                    distance = (pointX[entry] - penX)**2 + (pointY[entry] - penY)**2
+                    if distance < bestDistance:
+                        best = entry
+                        bestDistance = distance
+            # Every end outside the rings searched so far is at least this far away
+            if best >= 0 and bestDistance <= (edge + ring*cellSize)**2:
+                return best
+        return -1
+
+    def __twoOpt(self, penX, penY, startX, startY, endX, endY, reversible, order, flipped):
+        """
+        Reverses runs of up to twoOptWindow strokes in the order (which draws each of them backwards too)
+        when that makes the travel shorter. A run of one stroke just draws it backwards.
+        Runs with a stroke that can't be drawn backwards are not reversed.
+        """
+        numStrokes = len(order)
+        # Index 0 is the pen before the first stroke, it is never moved
+        order = np.concatenate(([0], order))
+        flipped = np.concatenate(([False], flipped))
+        startX = np.concatenate(([penX], startX))
+        startY = np.concatenate(([penY], startY))
+        endX = np.concatenate(([penX], endX))
+        endY = np.concatenate(([penY], endY))
+        blocked = np.concatenate(([1], ~reversible)).astype(np.int64)
+        order[1:] += 1
+
+        for _ in range(self.__maxPasses):
+            # Where each stroke in the order is drawn from and to
+            toX = np.where(flipped, endX[order], startX[order])
+            toY = np.where(flipped, endY[order], startY[order])
+            fromX = np.where(flipped, startX[order], endX[order])
+            fromY = np.where(flipped, startY[order], endY[order])
+            numBlocked = np.cumsum(blocked[order])
+
+            # Best j for every i, reversing strokes i+1 to j changes the travel i -> i+1 and j -> j+1.
+            # travel[k] is k -> k+1, there is no travel after the last stroke
+            travel = np.concatenate((np.hypot(toX[1:] - fromX[:-1], toY[1:] - fromY[:-1]), [0.0]))
+            paddedToX = np.concatenate((toX, [0.0]))
+            paddedToY = np.concatenate((toY, [0.0]))
+            bestGain = np.zeros(numStrokes)
+            bestJ = np.zeros(numStrokes, dtype=np.int64)
+            for length in range(1, min(self.__twoOptWindow, numStrokes) + 1):
+                # i from 0 to numStrokes - length, j = i + length
+                num = numStrokes - length + 1
+                old = travel[:num] + travel[length:length + num]
+                new = np.hypot(fromX[length:length + num] - fromX[:num], fromY[length:length + num] - fromY[:num])
+                afterJ = np.hypot(paddedToX[length + 1:length + 1 + num] - toX[1:num + 1],
+                                  paddedToY[length + 1:length + 1 + num] - toY[1:num + 1])
+                afterJ[-1] = 0.0
+                gain = old - new - afterJ
+                gain[numBlocked[length:length + num] != numBlocked[:num]] = 0.0
+                better = gain > bestGain[:num]
+                bestGain[:num][better] = gain[better]
+                bestJ[:num][better] = np.flatnonzero(better) + length
+
+            # Make the best reversals first, skipping any that overlap one already made
+            candidates = np.flatnonzero(bestGain > 1e-9)
+            # Stop when a pass would only make the travel slightly shorter
+            if len(candidates) == 0 or bestGain.sum() < self.__minPassGain*travel.sum():
+                break
+            candidates = candidates[np.argsort(-bestGain[candidates], kind="stable")]
+            touched = bytearray(numStrokes + 2)
+            for first, last in zip(candidates.tolist(), bestJ[candidates].tolist()):
+                if any(touched[first:last + 2]):
+                    continue
+                touched[first:last + 2] = b"\x01"*(last + 2 - first)
+                segment = slice(first + 1, last + 1)
+                order[segment] = order[segment][::-1].copy()
+                flipped[segment] = ~flipped[segment][::-1]
+        return order[1:] - 1, flipped[1:]
+
+    def __build(self, commands, x, y, starts, ends, gapStarts, gapEnds, tour, flipped):
+        """
+        Puts the program back together in the new order.
+        Each gap keeps the commands that are not moves, then gets a G00 to the start of the next stroke.
+        """
+        num = len(commands)
+        ops = commands["op"]
+        isMove = ops <= OP_ARC_CCW
+        # Every command drawn backwards, a move goes back to where the command before it started
+        backwards = commands.copy()
+        previousX = np.concatenate(([0.0], x[:-1]))
+        previousY = np.concatenate(([0.0], y[:-1]))
+        backwards["x"] = np.where(isMove, previousX, commands["x"])
+        backwards["y"] = np.where(isMove, previousY, commands["y"])
+        isArc = (ops == OP_ARC_CW) | (ops == OP_ARC_CCW)
+        # The center of an arc stays the same, so I and J are from the other end
+        backwards["i"] = np.where(isArc, previousX + commands["i"] - x, commands["i"])
+        backwards["j"] = np.where(isArc, previousY + commands["j"] - y, commands["j"])
+        backwards["op"] = np.where(ops == OP_ARC_CW, OP_ARC_CCW, np.where(ops == OP_ARC_CCW, OP_ARC_CW, ops))
+
+        # One travel move to the start of each stroke, in the order they are drawn
+        travel = np.zeros(len(tour), dtype=commands.dtype)
+        travel["op"] = OP_RAPID
+        travel["x"] = np.where(flipped, x[ends[tour]], x[starts[tour]])
+        travel["y"] = np.where(flipped, y[ends[tour]], y[starts[tour]])
+        for column in ("i", "j", "z", "f"):
+            travel[column] = np.nan
+        travel["pen"] = 0
+        travel["line"] = commands["line"][starts[tour]]
+        table = np.concatenate((commands, backwards, travel))
+
+        # The k-th piece is the commands in gap k that are not moves, the travel move, then the k-th stroke drawn
+        notMove = np.flatnonzero(~isMove)
+        firstNotMove = np.searchsorted(notMove, gapStarts[:-1])
+        numNotMoves = np.searchsorted(notMove, gapEnds[:-1]) - firstNotMove
+        strokeLength = ends[tour] - starts[tour] + 1
+        pieceStarts = np.concatenate(([0], np.cumsum(numNotMoves + 1 + strokeLength)[:-1]))
+        numPieceRows = int(pieceStarts[-1] + numNotMoves[-1] + 1 + strokeLength[-1])
+        # Everything after the last stroke stays as it was
+        postamble = np.arange(gapStarts[-1], num)
+        indices = np.empty(numPieceRows + len(postamble), dtype=np.int64)
+
+        indices[self.__ranges(pieceStarts, numNotMoves)] = notMove[self.__ranges(firstNotMove, numNotMoves)]
+        indices[pieceStarts + numNotMoves] = 2*num + np.arange(len(tour))
+        strokeRows = self.__ranges(pieceStarts + numNotMoves + 1, strokeLength)
+        step = self.__ranges(np.zeros_like(strokeLength), strokeLength)
+        start = np.repeat(starts[tour], strokeLength)
+        end = np.repeat(ends[tour], strokeLength)
+        # A stroke drawn backwards keeps its pen down and pen up, the moves between come backwards from the end
+        backwardsRow = np.where(step == 0, start, np.where(start + step == end, end, num + end - step))
+        indices[strokeRows] = np.where(np.repeat(flipped, strokeLength), backwardsRow, start + step)
+        indices[numPieceRows:] = postamble
+        return table[indices]
+
+    def __ranges(self, firsts, counts):
+        """
+        Concatenated aranges, firsts[k] to firsts[k] + counts[k] for every k.
+        """
+        total = int(counts.sum())
+        pieceStarts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return np.repeat(firsts - pieceStarts, counts) + np.arange(total)
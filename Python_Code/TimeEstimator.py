@@ -0,0 +1,143 @@
+import numpy as np
+
+from GcodeProgram import OP_PAUSE
+from Simulator import PolargraphSimulator, MOVE_LINEAR, MOVE_ARC_CW, MOVE_ARC_CCW
+
+# These match the defines in pos.ino, stepper.ino and penlift.ino
+STEPS_PER_LENGTH = 10.0 # steps for every 1mm of belt length
+HOME_OFFSET_X = 47.3    # home position distance from center of left stepper motor
+HOME_OFFSET_Y = 47.3
+STEPPERM_X_DIS = 665.0  # distance between stepper motor center axles
+MAX_EVER_SPEED = 1000.0 # steps/sec at 100% speed
+SEGMENT_END_DELAY = 0.002 # delay(2) after the last step of a linear move or arc, and after the first step of an arc
+PEN_UP_POSITION = 55    # servo angles
+PEN_DOWN_POSITION = 145
+PEN_LIFT_SPEED = 0.003  # seconds between steps of moving servo
+
+class TimeEstimate:
+    """
+    Estimated time of a program in seconds, split into the phases the plotter spends its time on.
+    drawing -> Moving with the pen down.
+    travel -> Moving with the pen up.
+    pen -> Moving the pen servo up and down.
+    comms -> Sending commands over USB and waiting for replies.
+    """
+    def __init__(self, drawing=0.0, travel=0.0, pen=0.0, comms=0.0):
+        self.drawing = drawing
+        self.travel = travel
+        self.pen = pen
+        self.comms = comms
+
+    def total(self):
+        return self.drawing + self.travel + self.pen + self.comms
+
+    def totalMinutes(self):
+        return self.total()/60
+
+    def summary(self):
+        """
+        Short description of the estimate in minutes, ex.) for a plot title.
+        """
+        return (f"Estimated time {self.totalMinutes():.2f} minutes "
+                f"(drawing {self.drawing/60:.2f}, travel {self.travel/60:.2f}, pen {self.pen/60:.2f}, comms {self.comms/60:.2f}).")
+
+class PrintTimeEstimator:
+    """
+    Estimates how long a program takes to run on the plotter, following what the firmware does for every position.
+    Each position is turned into motor steps with calcMotorPos(), both motors step at the same constant speed
+    (speed/100*1000 steps/sec, no acceleration), so a position takes as long as the motor with more steps.
+    The firmware also has a delay(2) at the end of every linear move and arc (and after the first arc step),
+    every pen move is a servo sweep of PEN_LIFT_SPEED per degree, and every command has a serial handshake.
+
+    estimate(program, points, speed) -> Returns a TimeEstimate for a GcodeProgram and the points simulated from it.
+    """
+    def __init__(self):
+        # Rough time for the firmware to calculate one position (software floating point on a 16MHz AVR).
+        # A position never takes less than this, even if the motors only move one step.
+        self.__positionTime = 0.0002
+        # Each command is sent, echoed back, confirmed with CHECKED, then the device sends RUNNING and CMD_COMPLETE.
+        # That is about three USB round trips, each waits at least one 1ms USB frame.
+        self.__commandRoundTrips = 3
+        self.__usbLatency = 0.001
+        # Bytes sent both ways for one command and its replies, and the serial baud rate
+        self.__commandBytes = 100
+        self.__baudRate = 1000000
+        # Max number of positions worked on at once
+        self.__blockSize = 1 << 20
+
+    def estimate(self, program, points, speed, moves=None):
+        """
+        program is the GcodeProgram that was simulated, points are the positions PolargraphSimulator generated from it.
+        speed is the plotter speed (1-100%). moves is the result of PolargraphSimulator.moves(program), it is
+        found again if it is not given.
+        Either program or points can be None, then that part of the estimate is left out.
+        """
+        estimate = TimeEstimate()
+        if points is not None and len(points) > 0:
+            estimate.drawing, estimate.travel = self.__moveTimes(points, speed)
+        if program is not None and len(program) > 0:
+            estimate.pen = self.__penTime(program)
+            estimate.comms = self.__commsTime(program)
+            if moves is None:
+                moves = PolargraphSimulator().moves(program)
+            kind, arcSteps = moves
+            # delay(2) after the last step of every linear move and arc, and after the first step of an arc
+            isArc = (kind == MOVE_ARC_CW) | (kind == MOVE_ARC_CCW)
+            numDelays = (kind == MOVE_LINEAR).astype(np.int64) + isArc + (isArc & (arcSteps > 0))
+            penDown = program.commands["pen"] == 1
+            estimate.drawing += int(np.sum(numDelays[penDown]))*SEGMENT_END_DELAY
+            estimate.travel += int(np.sum(numDelays[~penDown]))*SEGMENT_END_DELAY
+        return estimate
+
+    def calcMotorPos(self, X, Y):
+        """
+        Vectorized calcMotorPos() from pos.ino. Returns the left and right motor positions in steps.
+        """
+        # Invert Y axis to simplify calculation
+        Y = -np.asarray(Y, dtype=np.float64) + HOME_OFFSET_Y
+        X = np.asarray(X, dtype=np.float64) + HOME_OFFSET_X
+        # round() in C rounds halves away from zero, the lengths are never negative
+        L = np.floor(np.sqrt(X*X + Y*Y)*STEPS_PER_LENGTH + 0.5)
+        X_RBL = STEPPERM_X_DIS - X
+        R = np.floor(np.sqrt(X_RBL*X_RBL + Y*Y)*STEPS_PER_LENGTH + 0.5)
+        return L, R
+
+    def __moveTimes(self, points, speed):
+        """
+        Time moving to every position, split into pen down (drawing) and pen up (travel).
+        The plotter starts at home.
+        """
+        stepsPerSecond = (speed/100)*MAX_EVER_SPEED
+        drawing = 0.0
+        travel = 0.0
+        previousL, previousR = self.calcMotorPos(0.0, 0.0)
+        for start in range(0, len(points), self.__blockSize):
+            block = points[start:start + self.__blockSize]
+            L, R = self.calcMotorPos(block["x"], block["y"])
+            stepsL = np.abs(np.diff(L, prepend=previousL))
+            stepsR = np.abs(np.diff(R, prepend=previousR))
+            steps = np.maximum(stepsL, stepsR)
+            # A position with no steps is skipped by movePositionDirect(), it still has to be calculated
+            times = np.maximum(steps/stepsPerSecond, self.__positionTime)
+            penDown = block["pen"] == 1
+            drawing += float(np.sum(times[penDown]))
+            travel += float(np.sum(times[~penDown]))
+            previousL = L[-1]
+            previousR = R[-1]
+        return drawing, travel
+
+    def __penTime(self, program):
+        """
+        The servo only moves when the pen changes state, the pen starts up.
+        """
+        pen = program.commands["pen"]
+        numPenMoves = int(np.count_nonzero(np.diff(pen, prepend=0) != 0))
+        sweepTime = (PEN_DOWN_POSITION - PEN_UP_POSITION + 1)*PEN_LIFT_SPEED
+        return numPenMoves*sweepTime
+
+    def __commsTime(self, program):
+        # Pauses are not sent to the plotter
+        numCommands = int(np.count_nonzero(program.commands["op"] != OP_PAUSE))
+        # 10 bits are sent for every byte
+        commandTime = self.__commandRoundTrips*self.__usbLatency + self.__commandBytes*10/self.__baudRate
+        return numCommands*commandTime
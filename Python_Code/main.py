@@ -1,5 +1,9 @@
 from Comms import USBComm
 from GcodeControl import GcodeControler
+from ProgressChannel import ProgressChannel
+from CommandDispatcher import CommandDispatcher
+from SimulationWorker import SimulationWorker, SIMULATION_STAGES, MESSAGE_STAGE, MESSAGE_DONE
+from PlotPoints import plotPoints
 
 import customtkinter as tk
 
@@ -7,6 +11,7 @@ import sys
 import os
 import keyboard
 import threading
+import multiprocessing
 from queue import Queue
 import time
 
@@ -18,11 +23,12 @@ class GCODE_Controller_GUI(tk.CTk):
     comms Class (uses pyserial) and the keyboard class work differently and require permissions 
     in a linux environment.
     USBComm handles the communication with the USB device using pyserial.
+    CommandDispatcher sends the commands of the manual controls from its own thread, so the GUI does not wait on the device.
     GcodeControler can open .ngc and .txt file and process the GCODE commands as well as simualte them.
 
     Funtion Descriptions:
     # REGION mainLoop (not app.mainloop())
-    mainLoop() -> Runs every mainLoopUpdate ms. Handles keyboard input, updating the userFeedbackLabel, and handling unexpected shutdown of GCODE thread.
+    mainLoop() -> Runs every mainLoopUpdate ms. Handles keyboard input, updating the userFeedbackLabel, the simulation worker and handling unexpected shutdown of GCODE thread.
     
     # REGION GUI Controls
     menuSetup() -> Creates all of the customtkinter widgets and sets their callback functions.
@@ -30,8 +36,13 @@ class GCODE_Controller_GUI(tk.CTk):
     # REGION Gcode Commands Files
     playStopGcodeCall() -> Callback for playStopGcodeBtn. Starts or stops the GCODE file run thread. If the thread stops on it's own, that is handled in the main loop.
     pauseResumeGcodeCall() -> Callback for btn.
+    resumeRunCall() -> Callback for resumeRunBtn. Resumes the last GCODE file run that stopped before it finished (reset, ESTOP, lost connection or stopped).
     gcodeThreadIsActive() -> Determines if the GCODE thread is currently running.
-    simulateGcodeCallback() -> Callback for simulateGcodeBtn.
+    startAfterCommands(start) -> Disables the menu and calls start() once the manual commands already queued are done, ex.) to start a GCODE run.
+    updatePendingStart() -> Calls the waiting start() when the manual commands are done, called by mainLoop().
+    cancelPendingStart() -> Drops a start() that is still waiting, returns if there was one.
+    simulateGcodeCallback() -> Callback for simulateGcodeBtn. Starts simulating the file in a worker process, or cancels the simulation if one is running.
+    updateSimulation() -> Shows the stage of a running simulation and plots it when it is done, called by mainLoop().
     
     # REGION GCODE Individual Commands
     There are simlar functions for a single command, except that you cannot pause a single command.
@@ -42,8 +53,8 @@ class GCODE_Controller_GUI(tk.CTk):
 
     # REGION Individual Buttons/controls
     There are a lot of callbacks for individual buttons and controls. Many are self-explanitory and not described here.
-    keyboardMovementInput() -> This collects info about if arrow keys / spacebar are pressed and calls the respective functions for movment if they are.
-    Arrow keys move the x/y axis of the plotter, the spacebar moves the pen up/down.
+    keyboardMovementInput() -> This collects info about if arrow keys / spacebar are pressed and starts/stops moving or switches the pen.
+    Arrow keys move the x/y axis of the plotter for as long as they are held, the spacebar moves the pen up/down.
 
     # REGION Disable/Enable User Control
     These two functions disable/enable all widgets except for simulation and GCODE file run control. 
@@ -79,24 +90,61 @@ class GCODE_Controller_GUI(tk.CTk):
         self.inAbsoluteCoords = True 
         # Flag used to 
         self.penSwitchedSpacebar = False
+        # (directionX, directionY, speed) of the jog while arrow keys are held, None when none are
+        self.keyboardJog = None
         # Secondary way to stop commands while GCODE commands are running
         self.stopCommands = False 
         # GCODE Thread flag used in mainLoop to automatically detect if thread was stopped
         self.gcodeThreadRan = False
         # Holds the thread for running gcode commands
         self.gcodeThread = None
+        # Starts the GCODE run (or resumes it) once the manual commands queued before it are done, see startAfterCommands()
+        self.pendingStart = None
+        self.pendingStartTime = 0.0
+        self.pendingStartReported = False
+        # Seconds before the user is told the manual commands are still running
+        self.commandsIdleTimeout = 30.0
+        # Seconds to wait for a manual command to finish before the port is changed
+        self.changePortWaitTime = 2.0
+        # Simulates files in a seperate process, see updateSimulation()
+        self.simulation = SimulationWorker()
 
         # Queue of strings used to update the user feedback label.
         self.userFeedbackQueue = Queue()
         self.__userFeedbackLabelMaxCharsLine = 80
-        self.percentageQueue = Queue()
+        # Latest progress of a GCODE run and the last command sent, only the latest is kept so it never grows
+        self.progress = ProgressChannel()
 
         #set up communications
-        self.ArduinoComms = USBComm(self.userFeedbackQueue)
+        # Number of commands sent ahead while a file runs, used if the device supports streaming
+        self.commandWindow = 8
+        # Send streamed commands as binary frames (opcode, params in 0.1mm, CRC) if the device supports them
+        self.binaryFrames = False
+        self.ArduinoComms = USBComm(self.userFeedbackQueue, self.commandWindow, self.binaryFrames, self.progress)
         self.portStrList, self.portList = self.ArduinoComms.getPortsDesciptions()
+        # Sends the commands of the manual controls without blocking the GUI, superseded speeds and jogs are dropped
+        self.commands = CommandDispatcher(self.ArduinoComms, self.userFeedbackQueue)
 
         #Set up Gcode Control
-        self.gcodeControl = GcodeControler(self.ArduinoComms, self.percentageQueue)
+        self.gcodeControl = GcodeControler(self.ArduinoComms, self.progress)
+        # The optimizations below change the commands that are drawn, so they are off unless turned on here.
+        # With any of them on the whole file is parsed before it runs, otherwise it is streamed as it is read.
+        # Runs of G01 moves that follow a circle to within this distance (mm) are sent as one arc, 0 sends them as they are
+        self.arcTolerance = 0
+        self.gcodeControl.setArcTolerance(self.arcTolerance)
+        # Pen down G01 moves are simplified to within this distance (mm) before they are simulated or sent, 0 sends them as they are
+        self.simplifyTolerance = 0
+        self.gcodeControl.setSimplifyTolerance(self.simplifyTolerance)
+        # Strokes are reordered so the pen travels less while it is up
+        self.reorderStrokes = False
+        self.gcodeControl.setReorderStrokes(self.reorderStrokes)
+        # Strokes that end at the same motor position as the next starts are drawn without lifting the pen, and with a
+        # tolerance (mm) so are strokes that end that close, which draws up to that much more. None always lifts it
+        self.joinTolerance = None
+        self.gcodeControl.setJoinTolerance(self.joinTolerance)
+        # Runs of G01 moves are sent as one batch command (C18) per few moves, the plotter needs firmware with C18
+        self.batchMoves = False
+        self.gcodeControl.setBatchMoves(self.batchMoves)
 
         #Create a grid where menu items will be place
         self.grid = Grid(self, 5, 5)
@@ -126,6 +174,8 @@ class GCODE_Controller_GUI(tk.CTk):
                 self.enableMenu()
                 self.gcodeThreadRan = False
 
+        self.updatePendingStart()
+        self.updateSimulation()
         self.updateTextLabels()
 
         # calls mainloop function again after ms
@@ -186,8 +236,9 @@ class GCODE_Controller_GUI(tk.CTk):
         #Column 1 -> Up Movement
         self.moveUpBtn = tk.CTkButton(self, text="Move Up", command=self.moveUp,)                    
         self.moveUpBtn.grid(row=3, column=1, rowspan=1, columnspan=1, padx=self.padx, sticky="ew")
-        #Column 2
-        # Empty(self, 3, 2)
+        #Column 2 -> Resume a GCODE file run that stopped
+        self.resumeRunBtn = tk.CTkButton(self, text="Resume\nLast Run", command=self.resumeRunCall,)                    
+        self.resumeRunBtn.grid(row=3, column=2, rowspan=1, columnspan=1, padx=self.padx, sticky="ew")
         #Column 3 -> Enable/Disable Arrow Keys and spacebar
         self.manualCtrlBtn = tk.CTkButton(self, text="Enable/Disable\nArrows&Spacebar", font=('Arial',10), command=self.enabledDisableKeyboard,)                    
         self.manualCtrlBtn.grid(row=3, column=3, rowspan=1, columnspan=1, padx=4, sticky="ew")
@@ -223,10 +274,11 @@ class GCODE_Controller_GUI(tk.CTk):
         self.speedSlider.grid(row=5, column=3, rowspan=1, columnspan=2, padx=self.padx, sticky="ew")
 
     def updateTextLabels(self):
-        curCmd = None
+        # Show the last command sent, messages in the queue below are shown over it
+        curCmd = self.progress.pollCommand()
         first = True #Used to grab the most recent item from the queue, 
         # don't want the last item in the queue
-        # Update the user feedback with the current command
+        # Update the user feedback with the current message
         while not self.userFeedbackQueue.empty():
             if first:
                 curCmd = self.userFeedbackQueue.get()
@@ -241,24 +293,22 @@ class GCODE_Controller_GUI(tk.CTk):
                 curCmd[self.__userFeedbackLabelMaxCharsLine:]
             self.userFeedbackLabel.configure(text=curCmd)
 
-        #Update percentage label
-        curCmd = None
-        first = True
-        while not self.percentageQueue.empty():
-            if first:
-                curCmd = self.percentageQueue.get()
-            else:
-                self.percentageQueue.get()
-
-        # Only update if a command was actually added
-        if not (curCmd is None):
-            self.percentageLabel.configure(text=curCmd)
+        #Update percentage, rate and ETA label
+        progress = self.progress.poll()
+        # Only update if the progress changed
+        if not (progress is None):
+            self.percentageLabel.configure(text=progress.text())
 
     # REGION Gcode Commands Files
     def playStopGcodeCall(self):
         """
         Callback for playStopGcodeBtn. Starts or stops the Gcode thread.
         """
+        # A run that is waiting for the manual commands is stopped before it starts
+        if self.cancelPendingStart() and not self.gcodeThreadIsActive():
+            self.userFeedbackQueue.put("GCODE run cancelled.")
+            self.enableMenu()
+            return
         if not self.gcodeThreadIsActive():
             # Try to update the gcode file
             result, output = self.gcodeControl.setGcodeFile(self.getGcodeFileLocEntry.get())
@@ -266,9 +316,7 @@ class GCODE_Controller_GUI(tk.CTk):
                 self.userFeedbackQueue.put(output)
                 return
             if self.ArduinoComms.testConnection():
-                self.gcodeThread = threading.Thread(target=self.gcodeControl.runGcode)
-                self.gcodeThread.start()
-                self.disableMenu()
+                self.startAfterCommands(lambda: self.startGcodeThread(self.gcodeControl.runGcode))
         else:
             print("Stopping Gcode.")
             self.gcodeControl.stopGcode()
@@ -285,14 +333,64 @@ class GCODE_Controller_GUI(tk.CTk):
         """
         if self.gcodeThreadIsActive():
             if self.gcodeControl.isGcodePaused():
-                self.gcodeControl.resumeGcode()
-                self.disableMenu()
+                # Manual commands sent while paused are done before the run carries on
+                self.startAfterCommands(self.gcodeControl.resumeGcode)
             else:
                 self.gcodeControl.pauseGcode()
                 time.sleep(0.01) # allow program to pause in edge case
                 self.userFeedbackQueue.put("Paused.\nAllow Current Command to Finish.")
                 self.enableMenu()
 
+    def resumeRunCall(self):
+        """
+        Callback for resumeRunBtn. Runs the last GCODE file from the last command the plotter completed.
+        """
+        if self.gcodeThreadIsActive() or self.pendingStart is not None:
+            return
+        result, output = self.gcodeControl.getResumableJob()
+        self.userFeedbackQueue.put(output)
+        if not result:
+            return
+        if self.ArduinoComms.testConnection():
+            self.startAfterCommands(lambda: self.startGcodeThread(self.gcodeControl.resumeJob))
+
+    def startGcodeThread(self, target):
+        self.gcodeThread = threading.Thread(target=target)
+        self.gcodeThread.start()
+
+    def startAfterCommands(self, start):
+        """
+        The device runs commands in order, so manual commands already queued (ex.) a move home) have to be done
+        before a GCODE run uses it. Waiting here would freeze the GUI for the whole move, so start() is called
+        by mainLoop() once the dispatcher is idle. Stop cancels it.
+        """
+        self.disableMenu()
+        self.pendingStart = start
+        self.pendingStartTime = time.perf_counter()
+        self.pendingStartReported = False
+        self.updatePendingStart()
+        if self.pendingStart is not None:
+            self.userFeedbackQueue.put("Waiting for manual commands to finish...")
+
+    def updatePendingStart(self):
+        if self.pendingStart is None:
+            return
+        if self.commands.waitUntilIdle(0):
+            start = self.pendingStart
+            self.pendingStart = None
+            start()
+        elif not self.pendingStartReported and time.perf_counter() - self.pendingStartTime > self.commandsIdleTimeout:
+            # ex.) the device stopped answering
+            self.pendingStartReported = True
+            self.userFeedbackQueue.put("Manual commands have not finished.\nPress Stop to cancel the GCODE run.")
+
+    def cancelPendingStart(self):
+        if self.pendingStart is None:
+            return False
+        self.pendingStart = None
+        self.commands.clear()
+        return True
+
     def gcodeThreadIsActive(self):
         """
         Check the state of the GCODE thread safely
@@ -310,40 +408,44 @@ class GCODE_Controller_GUI(tk.CTk):
         """
         Callback for simulateGcodeBtn widget.
         """
+        if self.simulation.isRunning():
+            self.simulation.cancel()
+            self.simulateGcodeBtn.configure(text="Sim Gcode")
+            self.userFeedbackQueue.put("Simulation Cancelled.")
+            return
+
         #Set filename
-        # Try to update the gcode file\
+        # Try to update the gcode file
         result, output = self.gcodeControl.setGcodeFile(self.getGcodeFileLocEntry.get())
         if not result:
             self.userFeedbackQueue.put(output)
             return
         
         numLines = self.gcodeControl.countLinesReadlines()
-        # Update label text while in callback. Processing file can take some time.
-        self.userFeedbackLabel.configure(text=f"Processing {numLines} Lines...")
-        self.update()
-        
-        #Attempt to parse file
-        successBool, resultText = self.gcodeControl.generateCommandsFile()
-        if not successBool:
-            self.userFeedbackQueue.put(resultText)
-            return
-        
-        #Attempt to parse file
-        successBool, resultText = self.gcodeControl.generateArduinoCommands()
-        if not successBool:
-            self.userFeedbackQueue.put(resultText)
-            return
+        self.userFeedbackQueue.put(f"Processing {numLines} Lines...")
+        # Parsing, converting and simulating the file happen in a seperate process, the GUI keeps running
+        self.simulation.start(self.gcodeControl.getSimulationSettings())
+        self.simulateGcodeBtn.configure(text="Cancel Sim")
 
-        #Attempt to generate points
-        successBool, resultText = self.gcodeControl.generatePoints()
-        if not successBool:
-            self.userFeedbackQueue.put(resultText)
-            return
-        #Attempt to plot points and get predicted time
-        successBool, resultText = self.gcodeControl.plotPoints()
-        if not successBool:
-            self.userFeedbackQueue.put(resultText)
-        self.userFeedbackQueue.put("Simulation Complete.")
+    def updateSimulation(self):
+        """
+        Shows the stage of a running simulation, and plots it when it is done.
+        """
+        for kind, value in self.simulation.poll():
+            if kind == MESSAGE_STAGE:
+                number, stage = value
+                self.userFeedbackQueue.put(f"Simulating {number}/{len(SIMULATION_STAGES)}: {stage.capitalize()}...")
+                continue
+            self.simulateGcodeBtn.configure(text="Sim Gcode")
+            if kind != MESSAGE_DONE:
+                self.userFeedbackQueue.put(value)
+                continue
+            # Only drawing the figure happens here, the points were already reduced by the worker
+            pointPlotter = plotPoints(None, value.points, value.numPoints, value.errorBound)
+            successBool, resultText = pointPlotter.plotPoints(value.timeEstimate)
+            if not successBool:
+                self.userFeedbackQueue.put(resultText)
+            self.userFeedbackQueue.put(value.text)
 
     # REGION GCODE Individual Commands
     def simulateCmdCallback(self):
@@ -374,7 +476,7 @@ class GCODE_Controller_GUI(tk.CTk):
         """
         command = self.getCmdEntry.get()
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(command)
+            self.commands.submit(command)
 
     def comSelectCallback(self, choice):
         """
@@ -397,6 +499,11 @@ class GCODE_Controller_GUI(tk.CTk):
         if index == -1:
             return
 
+        # Commands queued for the old port are not sent to the new one
+        self.commands.clear()
+        if not self.commands.waitUntilIdle(self.changePortWaitTime):
+            # Ending the connection makes the command that is running fail
+            self.userFeedbackQueue.put("Manual command did not finish, changing port anyway.")
         self.ArduinoComms.endComm()
         self.userFeedbackLabel.configure(text="Starting machine...")
         self.update()
@@ -406,11 +513,13 @@ class GCODE_Controller_GUI(tk.CTk):
     # REGION Individual Buttons/controls
     def setHome(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand("C16")
+            self.commands.submit("C16")
     
     def moveHome(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand("C06")
+            # Jogs and speeds still waiting would be done after the move home
+            self.commands.clear()
+            self.commands.submit("C06")
             #  Set GUI to match how the USB device was change to home
             self.gcodeControl.setPenIsUp()
             self.gcodeControl.setSpeed(self.defaultSpeed)
@@ -419,11 +528,12 @@ class GCODE_Controller_GUI(tk.CTk):
     def speedSliderCallback(self, speed):
         self.gcodeControl.setSpeed(speed)
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C07,{int(speed)}")
+            # Only the latest speed of a slider drag is sent
+            self.commands.submit(f"C07,{int(speed)}", key="speed")
 
     def switchUpDownPen(self):
         if not self.stopCommands:
-            self.gcodeControl.switchPen()
+            self.commands.submit(self.gcodeControl.switchPen)
 
     def enabledDisableKeyboard(self):
         """
@@ -431,15 +541,18 @@ class GCODE_Controller_GUI(tk.CTk):
         """
         if not self.stopCommands:
             self.keyboardEnabled = (not self.keyboardEnabled)
+            if not self.keyboardEnabled:
+                self.commands.stopJog()
+                self.keyboardJog = None
 
     def coordsSwitch(self):
         if not self.stopCommands:
             if self.inAbsoluteCoords:
                 self.inAbsoluteCoords = False
-                self.ArduinoComms.sendSingleCommand("C91")
+                self.commands.submit("C91")
             else:
                 self.inAbsoluteCoords = True
-                self.ArduinoComms.sendSingleCommand("C90")
+                self.commands.submit("C90")
 
     def keyboardMovementInput(self):
         upArrow = keyboard.is_pressed('up')
@@ -448,31 +561,22 @@ class GCODE_Controller_GUI(tk.CTk):
         leftArrow = keyboard.is_pressed('left')
         spacebar = keyboard.is_pressed('space')
 
-        if(upArrow and leftArrow):
-            print("Up/Left")
-            self.moveUpLeft()
-        elif(upArrow and rightArrow):
-            print("Up/Right")
-            self.moveUpRight()
-        elif(downArrow and leftArrow):
-            print("Down/Left")
-            self.moveDownLeft()
-        elif(downArrow and rightArrow):
-            print("Down/Right")
-            self.moveDownRight()
-        elif(upArrow):
-            print("Up")
-            self.moveUp()
-        elif(downArrow):
-            print("Down")
-            self.moveDown()
-        elif(leftArrow):
-            print("Left")
-            self.moveLeft()
-        elif(rightArrow):
-            print("Right")
-            self.moveRight()
-        elif(spacebar):
+        # The plotter keeps moving while the arrow keys are held, see CommandDispatcher.startJog()
+        directionX = int(rightArrow) - int(leftArrow)
+        directionY = int(upArrow) - int(downArrow)
+        jog = None
+        if (directionX != 0 or directionY != 0) and not self.stopCommands:
+            jog = (directionX, directionY, self.gcodeControl.getSpeed())
+        if jog != self.keyboardJog:
+            if jog is None:
+                print("Stop Moving")
+                self.commands.stopJog()
+            else:
+                print(f"Moving {directionX},{directionY}")
+                self.commands.startJog(*jog)
+            self.keyboardJog = jog
+
+        if(spacebar and not (upArrow or downArrow or leftArrow or rightArrow)):
             print("Switch Pen")
             if not self.penSwitchedSpacebar:
                 self.switchUpDownPen()
@@ -483,35 +587,43 @@ class GCODE_Controller_GUI(tk.CTk):
 
     def moveUp(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,0,{self.gcodeControl.getQuickDistance()}")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(0, distance)
     
     def moveDown(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,0,-{self.gcodeControl.getQuickDistance()}")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(0, -distance)
     
     def moveRight(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,{self.gcodeControl.getQuickDistance()},0")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(distance, 0)
 
     def moveLeft(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,-{self.gcodeControl.getQuickDistance()},0")    
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(-distance, 0)
     
     def moveUpRight(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,{self.gcodeControl.getQuickDistance()},{self.gcodeControl.getQuickDistance()}")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(distance, distance)
 
     def moveUpLeft(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,-{self.gcodeControl.getQuickDistance()},{self.gcodeControl.getQuickDistance()}")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(-distance, distance)
 
     def moveDownRight(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,{self.gcodeControl.getQuickDistance()},-{self.gcodeControl.getQuickDistance()}")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(distance, -distance)
 
     def moveDownLeft(self):
         if not self.stopCommands:
-            self.ArduinoComms.sendSingleCommand(f"C05,-{self.gcodeControl.getQuickDistance()},-{self.gcodeControl.getQuickDistance()}")
+            distance = self.gcodeControl.getQuickDistance()
+            self.commands.jog(-distance, -distance)
 
     # REGION Disable/Enable User Control
     def disableMenu(self):
@@ -520,6 +632,7 @@ class GCODE_Controller_GUI(tk.CTk):
         """
         self.comSelect.configure(state="disabled")
         self.runCmd.configure(state="disabled")
+        self.resumeRunBtn.configure(state="disabled")
         self.setHomeBtn.configure(state="disabled")
         self.moveUpBtn.configure(state="disabled")
         self.manualCtrlBtn.configure(state="disabled")
@@ -531,6 +644,8 @@ class GCODE_Controller_GUI(tk.CTk):
         self.moveDownBtn.configure(state="disabled")
         self.speedSlider.configure(state="disabled")
         self.stopCommands = True
+        self.commands.stopJog()
+        self.keyboardJog = None
     
     def enableMenu(self):
         """
@@ -538,6 +653,7 @@ class GCODE_Controller_GUI(tk.CTk):
         """
         self.comSelect.configure(state="normal")
         self.runCmd.configure(state="normal")
+        self.resumeRunBtn.configure(state="normal")
         self.setHomeBtn.configure(state="normal")
         self.moveUpBtn.configure(state="normal")
         self.manualCtrlBtn.configure(state="normal")
@@ -557,6 +673,8 @@ class GCODE_Controller_GUI(tk.CTk):
         """
 
         self.destroy() #End tkinter application
+        self.commands.stop()
+        self.simulation.cancel()
         
         self.ArduinoComms.endComm()
 
@@ -580,6 +698,8 @@ class Grid:
             self.root.columnconfigure(j, weight=1)
 
 if __name__ == '__main__':
+    # The simulation worker process starts this executable again when it is built with PyInstaller
+    multiprocessing.freeze_support()
     #Initializes application
     app = GCODE_Controller_GUI()
 